@@ -1,5 +1,6 @@
 import argparse
 from classes import Action, QTable, get_action_name
+from qtable_file import load_table_dict
 
 
 if __name__ == '__main__':
@@ -11,8 +12,9 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     if args.file != '':
+        # pickle（辞書のみ・メタ情報付き）とバイナリ形式（qtable_file.py）のどちらでも読み込める
         q_table = QTable(action_class=Action)
-        q_table.load(args.file)
+        q_table.table, _ = load_table_dict(args.file)
         print('State,Action,Q value')
         for k, v in sorted(q_table.table.items(), key=lambda x:(x[0][0], ORDER[x[0][1]])):
             state, action = k
@@ -26,8 +26,10 @@ except ImportError:
     HAS_MATPLOTLIB = False
 
 # --- プロジェクト共通のコンポーネント ---
-from .classes import Action, Player, get_card_info, get_action_name
+from .classes import Action, Player, get_action_name, open_dealer_socket, CARD_RANKS, CARD_VALUES
 from .config import PORT, BET, INITIAL_MONEY, N_DECKS, SHUFFLE_INTERVAL, SHUFFLE_THRESHOLD
+from .protocol import BinaryChannel
+from .dealer import LocalDealerChannel
 from mylib.utility import print_args
 from .NN_structure import BJNet
 
@@ -70,17 +72,27 @@ def initialize_card_counter():
     g_card_counter = np.full(13, initial_count, dtype=int) 
     g_total_cards_seen = 0
 
+# カードIDを直接受け取ってカウントする（文字列への変換を行わない）
+def count_card(card_id):
+    global g_total_cards_seen
+    if card_id is None:
+        return
+    rank_idx = CARD_RANKS[card_id]
+    if g_card_counter[rank_idx] > 0:
+        g_card_counter[rank_idx] -= 1
+        g_total_cards_seen += 1
+
 def update_card_counter(card_id_str):
     global g_card_counter, g_total_cards_seen
     if card_id_str == 'X' or card_id_str is None: 
         return
     
     try:
-        if isinstance(card_id_str, int):
-             rank_idx = (card_id_str % 13)
+        if isinstance(card_id_str, (int, np.integer)):
+             rank_idx = CARD_RANKS[card_id_str]
         elif card_id_str.isdigit():
              cid = int(card_id_str)
-             rank_idx = (cid % 13)
+             rank_idx = CARD_RANKS[cid]
         else:
             parts = card_id_str.split('-')
             if len(parts) < 2: return
@@ -106,24 +118,10 @@ def get_state(done=False):
     score = player.player_hand.get_score()
     n_cards = player.player_hand.length()
     
-    has_ace = False
-    raw_score_assuming_ace_is_1 = 0
-    for card_id in player.player_hand.cards:
-        rank = (card_id % 13) + 1 
-        if rank == 1:
-            has_ace = True
-            raw_score_assuming_ace_is_1 += 1
-        else:
-            raw_score_assuming_ace_is_1 += min(10, rank)
-    
-    if has_ace and (raw_score_assuming_ace_is_1 + 10 <= 21):
-        soft_hand_val = 1.0
-    else:
-        soft_hand_val = 0.0
+    soft_hand_val = 1.0 if player.player_hand.is_soft() else 0.0
 
-    if len(player.dealer_hand.cards) > 0:
-        dealer_card_id = player.dealer_hand.cards[0]
-        dealer_open_card_score = min(10, (dealer_card_id % 13) + 1)
+    if len(player.dealer_hand) > 0:
+        dealer_open_card_score = CARD_VALUES[player.dealer_hand[0]]
     else:
         dealer_open_card_score = 0
     
@@ -194,10 +192,13 @@ def train_nn():
 # === 通信関連の関数 ===
 def connect_sv(port):
     global soc
-    soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if args.inprocess:
+        soc = LocalDealerChannel() # ソケットを使わず同じプロセス内のディーラーと直接やり取りする
+        return
     try:
-        soc.connect((socket.gethostname(), port))
-        soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        soc = open_dealer_socket(socket.gethostname(), port, uds_path=args.dealer_uds)
+        if args.protocol == 'binary':
+            soc = BinaryChannel(soc) # バイナリプロトコルを提案（ディーラーが非対応ならテキストのまま）
         # print('Connected to the dealer.')
     except Exception as e:
         print(f"Failed to connect to dealer: {e}")
@@ -209,8 +210,14 @@ def game_start(game_ID=0):
     bet, money = player.set_bet()
 
 def game_end():
+    # セッションを継続するため，ゲームごとには接続を切らない
+    pass
+
+def disconnect_sv():
     global soc
-    soc.close()
+    if soc is not None:
+        soc.close()
+        soc = None
 
 def act(action):
     global player, soc, g_retry_counter
@@ -227,15 +234,15 @@ def act(action):
     try:
         if action == Action.HIT:
             pc, score, status, rate, dc = player.receive_message(dsoc=soc, get_player_card=True, get_dealer_cards=True)
-            update_card_counter(get_card_info(pc))
+            count_card(pc)
             
         elif action == Action.DOUBLE_DOWN:
             pc, score, status, rate, dc = player.receive_message(dsoc=soc, get_player_card=True, get_dealer_cards=True)
-            update_card_counter(get_card_info(pc))
+            count_card(pc)
             
         elif action == Action.RETRY:
             pc, score, status, rate, dc = player.receive_message(dsoc=soc, get_player_card=True, get_dealer_cards=True, retry_mode=True)
-            update_card_counter(get_card_info(pc))
+            count_card(pc)
             g_retry_counter += 1
             
         elif action == Action.STAND or action == Action.SURRENDER:
@@ -250,7 +257,7 @@ def act(action):
     if 'dc' in locals():
         if len(dc) > 1:
             for i in range(1, len(dc)):
-                update_card_counter(get_card_info(dc[i]))
+                count_card(dc[i])
 
     learning_reward = 0.0
     if status == 'win' or status == 'dealer_bust':
@@ -284,6 +291,9 @@ def main():
     parser.add_argument('--games', type=int, default=1000, help='num. of games to play')
     parser.add_argument('--model', '-m', default=os.path.join(MODEL_DIR, 'dqn_model.pth'), type=str, help='file path of trained model')
     parser.add_argument('--testmode', help='run without learning', action='store_true')
+    parser.add_argument('--dealer_uds', type=str, default='', help='connect to the dealer through this Unix domain socket path instead of TCP')
+    parser.add_argument('--protocol', choices=['text', 'binary'], default='text', help='wire protocol to negotiate with the dealer')
+    parser.add_argument('--inprocess', action='store_true', help='run the dealer inside this process instead of connecting through a socket')
     args_dict = print_args(parser.parse_args()) 
     args = argparse.Namespace(**args_dict) 
 
@@ -327,7 +337,11 @@ def main():
 
     for game_ID in range(1, total_games + 1):
         
-        connect_sv(PORT)
+        # 最初のゲームで接続し，2ゲーム目以降は同じ接続のまま次のゲームを要求する
+        if soc is None:
+            connect_sv(PORT)
+        else:
+            player.request_next_game(soc)
         game_start(game_ID)
         
         # 1. シャッフル確認
@@ -337,9 +351,9 @@ def main():
             
         # 2. 初期カード受信
         dc, pc1, pc2 = player.receive_init_cards(soc)
-        update_card_counter(get_card_info(dc))
-        update_card_counter(get_card_info(pc1))
-        update_card_counter(get_card_info(pc2))
+        count_card(dc)
+        count_card(pc1)
+        count_card(pc2)
              
         # 3. 状態取得
         state_tensor = get_state(done=False)
@@ -407,6 +421,7 @@ def main():
                 torch.save(nn_model.state_dict(), os.path.join(MODEL_DIR, f'dqn_model_game{game_ID}.pth'))
 
     # 終了処理
+    disconnect_sv()
     final_money = player.get_money()
     print("\n--- All games finished ---")
     print(f"Final Money: {final_money}$ (Total Profit: {final_money - initial_money}$)")
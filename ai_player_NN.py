@@ -2,13 +2,14 @@ import os
 os.environ['CUDA_DEVICE_ORDER'] = 'PCI_BUS_ID'
 import sys
 sys.path.append(os.path.abspath('..'))
-import copy
 import socket
 import argparse
 import torch
 import numpy as np
-from classes import Action, Player, get_card_info, get_action_name
+from classes import Action, Player, get_card_info, get_action_name, open_dealer_socket
 from config import PORT, BET, INITIAL_MONEY, N_DECKS
+from protocol import BinaryChannel
+from dealer import LocalDealerChannel
 from NN_structure import BJNet
 from mylib.utility import print_args
 
@@ -32,6 +33,15 @@ player = Player(initial_money=INITIAL_MONEY, basic_bet=BET)
 # ディーラーとの通信用ソケット
 soc = None
 
+# ディーラーとの通信プロトコル（'text' または 'binary'）
+g_protocol = 'text'
+
+# Unixドメインソケットで接続する場合のパス（空文字列の場合はTCPで接続）
+g_dealer_uds = ''
+
+# True の場合はソケットを使わず，同じプロセス内のディーラーと直接やり取りする
+g_inprocess = False
+
 # ニューラルネットワーク用の変数の準備
 nn_model = None
 
@@ -47,7 +57,7 @@ g_device = '' # 空文字列で初期化
 
 # ゲームを開始する
 def game_start(game_ID=0):
-    global g_retry_counter, player, soc
+    global g_retry_counter, player, soc, g_protocol, g_dealer_uds, g_inprocess
 
     print('Game {0} start.'.format(game_ID))
     print('  money: ', player.get_money(), '$')
@@ -55,10 +65,15 @@ def game_start(game_ID=0):
     # RETRY回数カウンターの初期化
     g_retry_counter = 0
 
-    # ディーラープログラムに接続する
-    soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    soc.connect((socket.gethostname(), PORT))
-    soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # ディーラープログラムに接続する（2ゲーム目以降は同じ接続のまま次のゲームを要求する）
+    if soc is None and g_inprocess:
+        soc = LocalDealerChannel()
+    elif soc is None:
+        soc = open_dealer_socket(socket.gethostname(), PORT, uds_path=g_dealer_uds)
+        if g_protocol == 'binary':
+            soc = BinaryChannel(soc) # バイナリプロトコルを提案（ディーラーが非対応ならテキストのまま）
+    else:
+        player.request_next_game(soc)
 
     # ベット
     bet, money = player.set_bet()
@@ -82,8 +97,9 @@ def game_start(game_ID=0):
     print('  current score: ', player.get_score())
 
 # 現時点での手札情報（ディーラー手札は見えているもののみ）を取得
+# 手札はコピーせず，読み出し専用のビュー（classes.HandView）を返す
 def get_current_hands():
-    return copy.deepcopy(player.player_hand), copy.deepcopy(player.dealer_hand)
+    return player.player_hand.view(), player.dealer_hand.view()
 
 # HITを実行する
 def hit():
@@ -104,7 +120,6 @@ def hit():
         for i in range(len(dc)):
             print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
         print("  dealer's score: ", player.get_dealer_score())
-        soc.close() # ディーラーとの通信をカット
         reward = player.update_money(rate=rate) # 所持金額を更新
         print('Game finished.')
         print('  result: bust')
@@ -131,9 +146,6 @@ def stand():
         print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
     print("  dealer's score: ", player.get_dealer_score())
 
-    # ゲーム終了，ディーラーとの通信をカット
-    soc.close()
-
     # 所持金額を更新
     reward = player.update_money(rate=rate)
     print('Game finished.')
@@ -163,9 +175,6 @@ def double_down():
         print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
     print("  dealer's score: ", player.get_dealer_score())
 
-    # ゲーム終了，ディーラーとの通信をカット
-    soc.close()
-
     # 所持金額を更新
     reward = player.update_money(rate=rate)
     print('Game finished.')
@@ -189,9 +198,6 @@ def surrender():
         print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
     print("  dealer's score: ", player.get_dealer_score())
 
-    # ゲーム終了，ディーラーとの通信をカット
-    soc.close()
-
     # 所持金額を更新
     reward = player.update_money(rate=rate)
     print('Game finished.')
@@ -224,7 +230,6 @@ def retry():
         for i in range(len(dc)):
             print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
         print("  dealer's score: ", player.get_dealer_score())
-        soc.close() # ディーラーとの通信をカット
         reward = player.update_money(rate=rate) # 所持金額を更新
         print('Game finished.')
         print('  result: bust')
@@ -288,11 +293,14 @@ def select_action(state):
 ### ここから処理開始 ###
 
 def main():
-    global g_retry_counter, g_device, player, soc, nn_model, action_set
+    global g_retry_counter, g_device, player, soc, nn_model, action_set, g_protocol, g_dealer_uds, g_inprocess
 
     parser = argparse.ArgumentParser(description='AI Black Jack Player (Neural Network-based)')
     parser.add_argument('--games', type=int, default=1, help='num. of games to play')
     parser.add_argument('--history', type=str, default='play_log.csv', help='filename where game history will be saved')
+    parser.add_argument('--dealer_uds', type=str, default='', help='connect to the dealer through this Unix domain socket path instead of TCP')
+    parser.add_argument('--protocol', choices=['text', 'binary'], default='text', help='wire protocol to negotiate with the dealer')
+    parser.add_argument('--inprocess', action='store_true', help='run the dealer inside this process instead of connecting through a socket')
     parser.add_argument('--model', default=os.path.join(MODEL_DIR, 'model.pth'), type=str, help='file path of trained model')
     parser.add_argument('--gpu', default=-1, type=int, help='GPU/CUDA ID (negative value indicates CPU)')
     args = print_args(parser.parse_args())
@@ -301,6 +309,9 @@ def main():
     g_device = DEVICE
 
     n_games = args['games'] + 1
+    g_protocol = args['protocol']
+    g_dealer_uds = args['dealer_uds']
+    g_inprocess = args['inprocess']
 
     # ログファイルを開く
     logfile = open(args['history'], 'w')
@@ -358,6 +369,11 @@ def main():
 
         print('')
 
+    # ディーラーとの通信をカット
+    if soc is not None:
+        soc.close()
+        soc = None
+
     # ログファイルを閉じる
     logfile.close()
 
@@ -1,4 +1,3 @@
-import copy
 import socket
 import time
 import random
@@ -6,30 +5,25 @@ import argparse
 import pickle
 import numpy as np
 import math
-from classes import Action, Strategy, QTable, Player, get_card_info, get_action_name
+from classes import Action, Strategy, QTable, DenseQTable, QStateEncoder, Player, get_card_info, get_action_name, open_dealer_socket
 from config import PORT, BET, INITIAL_MONEY, N_DECKS
+from protocol import BinaryChannel, BATCH_MAX_RETRIES
+from dealer import LocalDealerChannel
+from qtable_file import QTABLE_SUFFIX, is_qtable_file, load_qtable, write_qtable, dense_from_dict
+from shared_qtable import SharedQTable
 
 
-# RETRY関連設定 (一部CLIで上書き可)
-RETRY_MAX = 10              # 1ゲームあたりRETRY最大回数 (後で --max_retries_per_game で上書き)
+# RETRY関連設定（既定値．QLearningAgent のコンストラクタ，CLIで上書き可）
+RETRY_MAX = 10              # 1ゲームあたりRETRY最大回数 (--max_retries_per_game で上書き)
 RETRY_BUCKET_MAX = 5         # 状態に含めるRETRY回数バケットの上限
-RETRY_PENALTY_SCALE = 0.3    # ペナルティエスカレーション係数 (後で --retry_penalty_scale で上書き)
+RETRY_PENALTY_SCALE = 0.3    # ペナルティエスカレーション係数 (--retry_penalty_scale で上書き)
 
+# 一括プレイ用の方策テーブルの大きさ（スコア 0～31，手札枚数 0～11 を対象とする）
+POLICY_N_SCORES = 32
+POLICY_N_LENGTHS = 12
 
-### グローバル変数 ###
-
-# ゲームごとのRETRY回数のカウンター
-g_retry_counter = 0
-
-# プレイヤークラスのインスタンスを作成
-player = Player(initial_money=INITIAL_MONEY, basic_bet=BET)
-
-# ディーラーとの通信用ソケット
-soc = None
-g_dealer_host = 'localhost'
-
-# Q学習用のQテーブル
-q_table = QTable(action_class=Action, default_value=0)
+# 一括プレイ（--batch_eval）の結果ファイルの項目（1ゲーム1行．行動ごとのログとは別のファイルに記録する）
+BATCH_LOG_HEADER = 'init_score,first_action,status,retries,doubled,reward'
 
 # Q学習の設定値（デフォルト）
 EPS = 0.3 # ε-greedyにおけるε
@@ -42,298 +36,690 @@ EPS_DECAY_TYPE = 'linear'  # 'const'|'linear'|'exp'
 
 ### 関数 ###
 
-# ゲームを開始する
-def game_start(game_ID=0, verbose=True):
-    global g_retry_counter, player, soc, g_dealer_host
+# 配列で実現したQテーブル（状態の範囲は一括プレイ用の方策テーブルと同じ）を作成
+#   - table: 初期値とする辞書形式のQテーブル（省略時は空）
+#   - rng: 同じQ値を持つ行動からの選択に使う乱数生成器（省略時は numpy のグローバル乱数）
+def make_dense_qtable(table=None, rng=None):
+    encoder = QStateEncoder(POLICY_N_SCORES, POLICY_N_LENGTHS, RETRY_BUCKET_MAX + 1)
+    if table is None:
+        return DenseQTable(action_class=Action, default_value=0, encoder=encoder, rng=rng)
+    return DenseQTable.from_dict(table, action_class=Action, default_value=0, encoder=encoder, rng=rng)
+
+
+### Q学習エージェント ###
+
+# Q学習でプレイするエージェント
+# Qテーブル，所持金，ディーラーとの接続，RETRY回数などを全てインスタンスが保持するため，
+# 1つのプロセス（やスレッドプール）の中で複数のエージェントを同時に学習させられる
+# 1ゲームは observe（状態の取得） -> select_action（行動の選択） -> act（行動の実行） -> update（Qテーブルの更新） の繰り返しで進む
+class QLearningAgent:
+
+    # コンストラクタ
+    #   - alpha: 学習率
+    #   - gamma: 割引率
+    #   - eps_start, eps_end, eps_decay_episodes, eps_decay_type: ε-greedy の ε の初期値，最終値，減衰させるゲーム数，減衰の仕方（'const'|'linear'|'exp'）
+    #   - max_retries: 1ゲームあたりのRETRY回数の上限
+    #   - retry_penalty_scale: RETRYペナルティのエスカレーション係数
+    #   - qtable_backend: Qテーブルの実装（'dict': QTable，'dense': DenseQTable）
+    #   - rng: 行動選択（ε-greedy，ランダム行動，同じQ値の行動からの選択）に使う乱数生成器（numpy.random.Generator）
+    #          省略時は random モジュールと numpy のグローバル乱数を使う（従来の ai_player_Q.py と同じ乱数の使い方）
+    #   - engine: 'socket'（ディーラーとメッセージをやり取りする）または 'local'（組み込みのディーラーを直接操作する）
+    #   - inprocess: True の場合はソケットを使わず同じプロセス内のディーラーと直接やり取りする（engine='local' の場合は常に True）
+    #   - dealer_host, dealer_uds, protocol: ディーラーの接続先ホスト，Unixドメインソケットのパス，通信プロトコル（'text'|'binary'）
+    #   - shoe_seed, dealer_table: ディーラーに要求するシューのシードとテーブルのID（None で要求しない）
+    #   - verbose: 行動ごとの表示を行うか否か
+    def __init__(self, alpha=LEARNING_RATE, gamma=DISCOUNT_FACTOR, eps_start=EPS_START, eps_end=EPS_END, eps_decay_episodes=EPS_DECAY_EPISODES,
+                 eps_decay_type=EPS_DECAY_TYPE, max_retries=RETRY_MAX, retry_penalty_scale=RETRY_PENALTY_SCALE, qtable_backend='dict', rng=None,
+                 engine='socket', inprocess=False, dealer_host='localhost', dealer_uds='', protocol='text', shoe_seed=None, dealer_table=None, verbose=True):
+
+        # Q学習の設定値
+        self.alpha = alpha
+        self.gamma = gamma
+        self.eps_start = eps_start
+        self.eps_end = eps_end
+        self.eps_decay_episodes = max(1, eps_decay_episodes)
+        self.eps_decay_type = eps_decay_type
+
+        # RETRY関連設定
+        self.max_retries = max(0, max_retries)
+        self.retry_penalty_scale = max(0.0, retry_penalty_scale)
+
+        # 行動選択用の乱数
+        self.rng = rng
+        if rng is None:
+            self.random = np.random.rand
+            self.choice = random.choice
+        else:
+            self.random = rng.random
+            self.choice = lambda seq: seq[int(rng.integers(len(seq)))]
+
+        # Q学習用のQテーブル
+        if qtable_backend == 'dense':
+            self.q_table = make_dense_qtable(rng=rng)
+        else:
+            self.q_table = QTable(action_class=Action, default_value=0, rng=rng)
+
+        # 共有メモリ上のQテーブル（テストモードでは参照側，学習時は公開側）
+        self.shared_qtable = None
+
+        # プレイヤークラスのインスタンスを作成
+        self.player = Player(initial_money=INITIAL_MONEY, basic_bet=BET)
+        if shoe_seed is not None:
+            self.player.set_shoe_seed(shoe_seed) # 同時に動作している他のプレイヤーに関係なく同じカード列になる
+        if dealer_table is not None:
+            self.player.set_table(dealer_table)
 
-    if verbose:
-        print('Game {0} start.'.format(game_ID))
-        print('  money: ', player.get_money(), '$')
+        # ディーラーとの接続
+        self.engine = engine
+        self.inprocess = inprocess or engine == 'local'
+        self.dealer_host = dealer_host
+        self.dealer_uds = dealer_uds
+        self.protocol = protocol
+        self.soc = None # ディーラーとの通信用ソケット（または DealerChannel）
+        self.local_dealer = None # engine='local' の場合に手札を直接参照するディーラー（dealer.Dealer．操作は self.soc を通して行う）
+        self.connect_rng = random.Random() # 接続先の順番・リトライ間隔の決定用（学習用の乱数系列に影響しないよう分けておく）
 
-    # RETRY回数カウンターの初期化
-    g_retry_counter = 0
+        # ゲームごとのRETRY回数のカウンター
+        self.retry_counter = 0
+
+        # Q値最大の行動を調べた状態（保存時に，これらの状態の全ての行動の値をQテーブルに含める）
+        self.seen_states = set()
+
+        # パイプライン化（run で設定する）
+        self.pipeline_next = False # 現在のゲームの後に続けて次のゲームを行うか否か（True なら決着する行動と次ゲームの要求をまとめて送る）
+        self.next_requested = False # 次のゲームの要求を送信済みか否か
+
+        # 行動ごとの表示の有無
+        self.verbose = verbose
 
     # ディーラープログラムに接続する（ホスト優先順位 + リトライ強化 + タイムアウト）
-    max_connect_attempts = 60
-    base_hosts = [g_dealer_host, '127.0.0.1', 'localhost', socket.gethostname()]
-    # dedupe while preserving order
-    hosts_to_try = []
-    for h in base_hosts:
-        if h and h not in hosts_to_try:
-            hosts_to_try.append(h)
-    connected = False
-    last_err = None
-    for attempt in range(max_connect_attempts):
-        random.shuffle(hosts_to_try)
-        for host in hosts_to_try:
-            try:
-                s = socket.create_connection((host, PORT), timeout=2.5)
+    def connect_dealer(self):
+
+        if self.inprocess:
+            self.soc = LocalDealerChannel()
+            return
+
+        max_connect_attempts = 60
+        if self.dealer_uds:
+            # Unixドメインソケットで接続する場合はホスト名を使わない
+            hosts_to_try = ['']
+        else:
+            base_hosts = [self.dealer_host, '127.0.0.1', 'localhost', socket.gethostname()]
+            # dedupe while preserving order
+            hosts_to_try = []
+            for h in base_hosts:
+                if h and h not in hosts_to_try:
+                    hosts_to_try.append(h)
+        last_err = None
+        for attempt in range(max_connect_attempts):
+            self.connect_rng.shuffle(hosts_to_try)
+            for host in hosts_to_try:
                 try:
-                    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                except Exception:
-                    pass
-                s.settimeout(None)
-                soc = s
-                connected = True
-                break
-            except OSError as e:
-                last_err = e
-                continue
-        if connected:
-            break
-        # stagger retries to reduce thundering herd
-        time.sleep(0.15 + random.random() * 0.5)
-    if not connected:
+                    s = open_dealer_socket(host, PORT, uds_path=self.dealer_uds, timeout=2.5)
+                    if self.protocol == 'binary':
+                        self.soc = BinaryChannel(s) # バイナリプロトコルを提案（ディーラーが非対応ならテキストのまま）
+                    else:
+                        self.soc = s
+                    return
+                except OSError as e:
+                    last_err = e
+                    continue
+            # stagger retries to reduce thundering herd
+            time.sleep(0.15 + self.connect_rng.random() * 0.5)
         raise OSError(f'Failed to connect to dealer after {max_connect_attempts} attempts: {last_err}')
 
-    # ベット
-    bet, money = player.set_bet()
-    if verbose:
-        print('Action: BET')
-        print('  money: ', money, '$')
-        print('  bet: ', bet, '$')
-
-    # ディーラーから「カードシャッフルを行ったか否か」の情報を取得
-    # シャッフルが行われた場合は True が, 行われなかった場合は False が，変数 cardset_shuffled にセットされる
-    # なお，本サンプルコードではここで取得した情報は使用していない
-    cardset_shuffled = player.receive_card_shuffle_status(soc)
-    if cardset_shuffled and verbose:
-        print('Dealer said: Card set has been shuffled before this game.')
-
-    # ディーラーから初期カード情報を受信
-    dc, pc1, pc2 = player.receive_init_cards(soc)
-    if verbose:
-        print('Dealer gave cards.')
-        print('  dealer-card: ', get_card_info(dc))
-        print('  player-card 1: ', get_card_info(pc1))
-        print('  player-card 2: ', get_card_info(pc2))
-        print('  current score: ', player.get_score())
-
-# 現時点での手札情報（ディーラー手札は見えているもののみ）を取得
-def get_current_hands():
-    return copy.deepcopy(player.player_hand), copy.deepcopy(player.dealer_hand)
-
-# HITを実行する
-def hit(verbose=True):
-    global player, soc
-
-    if verbose:
-        print('Action: HIT')
-
-    # ディーラーにメッセージを送信
-    player.send_message(soc, 'hit')
-
-    # ディーラーから情報を受信
-    pc, score, status, rate, dc = player.receive_message(dsoc=soc, get_player_card=True, get_dealer_cards=True)
-    if verbose:
-        print('  player-card {0}: '.format(player.get_num_player_cards()), get_card_info(pc))
-        print('  current score: ', score)
-
-    # バーストした場合はゲーム終了
-    if status == 'bust':
+    # ディーラーとの通信をカット
+    def disconnect_dealer(self):
+        if self.soc is not None:
+            try:
+                self.soc.close()
+            except OSError:
+                pass
+            self.soc = None
+            self.local_dealer = None
+
+    # ゲームを開始する
+    def start_game(self, game_ID=0):
+        player, verbose = self.player, self.verbose
+
+        if self.engine == 'local':
+            self.start_local_game()
+            return
+
+        if verbose:
+            print('Game {0} start.'.format(game_ID))
+            print('  money: ', player.get_money(), '$')
+
+        # RETRY回数カウンターの初期化
+        self.retry_counter = 0
+
+        # ディーラープログラムに接続する（2ゲーム目以降は同じ接続のまま次のゲームを要求する）
+        if self.soc is None:
+            self.connect_dealer()
+        elif self.next_requested:
+            self.next_requested = False # 前のゲームの最後の行動と一緒に要求済み
+        else:
+            player.request_next_game(self.soc)
+
+        # ベット
+        bet, money = player.set_bet()
+        if verbose:
+            print('Action: BET')
+            print('  money: ', money, '$')
+            print('  bet: ', bet, '$')
+
+        # ディーラーから「カードシャッフルを行ったか否か」の情報を取得
+        # シャッフルが行われた場合は True が, 行われなかった場合は False が，変数 cardset_shuffled にセットされる
+        # なお，本サンプルコードではここで取得した情報は使用していない
+        cardset_shuffled = player.receive_card_shuffle_status(self.soc)
+        if cardset_shuffled and verbose:
+            print('Dealer said: Card set has been shuffled before this game.')
+
+        # ディーラーから初期カード情報を受信
+        dc, pc1, pc2 = player.receive_init_cards(self.soc)
+        if verbose:
+            print('Dealer gave cards.')
+            print('  dealer-card: ', get_card_info(dc))
+            print('  player-card 1: ', get_card_info(pc1))
+            print('  player-card 2: ', get_card_info(pc2))
+            print('  current score: ', player.get_score())
+
+    # ゲームを開始する（engine='local' 用．メッセージのやり取りと表示を行わず，ディーラーを直接操作する）
+    def start_local_game(self):
+
+        # RETRY回数カウンターの初期化
+        self.retry_counter = 0
+
+        # ベット
+        self.player.set_bet()
+
+        # 最初のゲームはプロセス内モードと同じ手順で開始し，そこで作成されたディーラーを以降も使う
+        # （シューのシードやテーブルの指定はプロセス内モードと同じように扱われる）
+        # 2ゲーム目以降もメッセージを介さずに通信路（LocalDealerChannel）のゲーム開始処理を呼び出し，テーブルの動作状況を更新する
+        if self.local_dealer is None:
+            self.connect_dealer()
+            self.player.receive_card_shuffle_status(self.soc)
+            self.local_dealer = self.soc.dealer
+        else:
+            self.soc.start_game()
+
+    # 必ずゲームが決着する行動（STAND，DOUBLE DOWN，SURRENDER）のメッセージを送信する
+    # 続けて次のゲームを行い，通信路がパイプライン化に対応している場合は，次のゲームの要求も応答を待たずにまとめて送る
+    def send_final_action(self, msg: str):
+        if self.pipeline_next and self.player.can_pipeline(self.soc):
+            self.player.send_messages(self.soc, [msg, 'next'])
+            self.next_requested = True
+        else:
+            self.player.send_message(self.soc, msg)
+
+    # 現時点での手札情報（ディーラー手札は見えているもののみ）を取得
+    # 手札はコピーせず，読み出し専用のビュー（classes.HandView）を返す
+    def get_current_hands(self):
+        return self.player.player_hand.view(), self.player.dealer_hand.view()
+
+    # HITを実行する
+    def hit(self):
+        player, soc, verbose = self.player, self.soc, self.verbose
+
         if verbose:
+            print('Action: HIT')
+
+        # ディーラーにメッセージを送信
+        player.send_message(soc, 'hit')
+
+        # ディーラーから情報を受信
+        pc, score, status, rate, dc = player.receive_message(dsoc=soc, get_player_card=True, get_dealer_cards=True)
+        if verbose:
+            print('  player-card {0}: '.format(player.get_num_player_cards()), get_card_info(pc))
+            print('  current score: ', score)
+
+        # バーストした場合はゲーム終了
+        if status == 'bust':
+            if verbose:
+                for i in range(len(dc)):
+                    print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
+                print("  dealer's score: ", player.get_dealer_score())
+            reward = player.update_money(rate=rate) # 所持金額を更新
+            if verbose:
+                print('Game finished.')
+                print('  result: bust')
+                print('  money: ', player.get_money(), '$')
+            return reward, True, status
+
+        # バーストしなかった場合は続行
+        else:
+            return 0, False, status
+
+    # STANDを実行する
+    def stand(self):
+        player, soc, verbose = self.player, self.soc, self.verbose
+
+        if verbose:
+            print('Action: STAND')
+
+        # ディーラーにメッセージを送信
+        self.send_final_action('stand')
+
+        # ディーラーから情報を受信
+        score, status, rate, dc = player.receive_message(dsoc=soc, get_dealer_cards=True)
+        if verbose:
+            print('  current score: ', score)
             for i in range(len(dc)):
                 print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
             print("  dealer's score: ", player.get_dealer_score())
-        soc.close() # ディーラーとの通信をカット
-        reward = player.update_money(rate=rate) # 所持金額を更新
+
+        # 所持金額を更新
+        reward = player.update_money(rate=rate)
         if verbose:
             print('Game finished.')
-            print('  result: bust')
+            print('  result: ', status)
             print('  money: ', player.get_money(), '$')
         return reward, True, status
 
-    # バーストしなかった場合は続行
-    else:
-        return 0, False, status
-
-# STANDを実行する
-def stand(verbose=True):
-    global player, soc
-
-    if verbose:
-        print('Action: STAND')
-
-    # ディーラーにメッセージを送信
-    player.send_message(soc, 'stand')
-
-    # ディーラーから情報を受信
-    score, status, rate, dc = player.receive_message(dsoc=soc, get_dealer_cards=True)
-    if verbose:
-        print('  current score: ', score)
-        for i in range(len(dc)):
-            print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
-        print("  dealer's score: ", player.get_dealer_score())
-
-    # ゲーム終了，ディーラーとの通信をカット
-    soc.close()
-
-    # 所持金額を更新
-    reward = player.update_money(rate=rate)
-    if verbose:
-        print('Game finished.')
-        print('  result: ', status)
-        print('  money: ', player.get_money(), '$')
-    return reward, True, status
-
-# DOUBLE_DOWNを実行する
-def double_down(verbose=True):
-    global player, soc
-
-    if verbose:
-        print('Action: DOUBLE DOWN')
-
-    # 今回のみベットを倍にする
-    bet, money = player.double_bet()
-    if verbose:
-        print('  money: ', money, '$')
-        print('  bet: ', bet, '$')
-
-    # ディーラーにメッセージを送信
-    player.send_message(soc, 'double_down')
-
-    # ディーラーから情報を受信
-    pc, score, status, rate, dc = player.receive_message(dsoc=soc, get_player_card=True, get_dealer_cards=True)
-    if verbose:
-        print('  player-card {0}: '.format(player.get_num_player_cards()), get_card_info(pc))
-        print('  current score: ', score)
-        for i in range(len(dc)):
-            print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
-        print("  dealer's score: ", player.get_dealer_score())
-
-    # ゲーム終了，ディーラーとの通信をカット
-    soc.close()
-
-    # 所持金額を更新
-    reward = player.update_money(rate=rate)
-    if verbose:
-        print('Game finished.')
-        print('  result: ', status)
-        print('  money: ', player.get_money(), '$')
-    return reward, True, status
-
-# SURRENDERを実行する
-def surrender(verbose=True):
-    global player, soc
-
-    if verbose:
-        print('Action: SURRENDER')
-
-    # ディーラーにメッセージを送信
-    player.send_message(soc, 'surrender')
-
-    # ディーラーから情報を受信
-    score, status, rate, dc = player.receive_message(dsoc=soc, get_dealer_cards=True)
-    if verbose:
-        print('  current score: ', score)
-        for i in range(len(dc)):
-            print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
-        print("  dealer's score: ", player.get_dealer_score())
-
-    # ゲーム終了，ディーラーとの通信をカット
-    soc.close()
-
-    # 所持金額を更新
-    reward = player.update_money(rate=rate)
-    if verbose:
-        print('Game finished.')
-        print('  result: ', status)
-        print('  money: ', player.get_money(), '$')
-    return reward, True, status
-
-# RETRYを実行する
-def retry(verbose=True):
-    global player, soc
-    if verbose:
-        print('Action: RETRY')
-    # エスカレートするペナルティ: base=BET/4, (1 + scale * 現在までのRETRY回数)
-    base = player.current_bet / 4.0
-    penalty = int(base * (1.0 + RETRY_PENALTY_SCALE * g_retry_counter))
-    player.consume_money(penalty)
-    if verbose:
-        print('  player-card {0} has been removed.'.format(player.get_num_player_cards()))
-        print('  money: ', player.get_money(), '$')
-    player.send_message(soc, 'retry')
-    pc, score, status, rate, dc = player.receive_message(dsoc=soc, get_player_card=True, get_dealer_cards=True, retry_mode=True)
-    if verbose:
-        print('  player-card {0}: '.format(player.get_num_player_cards()), get_card_info(pc))
-        print('  current score: ', score)
-    if status == 'bust':
+    # DOUBLE_DOWNを実行する
+    def double_down(self):
+        player, soc, verbose = self.player, self.soc, self.verbose
+
+        if verbose:
+            print('Action: DOUBLE DOWN')
+
+        # 今回のみベットを倍にする
+        bet, money = player.double_bet()
+        if verbose:
+            print('  money: ', money, '$')
+            print('  bet: ', bet, '$')
+
+        # ディーラーにメッセージを送信
+        self.send_final_action('double_down')
+
+        # ディーラーから情報を受信
+        pc, score, status, rate, dc = player.receive_message(dsoc=soc, get_player_card=True, get_dealer_cards=True)
         if verbose:
+            print('  player-card {0}: '.format(player.get_num_player_cards()), get_card_info(pc))
+            print('  current score: ', score)
             for i in range(len(dc)):
                 print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
             print("  dealer's score: ", player.get_dealer_score())
-        soc.close()
+
+        # 所持金額を更新
         reward = player.update_money(rate=rate)
         if verbose:
             print('Game finished.')
-            print('  result: bust')
+            print('  result: ', status)
             print('  money: ', player.get_money(), '$')
-        return reward - penalty, True, status
-    else:
-        return -penalty, False, status
-
-# 行動の実行
-def act(action: Action, verbose=True):
-    if action == Action.HIT:
-        return hit(verbose=verbose)
-    elif action == Action.STAND:
-        return stand(verbose=verbose)
-    elif action == Action.DOUBLE_DOWN:
-        return double_down(verbose=verbose)
-    elif action == Action.SURRENDER:
-        return surrender(verbose=verbose)
-    elif action == Action.RETRY:
-        return retry(verbose=verbose)
-    else:
-        exit()
+        return reward, True, status
+
+    # SURRENDERを実行する
+    def surrender(self):
+        player, soc, verbose = self.player, self.soc, self.verbose
+
+        if verbose:
+            print('Action: SURRENDER')
+
+        # ディーラーにメッセージを送信
+        self.send_final_action('surrender')
+
+        # ディーラーから情報を受信
+        score, status, rate, dc = player.receive_message(dsoc=soc, get_dealer_cards=True)
+        if verbose:
+            print('  current score: ', score)
+            for i in range(len(dc)):
+                print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
+            print("  dealer's score: ", player.get_dealer_score())
+
+        # 所持金額を更新
+        reward = player.update_money(rate=rate)
+        if verbose:
+            print('Game finished.')
+            print('  result: ', status)
+            print('  money: ', player.get_money(), '$')
+        return reward, True, status
+
+    # RETRYを実行する
+    def retry(self):
+        player, soc, verbose = self.player, self.soc, self.verbose
+        if verbose:
+            print('Action: RETRY')
+        # エスカレートするペナルティ: base=BET/4, (1 + scale * 現在までのRETRY回数)
+        base = player.current_bet / 4.0
+        penalty = int(base * (1.0 + self.retry_penalty_scale * self.retry_counter))
+        player.consume_money(penalty)
+        if verbose:
+            print('  player-card {0} has been removed.'.format(player.get_num_player_cards()))
+            print('  money: ', player.get_money(), '$')
+        player.send_message(soc, 'retry')
+        pc, score, status, rate, dc = player.receive_message(dsoc=soc, get_player_card=True, get_dealer_cards=True, retry_mode=True)
+        if verbose:
+            print('  player-card {0}: '.format(player.get_num_player_cards()), get_card_info(pc))
+            print('  current score: ', score)
+        if status == 'bust':
+            if verbose:
+                for i in range(len(dc)):
+                    print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
+                print("  dealer's score: ", player.get_dealer_score())
+            reward = player.update_money(rate=rate)
+            if verbose:
+                print('Game finished.')
+                print('  result: bust')
+                print('  money: ', player.get_money(), '$')
+            return reward - penalty, True, status
+        else:
+            return -penalty, False, status
+
+    # 行動を実行する（engine='local' 用．戻り値は act と同じ）
+    def local_act(self, action: Action):
+        player = self.player
+        penalty = 0
+        if action == Action.DOUBLE_DOWN:
+            player.double_bet()
+        elif action == Action.RETRY:
+            penalty = int(player.current_bet / 4.0 * (1.0 + self.retry_penalty_scale * self.retry_counter))
+            player.consume_money(penalty)
+        status, rate, _, _ = self.soc.play(action)
+        if status == 'unsettled':
+            return -penalty, False, status
+        return player.update_money(rate=rate) - penalty, True, status
+
+    # 行動の実行
+    # 戻り値は (reward, done, status) のタプル
+    #   - reward: 獲得金額（ゲーム続行中の場合は 0 , ただし RETRY を実行した場合は1回につき -BET/4 ）
+    #   - done: 終了フラグ．今回の行動によりゲームが終了したか否か（終了した場合はTrue, 続行中ならFalse）
+    #   - status: 行動実行後のプレイヤーステータス（バーストしたか否か，勝ちか負けか，などの状態を表す文字列）
+    def act(self, action: Action):
+        if self.engine == 'local':
+            if action == Action.UNDEFINED:
+                exit()
+            return self.local_act(action)
+        if action == Action.HIT:
+            return self.hit()
+        elif action == Action.STAND:
+            return self.stand()
+        elif action == Action.DOUBLE_DOWN:
+            return self.double_down()
+        elif action == Action.SURRENDER:
+            return self.surrender()
+        elif action == Action.RETRY:
+            return self.retry()
+        else:
+            exit()
+
+    ### これ以降のメソッドが重要 ###
+
+    # 現在の状態の取得
+    def observe(self):
+        if self.local_dealer is not None:
+            p_hand = self.local_dealer.player_hand
+        else:
+            p_hand, _ = self.get_current_hands()
+        score = p_hand.get_score()
+        length = p_hand.length()
+        retry_bucket = min(self.retry_counter, RETRY_BUCKET_MAX)
+        return (score, length, retry_bucket)
+
+    # 行動戦略
+    def select_action(self, state, strategy: Strategy, epsilon: float = None):
+
+        # Q値最大行動を選択する戦略
+        if strategy == Strategy.QMAX:
+            return self.q_table.get_best_action(state)
+
+        # ε-greedy
+        elif strategy == Strategy.E_GREEDY:
+            eps = EPS if epsilon is None else epsilon
+            if self.random() < eps:
+                return self.select_action(state, strategy=Strategy.RANDOM)
+            else:
+                return self.q_table.get_best_action(state)
+
+        # ランダム戦略
+        else:
+            # ランダム戦略: RETRY上限到達時は除外
+            actions = [Action.HIT, Action.STAND, Action.DOUBLE_DOWN, Action.SURRENDER]
+            if self.retry_counter < self.max_retries:
+                actions.append(Action.RETRY)
+            return self.choice(actions)
+
+    # n ゲーム目の epsilon を計算
+    def epsilon(self, n: int):
+        if self.eps_decay_type == 'const':
+            return self.eps_start
+        elif self.eps_decay_type == 'linear':
+            fraction = min(1.0, (n - 1) / float(self.eps_decay_episodes))
+            return self.eps_start + fraction * (self.eps_end - self.eps_start)
+        elif self.eps_decay_type == 'exp':
+            tau = max(1.0, self.eps_decay_episodes / 5.0)
+            return self.eps_end + (self.eps_start - self.eps_end) * math.exp(-(n - 1) / tau)
+        else:
+            return self.eps_start
+
+    # Qテーブルを更新（状態 prev_state で行動 action を実行し，報酬 reward を得て状態 state に遷移した場合）
+    def update(self, prev_state, action: Action, reward, state):
+        _, V = self.q_table.get_best_action(state, with_value=True)
+        Q = self.q_table.get_Q_value(prev_state, action) # 現在のQ値
+        Q = (1 - self.alpha) * Q + self.alpha * (reward + self.gamma * V) # 新しいQ値
+        self.q_table.set_Q_value(prev_state, action, Q) # 新しいQ値を登録
+
+    # n ゲーム目を決着までプレイする
+    #   - logfile: 行動ごとに「行動前の状態」「行動の種類」「行動結果」「獲得金額」を記録するファイル（None で記録しない）
+    #   - testmode: True の場合はQ値最大の行動を選び，Qテーブルを更新しない
+    def play_game(self, n: int, logfile=None, testmode=False):
 
+        # 共有メモリのQテーブルに新しい世代が公開されていれば切り替える
+        if testmode and self.shared_qtable is not None and self.shared_qtable.refresh():
+            self.q_table = self.shared_qtable.q_table
 
-### これ以降の関数が重要 ###
+        # nゲーム目を開始
+        self.start_game(n)
 
-# 現在の状態の取得
-def get_state():
-    p_hand, _ = get_current_hands()
-    score = p_hand.get_score()
-    length = p_hand.length()
-    retry_bucket = min(g_retry_counter, RETRY_BUCKET_MAX)
-    return (score, length, retry_bucket)
+        # 「現在の状態」を取得
+        state = self.observe()
 
-# 行動戦略
-def select_action(state, strategy: Strategy, epsilon: float = None):
-    global q_table
+        # エピソードごとの epsilon を計算
+        current_eps = self.epsilon(n)
 
-    # Q値最大行動を選択する戦略
-    if strategy == Strategy.QMAX:
-        return q_table.get_best_action(state)
+        while True:
 
-    # ε-greedy
-    elif strategy == Strategy.E_GREEDY:
-        eps = EPS if epsilon is None else epsilon
-        if np.random.rand() < eps:
-            return select_action(state, strategy=Strategy.RANDOM)
+            # 次に実行する行動を選択
+            if testmode:
+                action = self.select_action(state, Strategy.QMAX)
+            else:
+                action = self.select_action(state, Strategy.E_GREEDY, epsilon=current_eps)
+            if self.retry_counter >= self.max_retries and action == Action.RETRY:
+                action = self.choice([Action.HIT, Action.STAND, Action.DOUBLE_DOWN, Action.SURRENDER])
+            action_name = get_action_name(action) # 行動名を表す文字列を取得
+
+            # 選択した行動を実際に実行
+            reward, done, status = self.act(action)
+            self.seen_states.add(state)
+
+            # 実行した行動がRETRYだった場合はRETRY回数カウンターを1増やす
+            if action == Action.RETRY:
+                self.retry_counter += 1
+
+            # 「現在の状態」を再取得
+            prev_state = state # 行動前の状態を別変数に退避
+            state = self.observe()
+
+            # Qテーブルを更新
+            if not testmode:
+                self.update(prev_state, action, reward, state)
+                self.seen_states.add(state)
+
+            # ログファイルに「行動前の状態」「行動の種類」「行動結果」「獲得金額」などの情報を記録
+            if logfile is not None:
+                print('{},{},{},{},{},{}'.format(prev_state[0], prev_state[1], prev_state[2], action_name, status, reward), file=logfile)
+
+            # 終了フラグが立った場合はnゲーム目を終了
+            if done == True:
+                break
+
+        if self.verbose and self.engine != 'local':
+            print('')
+
+    # n_games 回のゲームをプレイする（引数の意味は play_game と同じ）
+    #   - publish_interval: 学習時，共有メモリのQテーブルを公開している場合に新しい世代を公開する間隔（ゲーム数）
+    def run(self, n_games: int, logfile=None, testmode=False, publish_interval=100):
+        for n in range(1, n_games + 1):
+            self.pipeline_next = n < n_games
+            self.play_game(n, logfile, testmode)
+
+            # 学習中のQテーブルを共有メモリに公開
+            if not testmode and self.shared_qtable is not None and n % publish_interval == 0:
+                self.publish_shared_qtable()
+
+    # Qテーブルから一括プレイ用の方策テーブル（状態 -> Q値最大の行動コード）を作成
+    # Q値最大の行動が一意に定まらない状態（未学習の状態など）には 0 を入れ，ディーラー側でランダムに選択させる
+    def make_policy_table(self):
+        q_table = self.q_table
+        if isinstance(q_table, DenseQTable):
+            return q_table.greedy_policy()
+        policy = np.zeros((POLICY_N_SCORES, POLICY_N_LENGTHS, RETRY_BUCKET_MAX + 1), dtype=np.uint8)
+        actions = [a for a in Action if a != Action.UNDEFINED]
+        for score in range(POLICY_N_SCORES):
+            for length in range(POLICY_N_LENGTHS):
+                for bucket in range(RETRY_BUCKET_MAX + 1):
+                    state = (score, length, bucket)
+                    if not any((state, a) in q_table.table for a in actions):
+                        continue
+                    q = [q_table.get_Q_value(state, a) for a in actions]
+                    best = max(q)
+                    best_actions = [a for a, v in zip(actions, q) if v == best]
+                    if len(best_actions) == 1:
+                        policy[score, length, bucket] = best_actions[0].value
+        return policy
+
+    # Q値最大の行動を選択する戦略で，n_games 回のゲームをディーラー内で一括プレイする
+    # 行動ごとのログ（play_game の logfile）とは別の形式で，1ゲーム1行（BATCH_LOG_HEADER の項目）を logfile に記録する
+    #   - logfile: 一括プレイの結果を記録するファイル（ヘッダ行は呼び出し側で書き込む．None で記録しない）
+    def batch_evaluate(self, n_games, logfile=None):
+        player = self.player
+
+        # 一括プレイにはバイナリプロトコルが必要
+        self.protocol = 'binary'
+        self.connect_dealer()
+        player.receive_card_shuffle_status(self.soc)
+        player.receive_init_cards(self.soc)
+
+        n_played = 0
+        for records in self.soc.play_batch(self.make_policy_table(), n_games, self.max_retries):
+            for init_score, first_action, status, rate, n_retries, doubled in records:
+                bet = player.basic_bet * (2 if doubled else 1)
+                penalty = 0
+                for k in range(n_retries):
+                    penalty += int(player.basic_bet / 4.0 * (1.0 + self.retry_penalty_scale * k))
+                reward = int(bet * rate) - bet - penalty
+                player.money += reward
+                if logfile is not None:
+                    print('{},{},{},{},{},{}'.format(init_score, get_action_name(Action(first_action)), status, n_retries, doubled, reward), file=logfile)
+            n_played += len(records)
+            if self.verbose:
+                print('Batch: {0}/{1} games, money: {2} $'.format(n_played, n_games, player.get_money()))
+
+    # Qテーブルをファイルからロード（pickle 形式とバイナリ形式に対応．失敗した場合は警告を表示し，現在のQテーブルのままにする）
+    def load(self, filename: str):
+        # load can be either legacy (table dict) or new format {'meta':..., 'table':...}
+        try:
+            if is_qtable_file(filename):
+                loaded = None
+            else:
+                with open(filename, 'rb') as f:
+                    loaded = pickle.load(f)
+            if loaded is None:
+                # バイナリ形式（qtable_file.py）
+                dense, _ = load_qtable(filename)
+                table = dense.to_dict()
+                print(f'Loaded binary Q-table from {filename}')
+            elif isinstance(loaded, dict) and 'table' in loaded:
+                table = loaded['table']
+                print(f'Loaded Q-table (with meta) from {filename}')
+            elif isinstance(loaded, dict):
+                table = loaded
+                print(f'Loaded legacy Q-table dict from {filename}')
+            else:
+                # fallback to QTable.load (in case other formats)
+                tmp = QTable(action_class=Action, default_value=0)
+                tmp.load(filename)
+                table = tmp.table
+                print(f'Loaded Q-table via QTable.load from {filename}')
+            # 既存キーの状態が2次元 (score,length) の場合は (score,length,0) に変換
+            converted = {}
+            legacy_dim = False
+            for k, v in table.items():
+                if isinstance(k, tuple) and len(k) == 2 and isinstance(k[0], tuple) and len(k[0]) == 2:
+                    converted[((k[0][0], k[0][1], 0), k[1])] = v
+                    legacy_dim = True
+                else:
+                    converted[k] = v
+            if legacy_dim:
+                table = converted
+                print('[INFO] Expanded legacy state keys to 3D (retry_bucket=0)')
+            if isinstance(self.q_table, DenseQTable):
+                if loaded is None and dense.encoder.shape == self.q_table.encoder.shape:
+                    self.q_table.attach(dense.values, dense.known.reshape(dense.values.shape)) # 配列をそのまま使う
+                else:
+                    self.q_table = make_dense_qtable(table, rng=self.rng)
+            else:
+                self.q_table.table = table
+        except Exception as e:
+            print(f'Warning: failed to load Q-table from {filename}: {e}')
+
+    # Qテーブルをファイルに保存（ファイル名が .qtable で終わる場合はバイナリ形式，それ以外は pickle 形式．失敗した場合は警告を表示する）
+    #   - meta: Qテーブルと一緒に保存するメタ情報（学習率など）
+    #   - materialize_states: True の場合，Qテーブルに値がある状態と，プレイ中にQ値最大の行動を調べた状態について，
+    #     全ての行動の値（未学習の行動は初期値）を保存する（Q値最大の行動の選択でQテーブルに値を追加していた従来と同じ内容になる）
+    #     False の場合は，学習で値を更新した (状態, 行動) のみを保存する
+    def save(self, filename: str, meta=None, materialize_states=True):
+        q_table = self.q_table
+        try:
+            if materialize_states:
+                q_table.materialize_states()
+                q_table.materialize_states(self.seen_states)
+            meta = meta if meta is not None else {}
+            if filename.endswith(QTABLE_SUFFIX):
+                # バイナリ形式（qtable_file.py）で保存
+                write_qtable(filename, q_table if isinstance(q_table, DenseQTable) else dense_from_dict(q_table.table), meta)
+            else:
+                to_save = {'meta': meta, 'table': q_table.to_dict() if isinstance(q_table, DenseQTable) else q_table.table}
+                with open(filename, 'wb') as f:
+                    pickle.dump(to_save, f)
+            print(f'Saved Q-table with meta to {filename}')
+        except Exception as e:
+            print(f'Warning: failed to save Q-table to {filename}: {e}')
+
+    # 共有メモリ上のQテーブルに読み出し専用で接続し，以降はその値を使う（新しい世代が公開されるとテストモードのゲーム開始時に切り替わる）
+    def attach_shared_qtable(self, name: str):
+        self.shared_qtable = SharedQTable.attach(name, readonly=True, rng=self.rng)
+        self.q_table = self.shared_qtable.q_table
+
+    # 現在のQテーブルを共有メモリに新しい世代として公開する（初回は名前 name の共有メモリを作成する）
+    #   - meta: 作成時にヘッダに含めるメタ情報
+    def publish_shared_qtable(self, name=None, meta=None):
+        q_table = self.q_table
+        dense = q_table if isinstance(q_table, DenseQTable) else make_dense_qtable(q_table.table)
+        if self.shared_qtable is None:
+            self.shared_qtable = SharedQTable.create(name, dense, meta)
         else:
-            return q_table.get_best_action(state)
+            self.shared_qtable.publish(dense)
 
-    # ランダム戦略
-    else:
-        # ランダム戦略: RETRY上限到達時は除外
-        actions = [Action.HIT, Action.STAND, Action.DOUBLE_DOWN, Action.SURRENDER]
-        if g_retry_counter < RETRY_MAX:
-            actions.append(Action.RETRY)
-        return random.choice(actions)
+    # ディーラーとの接続と，共有メモリのQテーブルとの接続を閉じる（共有メモリを公開している場合は削除する）
+    def close(self):
+        self.disconnect_dealer()
+        if self.shared_qtable is not None:
+            if not self.shared_qtable.owner:
+                self.q_table = None # 共有メモリの配列への参照を手放す
+            self.shared_qtable.close()
+            self.shared_qtable = None
 
 
 ### ここから処理開始 ###
 
 def main():
-    global g_retry_counter, player, soc, q_table, RETRY_MAX, RETRY_PENALTY_SCALE
 
     parser = argparse.ArgumentParser(description='AI Black Jack Player (Q-learning)')
     parser.add_argument('--games', type=int, default=1, help='num. of games to play')
     parser.add_argument('--history', type=str, default='play_log.csv', help='filename where game history will be saved')
-    parser.add_argument('--load', type=str, default='', help='filename of Q table to be loaded before learning')
-    parser.add_argument('--save', type=str, default='', help='filename where Q table will be saved after learning')
+    parser.add_argument('--load', type=str, default='', help='filename of Q table to be loaded before learning (pickle or binary .qtable)')
+    parser.add_argument('--save', type=str, default='', help='filename where Q table will be saved after learning (binary format if it ends with .qtable, otherwise pickle)')
     parser.add_argument('--testmode', help='this option runs the program without learning', action='store_true')
     parser.add_argument('--alpha', '--learning_rate', type=float, default=LEARNING_RATE, help='learning rate (alpha)')
     parser.add_argument('--gamma', '--discount_factor', type=float, default=DISCOUNT_FACTOR, help='discount factor (gamma)')
@@ -346,17 +732,29 @@ def main():
     parser.add_argument('--retry_penalty_scale', type=float, default=RETRY_PENALTY_SCALE, help='scaling factor for escalating retry penalty')
     parser.add_argument('--quiet', action='store_true', help='suppress per-action verbose logs for faster long runs')
     parser.add_argument('--seed', type=int, default=None, help='random seed for reproducibility')
+    parser.add_argument('--shoe_seed', type=int, default=None, help='ask the dealer to shuffle this session\'s shoe with this seed (default: --seed)')
     parser.add_argument('--dealer_host', type=str, default='localhost', help='dealer host to connect (default: localhost)')
+    parser.add_argument('--dealer_uds', type=str, default='', help='connect to the dealer through this Unix domain socket path instead of TCP')
+    parser.add_argument('--dealer_table', type=str, default=None, help='ask the dealer to seat this session at the table with this ID (its own shoe, kept across reconnects)')
+    parser.add_argument('--protocol', choices=['text', 'binary'], default='text', help='wire protocol to negotiate with the dealer')
+    parser.add_argument('--inprocess', action='store_true', help='run the dealer inside this process instead of connecting through a socket')
+    parser.add_argument('--engine', choices=['socket', 'local'], default='socket', help='socket: play through the dealer protocol; local: drive an embedded dealer directly without messages or per-game output (implies --inprocess)')
+    parser.add_argument('--qtable_backend', choices=['dict', 'dense'], default='dict', help='Q-table implementation: dict (classes.QTable) or dense (classes.DenseQTable, a NumPy array over the state grid)')
+    parser.add_argument('--materialize_states', action=argparse.BooleanOptionalAction, default=True, help='with --save, store every action of each stored or visited state, unset ones with the default value, as tables were saved before greedy lookups became read-only (--no-materialize_states: only the updated entries)')
+    parser.add_argument('--qtable_shm', type=str, default='', help='shared-memory Q-table name: with --testmode, attach to it read-only (and follow newly published versions); otherwise publish the Q-table under this name while learning')
+    parser.add_argument('--publish_interval', type=int, default=100, help='with --qtable_shm while learning, publish a new version of the Q-table every this many games')
+    parser.add_argument('--batch_eval', action='store_true', help='with --testmode, let the dealer play all games in-process with the greedy policy (binary protocol)')
+    parser.add_argument('--batch_history', type=str, default='batch_log.csv', help='with --batch_eval, filename where one row per game (initial score, first action, result, retries, double down, reward) will be saved instead of --history')
     args = parser.parse_args()
 
-    n_games = args.games + 1
-    learning_rate = args.alpha
-    discount_factor = args.gamma
-    eps_start = args.eps_start
-    eps_end = args.eps_end
-    eps_decay_episodes = max(1, args.eps_decay_episodes)
-    eps_decay_type = args.eps_decay_type
-    g_dealer_host = args.dealer_host
+    if args.batch_eval and not args.testmode:
+        parser.error('--batch_eval requires --testmode')
+    if args.batch_eval and args.max_retries_per_game > BATCH_MAX_RETRIES:
+        parser.error('--batch_eval supports --max_retries_per_game up to {0}'.format(BATCH_MAX_RETRIES))
+    if args.qtable_shm and args.testmode and args.load:
+        parser.error('--qtable_shm with --testmode cannot be combined with --load')
+    if args.publish_interval < 1:
+        parser.error('--publish_interval must be at least 1')
 
     # シード設定
     if args.seed is not None:
@@ -366,129 +764,73 @@ def main():
         except Exception:
             pass
 
+    # エージェントを作成（行動選択には上でシードを設定したグローバル乱数を使う）
+    # ディーラーにはシューのシードを要求する（同時に動作している他のプレイヤーに関係なく同じカード列になる）
+    agent = QLearningAgent(
+        alpha=args.alpha,
+        gamma=args.gamma,
+        eps_start=args.eps_start,
+        eps_end=args.eps_end,
+        eps_decay_episodes=args.eps_decay_episodes,
+        eps_decay_type=args.eps_decay_type,
+        max_retries=args.max_retries_per_game,
+        retry_penalty_scale=args.retry_penalty_scale,
+        qtable_backend=args.qtable_backend,
+        engine='socket' if args.batch_eval else args.engine,
+        inprocess=args.inprocess or args.engine == 'local',
+        dealer_host=args.dealer_host,
+        dealer_uds=args.dealer_uds,
+        protocol=args.protocol,
+        shoe_seed=args.shoe_seed if args.shoe_seed is not None else args.seed,
+        dealer_table=args.dealer_table,
+        verbose=not args.quiet,
+    )
+
     # Qテーブルをロード
     if args.load != '':
-        # load can be either legacy (table dict) or new format {'meta':..., 'table':...}
-        try:
-            with open(args.load, 'rb') as f:
-                loaded = pickle.load(f)
-            if isinstance(loaded, dict) and 'table' in loaded:
-                q_table.table = loaded['table']
-                print(f'Loaded Q-table (with meta) from {args.load}')
-            elif isinstance(loaded, dict):
-                q_table.table = loaded
-                print(f'Loaded legacy Q-table dict from {args.load}')
-            else:
-                # fallback to QTable.load (in case other formats)
-                q_table.load(args.load)
-                print(f'Loaded Q-table via QTable.load from {args.load}')
-            # 既存キーが2次元 (score,length) の場合は (score,length,0) に変換
-            converted = {}
-            legacy_dim = False
-            for k, v in q_table.table.items():
-                if isinstance(k, tuple) and len(k) == 2:
-                    converted[(k[0], k[1], 0)] = v
-                    legacy_dim = True
-                else:
-                    converted[k] = v
-            if legacy_dim:
-                q_table.table = converted
-                print('[INFO] Expanded legacy state keys to 3D (retry_bucket=0)')
-        except Exception as e:
-            print(f'Warning: failed to load Q-table from {args.load}: {e}')
+        agent.load(args.load)
+
+    # 共有メモリ上のQテーブルを使う
+    if args.qtable_shm:
+        if args.testmode:
+            # 公開されている配列をコピーせずに参照する（読み出し専用）
+            agent.attach_shared_qtable(args.qtable_shm)
+            print(f'Attached shared Q-table {args.qtable_shm} (version {agent.shared_qtable.generation})')
+        else:
+            agent.publish_shared_qtable(args.qtable_shm, meta={'alpha': agent.alpha, 'gamma': agent.gamma})
+            print(f'Publishing Q-table as {args.qtable_shm} every {args.publish_interval} games')
 
     # ログファイルを開き、必ず閉じられるよう with 構文で処理
-    with open(args.history, 'w', encoding='utf-8') as logfile:
-        print('score,hand_length,retry_bucket,action,status,reward', file=logfile)
-
-        # n_games回ゲームを実行
-        # RETRY設定を反映
-        RETRY_MAX = max(0, args.max_retries_per_game)
-        RETRY_PENALTY_SCALE = max(0.0, args.retry_penalty_scale)
-
-        for n in range(1, n_games):
-
-            # nゲーム目を開始
-            game_start(n, verbose=not args.quiet)
-
-            # 「現在の状態」を取得
-            state = get_state()
-
-            # エピソードごとの epsilon を計算
-            if eps_decay_type == 'const':
-                current_eps = eps_start
-            elif eps_decay_type == 'linear':
-                fraction = min(1.0, (n - 1) / float(eps_decay_episodes))
-                current_eps = eps_start + fraction * (eps_end - eps_start)
-            elif eps_decay_type == 'exp':
-                tau = max(1.0, eps_decay_episodes / 5.0)
-                current_eps = eps_end + (eps_start - eps_end) * math.exp(-(n - 1) / tau)
-            else:
-                current_eps = eps_start
-
-            while True:
-
-                # 次に実行する行動を選択
-                if args.testmode:
-                    action = select_action(state, Strategy.QMAX)
-                else:
-                    action = select_action(state, Strategy.E_GREEDY, epsilon=current_eps)
-                if g_retry_counter >= RETRY_MAX and action == Action.RETRY:
-                    action = random.choice([Action.HIT, Action.STAND, Action.DOUBLE_DOWN, Action.SURRENDER])
-                action_name = get_action_name(action) # 行動名を表す文字列を取得
-
-                # 選択した行動を実際に実行
-                # 戻り値:
-                #   - done: 終了フラグ．今回の行動によりゲームが終了したか否か（終了した場合はTrue, 続行中ならFalse）
-                #   - reward: 獲得金額（ゲーム続行中の場合は 0 , ただし RETRY を実行した場合は1回につき -BET/4 ）
-                #   - status: 行動実行後のプレイヤーステータス（バーストしたか否か，勝ちか負けか，などの状態を表す文字列）
-                reward, done, status = act(action, verbose=not args.quiet)
-
-                # 実行した行動がRETRYだった場合はRETRY回数カウンターを1増やす
-                if action == Action.RETRY:
-                    g_retry_counter += 1
-
-                # 「現在の状態」を再取得
-                prev_state = state # 行動前の状態を別変数に退避
-                prev_score = prev_state[0] # 行動前のプレイヤー手札のスコア（prev_state の一つ目の要素）
-                state = get_state()
-                score = state[0] # 行動後のプレイヤー手札のスコア（state の一つ目の要素）
-
-                # Qテーブルを更新
-                if not args.testmode:
-                    _, V = q_table.get_best_action(state, with_value=True)
-                    Q = q_table.get_Q_value(prev_state, action) # 現在のQ値
-                    Q = (1 - learning_rate) * Q + learning_rate * (reward + discount_factor * V) # 新しいQ値
-                    q_table.set_Q_value(prev_state, action, Q) # 新しいQ値を登録
-
-                # ログファイルに「行動前の状態」「行動の種類」「行動結果」「獲得金額」などの情報を記録
-                print('{},{},{},{},{},{}'.format(prev_state[0], prev_state[1], prev_state[2], action_name, status, reward), file=logfile)
+    if args.batch_eval:
+        # ディーラー内で一括プレイ（Qテーブルは更新しない．行動ごとのログとは形式が異なるため別のファイルに記録する）
+        with open(args.batch_history, 'w', encoding='utf-8') as logfile:
+            print(BATCH_LOG_HEADER, file=logfile)
+            agent.batch_evaluate(args.games, logfile)
+    else:
+        with open(args.history, 'w', encoding='utf-8') as logfile:
+            print('score,hand_length,retry_bucket,action,status,reward', file=logfile)
 
-                # 終了フラグが立った場合はnゲーム目を終了
-                if done == True:
-                    break
+            # n_games回ゲームを実行
+            agent.run(args.games, logfile, testmode=args.testmode, publish_interval=args.publish_interval)
 
-            if not args.quiet:
-                print('')
+    # ディーラーとの通信をカット
+    agent.disconnect_dealer()
 
     # Qテーブルをセーブ (新仕様: 保存にメタ情報を付与する)
     if args.save != '':
-        try:
-            meta = {
-                'alpha': learning_rate,
-                'gamma': discount_factor,
-                'eps_start': eps_start,
-                'eps_end': eps_end,
-                'eps_decay_episodes': eps_decay_episodes,
-                'eps_decay_type': eps_decay_type,
-                'games': args.games,
-            }
-            to_save = {'meta': meta, 'table': q_table.table}
-            with open(args.save, 'wb') as f:
-                pickle.dump(to_save, f)
-            print(f'Saved Q-table with meta to {args.save}')
-        except Exception as e:
-            print(f'Warning: failed to save Q-table to {args.save}: {e}')
+        meta = {
+            'alpha': agent.alpha,
+            'gamma': agent.gamma,
+            'eps_start': agent.eps_start,
+            'eps_end': agent.eps_end,
+            'eps_decay_episodes': agent.eps_decay_episodes,
+            'eps_decay_type': agent.eps_decay_type,
+            'games': args.games,
+        }
+        agent.save(args.save, meta, materialize_states=args.materialize_states)
+
+    # 共有メモリのQテーブルとの接続を閉じる（公開側は共有メモリを削除する）
+    agent.close()
 
 
 if __name__ == '__main__':
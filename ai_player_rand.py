@@ -1,9 +1,10 @@
-import copy
 import socket
 import argparse
 import numpy as np
-from classes import Action, Player, get_card_info, get_action_name
+from classes import Action, Player, get_card_info, get_action_name, open_dealer_socket
 from config import PORT, BET, INITIAL_MONEY, N_DECKS
+from protocol import BinaryChannel
+from dealer import LocalDealerChannel
 
 
 # 1ゲームあたりのRETRY回数の上限
@@ -21,12 +22,27 @@ player = Player(initial_money=INITIAL_MONEY, basic_bet=BET)
 # ディーラーとの通信用ソケット
 soc = None
 
+# ディーラーとの通信プロトコル（'text' または 'binary'）
+g_protocol = 'text'
+
+# Unixドメインソケットで接続する場合のパス（空文字列の場合はTCPで接続）
+g_dealer_uds = ''
+
+# True の場合はソケットを使わず，同じプロセス内のディーラーと直接やり取りする
+g_inprocess = False
+
+# 現在のゲームの後に続けて次のゲームを行うか否か（True なら決着する行動と次ゲームの要求をまとめて送る）
+g_pipeline_next = False
+
+# 次のゲームの要求を送信済みか否か
+g_next_requested = False
+
 
 ### 関数 ###
 
 # ゲームを開始する
 def game_start(game_ID=0):
-    global g_retry_counter, player, soc
+    global g_retry_counter, player, soc, g_protocol, g_dealer_uds, g_inprocess, g_next_requested
 
     print('Game {0} start.'.format(game_ID))
     print('  money: ', player.get_money(), '$')
@@ -34,10 +50,17 @@ def game_start(game_ID=0):
     # RETRY回数カウンターの初期化
     g_retry_counter = 0
 
-    # ディーラープログラムに接続する
-    soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    soc.connect((socket.gethostname(), PORT))
-    soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # ディーラープログラムに接続する（2ゲーム目以降は同じ接続のまま次のゲームを要求する）
+    if soc is None and g_inprocess:
+        soc = LocalDealerChannel()
+    elif soc is None:
+        soc = open_dealer_socket(socket.gethostname(), PORT, uds_path=g_dealer_uds)
+        if g_protocol == 'binary':
+            soc = BinaryChannel(soc) # バイナリプロトコルを提案（ディーラーが非対応ならテキストのまま）
+    elif g_next_requested:
+        g_next_requested = False # 前のゲームの最後の行動と一緒に要求済み
+    else:
+        player.request_next_game(soc)
 
     # ベット
     bet, money = player.set_bet()
@@ -61,8 +84,19 @@ def game_start(game_ID=0):
     print('  current score: ', player.get_score())
 
 # 現時点での手札情報（ディーラー手札は見えているもののみ）を取得
+# 手札はコピーせず，読み出し専用のビュー（classes.HandView）を返す
 def get_current_hands():
-    return copy.deepcopy(player.player_hand), copy.deepcopy(player.dealer_hand)
+    return player.player_hand.view(), player.dealer_hand.view()
+
+# 必ずゲームが決着する行動（STAND，DOUBLE DOWN，SURRENDER）のメッセージを送信する
+# 続けて次のゲームを行い，通信路がパイプライン化に対応している場合は，次のゲームの要求も応答を待たずにまとめて送る
+def send_final_action(msg: str):
+    global player, soc, g_next_requested
+    if g_pipeline_next and player.can_pipeline(soc):
+        player.send_messages(soc, [msg, 'next'])
+        g_next_requested = True
+    else:
+        player.send_message(soc, msg)
 
 # HITを実行する
 def hit():
@@ -83,7 +117,6 @@ def hit():
         for i in range(len(dc)):
             print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
         print("  dealer's score: ", player.get_dealer_score())
-        soc.close() # ディーラーとの通信をカット
         reward = player.update_money(rate=rate) # 所持金額を更新
         print('Game finished.')
         print('  result: bust')
@@ -101,7 +134,7 @@ def stand():
     print('Action: STAND')
 
     # ディーラーにメッセージを送信
-    player.send_message(soc, 'stand')
+    send_final_action('stand')
 
     # ディーラーから情報を受信
     score, status, rate, dc = player.receive_message(dsoc=soc, get_dealer_cards=True)
@@ -110,9 +143,6 @@ def stand():
         print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
     print("  dealer's score: ", player.get_dealer_score())
 
-    # ゲーム終了，ディーラーとの通信をカット
-    soc.close()
-
     # 所持金額を更新
     reward = player.update_money(rate=rate)
     print('Game finished.')
@@ -132,7 +162,7 @@ def double_down():
     print('  bet: ', bet, '$')
 
     # ディーラーにメッセージを送信
-    player.send_message(soc, 'double_down')
+    send_final_action('double_down')
 
     # ディーラーから情報を受信
     pc, score, status, rate, dc = player.receive_message(dsoc=soc, get_player_card=True, get_dealer_cards=True)
@@ -142,9 +172,6 @@ def double_down():
         print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
     print("  dealer's score: ", player.get_dealer_score())
 
-    # ゲーム終了，ディーラーとの通信をカット
-    soc.close()
-
     # 所持金額を更新
     reward = player.update_money(rate=rate)
     print('Game finished.')
@@ -159,7 +186,7 @@ def surrender():
     print('Action: SURRENDER')
 
     # ディーラーにメッセージを送信
-    player.send_message(soc, 'surrender')
+    send_final_action('surrender')
 
     # ディーラーから情報を受信
     score, status, rate, dc = player.receive_message(dsoc=soc, get_dealer_cards=True)
@@ -168,9 +195,6 @@ def surrender():
         print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
     print("  dealer's score: ", player.get_dealer_score())
 
-    # ゲーム終了，ディーラーとの通信をカット
-    soc.close()
-
     # 所持金額を更新
     reward = player.update_money(rate=rate)
     print('Game finished.')
@@ -203,7 +227,6 @@ def retry():
         for i in range(len(dc)):
             print('  dealer-card {0}: '.format(i+2), get_card_info(dc[i]))
         print("  dealer's score: ", player.get_dealer_score())
-        soc.close() # ディーラーとの通信をカット
         reward = player.update_money(rate=rate) # 所持金額を更新
         print('Game finished.')
         print('  result: bust')
@@ -270,14 +293,20 @@ def select_action(state):
 ### ここから処理開始 ###
 
 def main():
-    global g_retry_counter, player, soc
+    global g_retry_counter, player, soc, g_protocol, g_dealer_uds, g_inprocess, g_pipeline_next
 
     parser = argparse.ArgumentParser(description='AI Black Jack Player (random strategy)')
     parser.add_argument('--games', type=int, default=1, help='num. of games to play')
     parser.add_argument('--history', type=str, default='play_log.csv', help='filename where game history will be saved')
+    parser.add_argument('--dealer_uds', type=str, default='', help='connect to the dealer through this Unix domain socket path instead of TCP')
+    parser.add_argument('--protocol', choices=['text', 'binary'], default='text', help='wire protocol to negotiate with the dealer')
+    parser.add_argument('--inprocess', action='store_true', help='run the dealer inside this process instead of connecting through a socket')
     args = parser.parse_args()
 
     n_games = args.games + 1
+    g_protocol = args.protocol
+    g_dealer_uds = args.dealer_uds
+    g_inprocess = args.inprocess
 
     # ログファイルを開く
     logfile = open(args.history, 'w')
@@ -287,6 +316,7 @@ def main():
     for n in range(1, n_games):
 
         # nゲーム目を開始
+        g_pipeline_next = n < n_games - 1
         game_start(n)
 
         # 「現在の状態」を取得
@@ -329,6 +359,11 @@ def main():
 
         print('')
 
+    # ディーラーとの通信をカット
+    if soc is not None:
+        soc.close()
+        soc = None
+
     # ログファイルを閉じる
     logfile.close()
 
@@ -0,0 +1,274 @@
+import numpy as np
+from classes import Action, CARD_VALUES
+from config import BET, N_DECKS, SHUFFLE_INTERVAL, SHUFFLE_THRESHOLD, MAX_CARDS_PER_GAME
+from protocol import STATUS_CODES
+
+
+# カードIDからカードの値（A は 1，絵札は 10）への変換表
+CARD_VALUE_ARRAY = np.array(CARD_VALUES, dtype=np.int16)
+
+# 勝敗ステータスのコード（protocol.STATUS_CODES と同じ値）
+UNSETTLED = STATUS_CODES['unsettled']
+WIN = STATUS_CODES['win']
+LOSE = STATUS_CODES['lose']
+DRAW = STATUS_CODES['draw']
+BUST = STATUS_CODES['bust']
+SURRENDERED = STATUS_CODES['surrendered']
+
+
+# 手札のスコアを計算（A は1枚だけ，21を超えない場合に 11 として数える．Hand.get_score と同じ）
+def hand_scores(hard, n_aces):
+    return hard + 10 * ((n_aces > 0) & (hard <= 11))
+
+
+# シャッフル用シード（整数または np.random.SeedSequence）を，同じ乱数列になるものどうしで等しくなるキーに変換
+def seed_key(seed):
+    if isinstance(seed, np.random.SeedSequence):
+        entropy = seed.entropy
+        return (entropy if isinstance(entropy, int) else tuple(entropy), seed.spawn_key)
+    return int(seed)
+
+
+# 複数のテーブルでのゲームをまとめて進めるシミュレータ
+# M 個のテーブルの状態（シュー，次に引く位置，両者の手札のハードの合計・A の枚数・枚数，RETRY回数，ベット額）を
+# 長さ M の配列で持ち，配布・各行動・ディーラーのカード追加・勝敗判定をマスク付きの配列演算で行う
+# ルール（シャッフルの時期，配る順番，各行動の処理，勝敗判定）は dealer.Dealer と同じで，
+# 同じシューと同じ行動列を与えれば Dealer と同じ結果になる（tools/check_batch_sim.py で確認できる）
+# 手札はカードIDではなく合計と枚数だけを持つため，カードの種類が必要な処理（メッセージ作成など）には使えない
+class BatchTables:
+
+    # コンストラクタ
+    #   - n_tables: テーブルの数 M
+    #   - seed: シャッフルと一括プレイ時のランダムな行動選択に使用する乱数シード（省略時はランダム）
+    #   - shoe_seeds: テーブルごとのシャッフル用シード（整数または np.random.SeedSequence のリスト．省略時は全テーブルで seed の乱数を使う）
+    #     指定した場合，同じシードのテーブルは同じシューの列を使う（k 回目のシャッフルで，そのシードの乱数で作った k 番目のシューを使う）
+    #   - その他の引数の意味は Dealer のコンストラクタと同じ
+    def __init__(self, n_tables: int, seed=None, n_decks=N_DECKS, shuffle_interval=SHUFFLE_INTERVAL,
+                 shuffle_threshold=SHUFFLE_THRESHOLD, max_cards_per_game=MAX_CARDS_PER_GAME, shoe_seeds=None):
+        self.n_tables = n_tables
+        self.n_cards = 52 * n_decks
+        self.shuffle_interval = shuffle_interval
+        self.shuffle_threshold = shuffle_threshold
+        self.max_cards_per_game = max_cards_per_game
+        self.rng = np.random.default_rng(seed)
+
+        # シャッフル用シードごとのシューの列（shoe_seeds 指定時）
+        # 各列は作成済みのシューのうち，まだその列の全テーブルが使い終えていないものだけを保持する
+        if shoe_seeds is not None:
+            seeds = {} # キー -> (列の番号, シード)
+            self.stream_ids = np.array([seeds.setdefault(seed_key(s), (len(seeds), s))[0] for s in shoe_seeds], dtype=np.int64)
+            self.streams = [np.random.default_rng(s) for _, s in seeds.values()]
+            self.stream_shoes = [[] for _ in self.streams]
+            self.stream_base = np.zeros(len(self.streams), dtype=np.int64) # 各列で保持している最初のシューの番号
+            self.n_shuffles = np.zeros(n_tables, dtype=np.int64)
+        else:
+            self.streams = None
+
+        # シュー（カードIDとカードの値）と次に引くカードの位置
+        # 最初のゲームの開始時に必ずシャッフルするため，初期値は使われない
+        self.shoes = np.zeros((n_tables, self.n_cards), dtype=np.int16)
+        self.shoe_values = np.zeros((n_tables, self.n_cards), dtype=np.int16)
+        self.pos = np.zeros(n_tables, dtype=np.int64)
+        self.game_ids = np.zeros(n_tables, dtype=np.int64)
+
+        # プレイヤーの手札（ハードの合計，A の枚数，枚数，最後に引いたカードの値）
+        self.p_hard = np.zeros(n_tables, dtype=np.int16)
+        self.p_aces = np.zeros(n_tables, dtype=np.int16)
+        self.p_n = np.zeros(n_tables, dtype=np.int16)
+        self.p_last = np.zeros(n_tables, dtype=np.int16)
+
+        # ディーラーの手札（ハードの合計，A の枚数，枚数）
+        self.d_hard = np.zeros(n_tables, dtype=np.int16)
+        self.d_aces = np.zeros(n_tables, dtype=np.int16)
+        self.d_n = np.zeros(n_tables, dtype=np.int16)
+
+        # 現在のゲームの RETRY回数，ベット額，勝敗ステータスのコード，配当倍率
+        self.retries = np.zeros(n_tables, dtype=np.int64)
+        self.bets = np.zeros(n_tables, dtype=np.int64)
+        self.status = np.full(n_tables, UNSETTLED, dtype=np.int8)
+        self.rates = np.zeros(n_tables, dtype=np.float64)
+
+    # 指定したテーブルのシューをシャッフル（Dealer と同様に初期順序のカードを毎回シャッフルする）
+    def shuffle(self, idx):
+        if self.streams is not None:
+            shoes = self.stream_shuffle(idx)
+        else:
+            shoes = self.rng.permuted(np.broadcast_to(np.arange(self.n_cards, dtype=np.int16), (len(idx), self.n_cards)), axis=1)
+        self.shoes[idx] = shoes
+        self.shoe_values[idx] = CARD_VALUE_ARRAY[shoes]
+        self.pos[idx] = 0
+
+    # 指定したテーブルに，それぞれのシャッフル用シードの列の次のシューを割り当てる（shoe_seeds 指定時）
+    def stream_shuffle(self, idx):
+        shoes = np.empty((len(idx), self.n_cards), dtype=np.int16)
+        for i, t in enumerate(idx):
+            s = self.stream_ids[t]
+            k = self.n_shuffles[t] - self.stream_base[s]
+            made = self.stream_shoes[s]
+            while len(made) <= k:
+                made.append(self.streams[s].permutation(self.n_cards).astype(np.int16))
+            shoes[i] = made[k]
+        self.n_shuffles[idx] += 1
+
+        # 列の全テーブルが使い終えたシューを捨てる
+        for s in np.unique(self.stream_ids[idx]):
+            used = self.n_shuffles[self.stream_ids == s].min() - self.stream_base[s]
+            if used > 0:
+                del self.stream_shoes[s][:used]
+                self.stream_base[s] += used
+        return shoes
+
+    # 指定したテーブルでカードを1枚ずつ引き，その値を返す
+    def draw(self, idx):
+        pos = self.pos[idx]
+        if len(pos) > 0 and pos.max() >= self.n_cards:
+            raise IndexError('no cards left in the shoe')
+        self.pos[idx] = pos + 1
+        return self.shoe_values[idx, pos]
+
+    # 全テーブルで新しいゲームを開始する（必要ならシャッフルし，ディーラーとプレイヤーに2枚ずつ配る）
+    # 戻り値は各テーブルでシャッフルを行ったか否かの配列
+    def deal(self):
+        shuffled = (self.game_ids % self.shuffle_interval == 0) | (self.n_cards - self.pos < self.shuffle_threshold)
+        idx = np.flatnonzero(shuffled)
+        if len(idx) > 0:
+            self.shuffle(idx)
+        self.game_ids += 1
+
+        # Dealer.deal_initial_cards と同じく，ディーラーの2枚，プレイヤーの2枚の順に配る
+        c = self.shoe_values[np.arange(self.n_tables)[:, None], self.pos[:, None] + np.arange(4)]
+        self.pos += 4
+        self.d_hard[:] = c[:, 0] + c[:, 1]
+        self.d_aces[:] = (c[:, 0] == 1).astype(np.int16) + (c[:, 1] == 1)
+        self.d_n[:] = 2
+        self.p_hard[:] = c[:, 2] + c[:, 3]
+        self.p_aces[:] = (c[:, 2] == 1).astype(np.int16) + (c[:, 3] == 1)
+        self.p_n[:] = 2
+        self.p_last[:] = c[:, 3]
+
+        self.retries[:] = 0
+        self.bets[:] = BET
+        self.status[:] = UNSETTLED
+        self.rates[:] = 0.0
+        return shuffled
+
+    # 現在のプレイヤースコア
+    def player_scores(self):
+        return hand_scores(self.p_hard, self.p_aces)
+
+    # 現在のディーラースコア
+    def dealer_scores(self):
+        return hand_scores(self.d_hard, self.d_aces)
+
+    # 決着していないテーブルか否かの配列
+    def unsettled(self):
+        return self.status == UNSETTLED
+
+    # 指定したテーブルでプレイヤーにカードを1枚配布
+    def draw_player_cards(self, idx):
+        v = self.draw(idx)
+        self.p_hard[idx] += v
+        self.p_aces[idx] += v == 1
+        self.p_n[idx] += 1
+        self.p_last[idx] = v
+
+    # 指定したテーブルでルールに従ってディーラーにカードを追加
+    # （ディーラーのスコアが17以上になるか，カード使用枚数の上限に達するまで追加）
+    def draw_dealer_cards(self, idx):
+        while len(idx) > 0:
+            need = (hand_scores(self.d_hard[idx], self.d_aces[idx]) < 17) & (self.d_n[idx] < self.max_cards_per_game)
+            idx = idx[need]
+            if len(idx) == 0:
+                break
+            v = self.draw(idx)
+            self.d_hard[idx] += v
+            self.d_aces[idx] += v == 1
+            self.d_n[idx] += 1
+
+    # 指定したテーブルで勝敗判定を行い，ステータスと配当倍率を設定する（Dealer.judge と同じ順序で判定）
+    def judge(self, idx):
+        p_hard, d_hard = self.p_hard[idx], self.d_hard[idx]
+        p_score = hand_scores(p_hard, self.p_aces[idx])
+        d_score = hand_scores(d_hard, self.d_aces[idx])
+        p_nbj = (self.p_n[idx] == 2) & (p_score == 21)
+        d_nbj = (self.d_n[idx] == 2) & (d_score == 21)
+        conds = [p_hard > 21, p_nbj & d_nbj, p_nbj, d_hard > 21, d_nbj, p_score > d_score, p_score < d_score]
+        self.status[idx] = np.select(conds, [LOSE, DRAW, WIN, WIN, LOSE, WIN, LOSE], DRAW)
+        self.rates[idx] = np.select(conds, [0.0, 1.0, 2.5, 2.0, 0.0, 2.0, 0.0], 1.0)
+
+    # 決着していないテーブルでプレイヤーの行動を処理する（Dealer.resolve_action と同じ）
+    # 決着済みのテーブルの値は無視する．処理後の status と rates に各テーブルの結果が入る
+    #   - actions: 各テーブルの行動コード（Action の値）の配列
+    def step(self, actions):
+        actions = np.asarray(actions)
+        active = self.status == UNSETTLED
+        hit = active & (actions == Action.HIT.value)
+        stand = active & (actions == Action.STAND.value)
+        double = active & (actions == Action.DOUBLE_DOWN.value)
+        surrender = active & (actions == Action.SURRENDER.value)
+        retry = active & (actions == Action.RETRY.value)
+        if (active & ~(hit | stand | double | surrender | retry)).any():
+            raise ValueError('undefined action code for an unsettled table')
+
+        # RETRY: 最後のカードを破棄してから1枚配布
+        idx = np.flatnonzero(retry)
+        if len(idx) > 0:
+            last = self.p_last[idx]
+            self.p_hard[idx] -= last
+            self.p_aces[idx] -= last == 1
+            self.p_n[idx] -= 1
+            self.retries[idx] += 1
+
+        # HIT, DOUBLE DOWN, RETRY: プレイヤーにカードを1枚配布し，バーストしたら負け
+        drawn = hit | double | retry
+        self.draw_player_cards(np.flatnonzero(drawn))
+        busted = drawn & (self.p_hard > 21)
+        self.status[busted] = BUST
+        self.bets[double] *= 2
+
+        # STAND と（バーストしなかった）DOUBLE DOWN: ディーラーにカードを追加して勝敗を判定
+        idx = np.flatnonzero(stand | (double & ~busted))
+        self.draw_dealer_cards(idx)
+        self.judge(idx)
+
+        # SURRENDER: ベット額の半分が戻る
+        self.status[surrender] = SURRENDERED
+        self.rates[surrender] = 0.5
+
+    # 決着したゲームの獲得金額（Player.update_money と同じく，払い戻し額を整数に切り捨ててからベット額を引く．RETRYのペナルティは含まない）
+    def payouts(self):
+        return (self.bets * self.rates).astype(np.int64) - self.bets
+
+    # 全テーブルで新しいゲームを開始し，方策テーブルに従って決着までプレイする（Dealer.play_policy_game と同じ規則）
+    # 状態は (プレイヤースコア, プレイヤー手札の枚数, RETRYバケット) とし，RETRYバケットは上限の値でまとめる
+    # スコアか手札枚数がテーブルの範囲外の状態は，値のない状態と同じく未定義として扱う（Dealer.play_policy_game と同じ）
+    # 戻り値は (初期スコア, 最初の行動コード, ステータスのコード, 配当倍率, RETRY回数, ダブルダウンしたか否か) の配列のタプル
+    #   - policy: 方策テーブル（形状 (スコア数, 手札枚数の数, RETRYバケット数) の行動コードの配列）
+    #   - max_retries: 1ゲームあたりのRETRY回数の上限（上限到達後にRETRYが選ばれた場合は他の行動をランダムに選択）
+    def play_policy(self, policy, max_retries: int):
+        policy = np.asarray(policy, dtype=np.uint8)
+        n_scores, n_lengths, n_buckets = policy.shape
+        self.deal()
+        init_scores = self.player_scores()
+        first_actions = np.zeros(self.n_tables, dtype=np.uint8)
+        actions = np.zeros(self.n_tables, dtype=np.uint8)
+        idx = np.arange(self.n_tables)
+        while len(idx) > 0:
+            s = hand_scores(self.p_hard[idx], self.p_aces[idx])
+            l = self.p_n[idx]
+            r = np.minimum(self.retries[idx], n_buckets - 1)
+            outside = (s >= n_scores) | (l >= n_lengths)
+            code = policy[np.minimum(s, n_scores - 1), np.minimum(l, n_lengths - 1), r]
+            undefined = (code == Action.UNDEFINED.value) | (code > Action.RETRY.value) | outside
+            if undefined.any():
+                code[undefined] = self.rng.integers(1, Action.RETRY.value + 1, size=int(undefined.sum())) # 未定義の状態では全行動からランダムに選択
+            capped = (code == Action.RETRY.value) & (self.retries[idx] >= max_retries)
+            if capped.any():
+                code[capped] = self.rng.integers(1, Action.RETRY.value, size=int(capped.sum())) # RETRY以外からランダムに選択
+            first = first_actions[idx] == 0
+            first_actions[idx[first]] = code[first]
+            actions[idx] = code
+            self.step(actions)
+            idx = idx[self.status[idx] == UNSETTLED]
+        doubled = (self.bets > BET).astype(np.uint8)
+        return init_scores, first_actions, self.status.copy(), self.rates.copy(), self.retries.copy(), doubled
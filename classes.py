@@ -1,7 +1,12 @@
+import os
+import queue
 import pickle
 import socket
+import threading
 import numpy as np
+from collections import deque
 from enum import Enum
+from config import N_DECKS, MAX_CARDS_PER_GAME
 
 
 # プレイヤーの取り得る行動の定義
@@ -23,20 +28,129 @@ class Strategy(Enum):
     MANUAL = 4 # myGame.pyでのみ有効（それ以外のケースではRANDOMと解釈される）
 
 
+# カードIDで引くカード情報の表（ディーラー内部のカードIDは 52 * N_DECKS 未満，プレイヤーに通知されるカードIDは 52 未満）
+# カードごとに剰余や文字列の組み立てを行わずに済むよう，モジュールの読み込み時に1度だけ作成する
+#   - CARD_FACES: プレイヤーに通知するカードID（スートと数字のみ．0～51）
+#   - CARD_RANKS: 数字のインデックス（0: A, 1: 2, ..., 9: 10, 10: J, 11: Q, 12: K）
+#   - CARD_VALUES: ブラックジャックでの値（A は 1，J・Q・K は 10）
+#   - CARD_IS_ACE: A か否か
+#   - CARD_NAMES: 表示名（'Spade-A' など．get_card_info の戻り値．従来どおり，ID 52 以降のスートは全て 'Heart' になる）
+CARD_SUIT_NAMES = ('Spade', 'Club', 'Diamond', 'Heart')
+CARD_RANK_NAMES = ('A', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K')
+CARD_FACES = tuple(c % 52 for c in range(52 * N_DECKS))
+CARD_RANKS = tuple(c % 13 for c in range(52 * N_DECKS))
+CARD_VALUES = tuple(min(10, r + 1) for r in CARD_RANKS)
+CARD_IS_ACE = tuple(r == 0 for r in CARD_RANKS)
+CARD_NAMES = tuple(CARD_SUIT_NAMES[min(c // 13, 3)] + '-' + CARD_RANK_NAMES[c % 13] for c in range(52 * N_DECKS))
+
+
+# シャッフル済みのカード列（シュー）を前もってまとめて生成しておき，要求に応じて1つずつ払い出すクラス
+# depth 個のシューを (depth, n_cards) の配列として1回の呼び出しで生成する
+# 同じ乱数生成器を使う限り，払い出されるシューの列は depth や生成のタイミングに関係なく同じになる
+#   - n_cards: 1つのシューのカード枚数
+#   - depth: 一度に生成するシューの数（プールの深さ）
+#   - rng: シャッフルに使用する乱数生成器（numpy.random.Generator）．省略時は新たに作成
+#   - background: True の場合，プールの残りが半分を下回った時点で次のシューの生成をバックグラウンドスレッドに依頼する
+class ShoeFactory:
+
+    # 全ての ShoeFactory で共有するバックグラウンドスレッドへの依頼キュー（プロセスごとに1つ）
+    refill_queue = None
+    refill_pid = None
+
+    def __init__(self, n_cards: int, depth=64, rng=None, background=True):
+        self.n_cards = n_cards
+        self.depth = max(1, depth)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.background = background
+        self.pool = deque()
+        self.cond = threading.Condition()
+        self.refilling = False # 生成中または生成を依頼済みか否か（同じ乱数生成器を同時に使わないようにする）
+        self.n_generated = 0 # これまでに生成したシューの数
+
+    # バックグラウンドスレッドの処理（依頼された ShoeFactory のシューを順番に生成する）
+    @staticmethod
+    def refill_worker(q):
+        while True:
+            q.get().refill()
+
+    # バックグラウンドスレッドに生成を依頼（スレッドはプロセスごとに最初の依頼時に起動する）
+    @staticmethod
+    def request_refill(factory):
+        if ShoeFactory.refill_pid != os.getpid():
+            ShoeFactory.refill_queue = queue.SimpleQueue()
+            ShoeFactory.refill_pid = os.getpid()
+            threading.Thread(target=ShoeFactory.refill_worker, args=(ShoeFactory.refill_queue,), daemon=True).start()
+        ShoeFactory.refill_queue.put(factory)
+
+    # depth 個のシューをまとめて生成してプールに追加（呼び出し前に refilling を True にしておくこと）
+    def refill(self):
+        shoes = self.rng.permuted(np.broadcast_to(np.arange(self.n_cards), (self.depth, self.n_cards)), axis=1)
+        with self.cond:
+            self.pool.extend(shoes)
+            self.n_generated += self.depth
+            self.refilling = False
+            self.cond.notify_all()
+
+    # シューを1つ取り出す
+    def next_shoe(self):
+        with self.cond:
+            while not self.pool and self.refilling:
+                self.cond.wait() # バックグラウンドでの生成が終わるのを待つ
+            generate_now = not self.pool
+            if generate_now:
+                self.refilling = True
+        if generate_now:
+            self.refill() # プールが空の場合はその場で生成
+        with self.cond:
+            shoe = self.pool.popleft()
+            request = self.background and not self.refilling and len(self.pool) < self.depth // 2
+            if request:
+                self.refilling = True
+        if request:
+            ShoeFactory.request_refill(self)
+        return shoe
+
+
 # カードセット
+#   - n_decks: 使用するデッキの数
+#   - rng: シャッフルに使用する乱数生成器（numpy.random.Generator）．省略時は numpy のグローバル乱数を使用
+#   - shoe_factory: 指定した場合は，シャッフルの代わりに ShoeFactory から新しいシューを受け取る
 class CardSet:
 
-    def __init__(self, n_decks: int):
+    __slots__ = ('n_cards', 'all_cards', 'rng', 'shoe_factory', 'pos')
+
+    def __init__(self, n_decks: int, rng=None, shoe_factory=None):
         self.n_cards = 52 * n_decks
         self.all_cards = np.arange(0, self.n_cards)
+        self.rng = rng
+        self.shoe_factory = shoe_factory
         self.pos = -1
         self.shuffle()
 
     # シャッフル
+    # 乱数生成器を指定した場合は，ShoeFactory を使う場合と同じカード列になるよう毎回初期順序のカードをシャッフルする
+    # いずれの場合も新しい配列にシャッフル結果を格納し，それまでのカード列は書き換えない（snapshot を参照）
     def shuffle(self):
-        np.random.shuffle(self.all_cards)
+        if self.shoe_factory is not None:
+            self.all_cards = self.shoe_factory.next_shoe()
+        elif self.rng is not None:
+            self.all_cards = np.arange(0, self.n_cards)
+            self.rng.shuffle(self.all_cards)
+        else:
+            cards = self.all_cards.copy()
+            np.random.shuffle(cards)
+            self.all_cards = cards
         self.pos = 0
 
+    # 現在の状態（カード列, 次に引くカードの位置）を取得
+    # カード列は書き換えられることがないため，コピーせずに参照を保持する（コピーオンライト）
+    def snapshot(self):
+        return self.all_cards, self.pos
+
+    # snapshot で取得した状態に戻す
+    def restore(self, state):
+        self.all_cards, self.pos = state
+
     # 1枚ドロー
     def draw(self):
         card = self.all_cards[self.pos]
@@ -49,67 +163,132 @@ class CardSet:
 
 
 # 手札
+# カードの追加・破棄のたびにハードの合計（A を 1 として数えた合計）と A の枚数を更新しておき，
+# スコアやバースト・ナチュラルブラックジャックの判定は再計算なしで行う
+# カードは最大枚数分を確保したバッファに格納し，clear ではバッファを作り直さない
 class Hand:
 
-    def __init__(self):
-        self.clear()
+    __slots__ = ('buf', 'n', 'hard_total', 'n_aces', '_view')
 
-    # i枚目を取得
+    # capacity: 最初に確保しておくカード枚数（超えた場合のみバッファを拡張する）
+    def __init__(self, capacity=MAX_CARDS_PER_GAME):
+        self.buf = [0] * capacity # カードIDのバッファ（先頭 n 枚が手札）
+        self.n = 0
+        self.hard_total = 0 # A を 1 として数えた合計
+        self.n_aces = 0 # A の枚数
+        self._view = HandView(self)
+
+    # i枚目を取得（負の値は最後から数える．スライスの場合は手札の部分だけを対象にしたリストを返す）
     def __getitem__(self, i):
-        return self.cards[i]
+        if isinstance(i, slice):
+            return self.buf[:self.n][i] # バッファの n 枚目以降（破棄したカードなど）は含めない
+        if i < 0:
+            i += self.n
+        if i < 0 or i >= self.n:
+            raise IndexError('hand index out of range')
+        return self.buf[i]
 
     # 手札の枚数
     def __len__(self):
-        return len(self.cards)
+        return self.n
     def length(self):
-        return len(self.cards)
+        return self.n
+
+    # 手札のカードID（コピーしたタプル）
+    @property
+    def cards(self):
+        return tuple(self.buf[:self.n])
+
+    # 読み出し専用のビューを取得（手札と同じ内容を常に反映する．コピーは作らない）
+    def view(self):
+        return self._view
 
     # カード c を追加
     def append(self, c):
-        self.cards.append(c)
+        if self.n < len(self.buf):
+            self.buf[self.n] = c
+        else:
+            self.buf.append(c) # 確保した枚数を超えた場合のみ拡張
+        self.n += 1
+        self.hard_total += CARD_VALUES[c]
+        if CARD_IS_ACE[c]:
+            self.n_aces += 1
 
     # 一番最後に取得したカードを破棄
     def pop(self):
-        self.cards.pop()
+        self.n -= 1
+        c = self.buf[self.n]
+        self.hard_total -= CARD_VALUES[c]
+        if CARD_IS_ACE[c]:
+            self.n_aces -= 1
 
-    # 手札をクリア（0枚にする）
+    # 手札をクリア（0枚にする．バッファはそのまま再利用する）
     def clear(self):
-        self.cards = []
+        self.n = 0
+        self.hard_total = 0
+        self.n_aces = 0
+
+    # 現在の手札を取得（restore で元に戻せる）
+    def snapshot(self):
+        return tuple(self.buf[:self.n])
+
+    # snapshot で取得した手札に戻す
+    def restore(self, state):
+        self.clear()
+        for c in state:
+            self.append(c)
 
-    # 現在のスコアを計算
+    # 現在のスコアを計算（A は1枚だけ，21を超えない場合に 11 として数える）
     def get_score(self):
-        tmp = []
-        have_ace = False
-        for i in self.cards:
-            j = min(10, (i % 13) + 1)
-            if j != 1:
-                tmp.append(j)
-            else:
-                if have_ace:
-                    tmp.append(1)
-                else:
-                    have_ace = True
-        score = sum(tmp)
-        if have_ace:
-            if score + 11 > 21:
-                score += 1
-            else:
-                score += 11
-        return score
+        if self.n_aces > 0 and self.hard_total <= 11:
+            return self.hard_total + 10
+        return self.hard_total
+
+    # A を 11 として数えている（ソフトハンドである）か否かを判定
+    def is_soft(self):
+        return self.n_aces > 0 and self.hard_total <= 11
 
     # ナチュラルブラックジャックか否かを判定
     def is_nbj(self):
-        if self.get_score() == 21 and len(self.cards) == 2:
-            return True
-        else:
-            return False
+        return self.n == 2 and self.get_score() == 21
 
     # バーストか否かを判定
     def is_busted(self):
-        if self.get_score() > 21:
-            return True
-        else:
-            return False
+        return self.hard_total > 21
+
+
+# 手札の読み出し専用ビュー（Hand.view で取得）
+# 状態取得のたびに手札をコピーせずに済むよう，元の手札を参照したまま読み出し用のメソッドだけを提供する
+class HandView:
+
+    __slots__ = ('_hand',)
+
+    def __init__(self, hand: Hand):
+        self._hand = hand
+
+    def __getitem__(self, i):
+        return self._hand[i]
+
+    def __len__(self):
+        return self._hand.n
+    def length(self):
+        return self._hand.n
+
+    @property
+    def cards(self):
+        return self._hand.cards
+
+    def get_score(self):
+        return self._hand.get_score()
+
+    def is_soft(self):
+        return self._hand.is_soft()
+
+    def is_nbj(self):
+        return self._hand.is_nbj()
+
+    def is_busted(self):
+        return self._hand.is_busted()
 
 
 # 行動名の取得
@@ -128,37 +307,111 @@ def get_action_name(action: Action):
         return 'UNDEFINED'
 
 
-# カードのスート・数字を取得
+# カードのスート・数字を取得（'Spade-A' など）
 def get_card_info(card):
-
-    n = (card % 13) + 1
-    if n == 1:
-        num = 'A'
-    elif n == 11:
-        num = 'J'
-    elif n == 12:
-        num = 'Q'
-    elif n == 13:
-        num = 'K'
-    else:
-        num = '{0}'.format(n)
-
-    s = card // 13
-    if s == 0:
-        suit = 'Spade'
-    elif s == 1:
-        suit = 'Club'
-    elif s == 2:
-        suit = 'Diamond'
+    return CARD_NAMES[card]
+
+
+# テキストプロトコルで受信した行動結果メッセージを解析
+# 戻り値は (player_card, score, status, rate, dealer_cards) のタプル（プレイヤーカードが通知されない場合 player_card は None）
+#   - msg: 受信したメッセージテキスト
+#   - with_player_card: プレイヤーカードの種類が通知されているか否か
+#   - with_dealer_cards: ディーラーの手札が通知されているか否か
+def parse_result_message(msg: str, with_player_card=False, with_dealer_cards=False):
+    fields = msg.split(',')
+    player_card = None
+    if with_player_card:
+        player_card = int(fields[0])
+        fields = fields[1:]
+    score = int(fields[0])
+    status = fields[1]
+    rate = float(fields[2])
+    dealer_cards = []
+    if with_dealer_cards:
+        dealer_cards = [int(f) for f in fields[3:]]
+    return player_card, score, status, rate, dealer_cards
+
+
+# セッションオプション（'seed=123,key=value' 形式の文字列）を辞書に変換
+# 形式が正しくない項目は無視する
+def parse_session_options(text: str):
+    options = {}
+    for item in text.split(','):
+        key, sep, value = item.partition('=')
+        if sep and key:
+            options[key.strip()] = value.strip()
+    return options
+
+
+# 辞書をセッションオプションの文字列に変換（値が None の項目は含めない）
+def format_session_options(options: dict):
+    return ','.join('{0}={1}'.format(k, v) for k, v in options.items() if v is not None)
+
+
+# ディーラープログラムに接続したソケットを作成
+#   - host, port: TCPで接続する場合のホスト名とポート番号
+#   - uds_path: Unixドメインソケットで接続する場合のパス（指定した場合は host, port は使用しない）
+#   - timeout: 接続時のタイムアウト（秒）．接続後のソケットはブロッキングモードになる
+def open_dealer_socket(host: str, port: int, uds_path='', timeout=None):
+    if uds_path:
+        soc = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        soc.settimeout(timeout)
+        try:
+            soc.connect(uds_path)
+        except OSError:
+            soc.close()
+            raise
     else:
-        suit = 'Heart'
+        soc = socket.create_connection((host, port), timeout=timeout)
+        try:
+            soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        except OSError:
+            pass
+    soc.settimeout(None)
+    return soc
+
+
+# ディーラーとの通信路の基底クラス
+# ソケットの代わりに Player の各メソッドの dsoc 引数として渡すことができる
+# （バイナリプロトコルなど，テキストメッセージ以外の方法でディーラーとやり取りする場合に使用）
+class DealerChannel:
+
+    # ディーラーへコマンド（'hit', 'stand', 'double_down', 'surrender', 'retry', 'next' など）を送信
+    def send_command(self, cmd: str):
+        raise NotImplementedError
 
-    return suit + '-' + num
+    # 複数のコマンドを応答を待たずにまとめて送信（パイプライン化）
+    def send_commands(self, cmds):
+        for cmd in cmds:
+            self.send_command(cmd)
+
+    # send_commands で複数のコマンドをまとめて送信できるか否か（応答がコマンドごとに区切られて届く場合のみ True）
+    def supports_pipelining(self):
+        return False
+
+    # 「カードシャッフルを行ったか否か」の情報を受信
+    #   - options: 最初のゲームでディーラーに伝えるセッションオプション（parse_session_options の形式）
+    def recv_shuffle_status(self, options=''):
+        raise NotImplementedError
+
+    # 初期カード情報 (dc, pc1, pc2) を受信
+    def recv_init_cards(self):
+        raise NotImplementedError
+
+    # 行動結果を受信（戻り値は parse_result_message と同じ形式）
+    def recv_result(self, with_player_card=False, with_dealer_cards=False):
+        raise NotImplementedError
+
+    # 通信路を閉じる
+    def close(self):
+        pass
 
 
 # プレイヤークラス
 class Player:
 
+    __slots__ = ('initial_money', 'basic_bet', 'money', 'current_bet', 'player_hand', 'dealer_hand', 'session_options', 'options_sent_to')
+
     # コンストラクタ
     #   - initial_money: 初期所持金
     #   - basic_bet: 基本ベット額
@@ -178,6 +431,10 @@ class Player:
         self.player_hand = Hand() # プレイヤーの手札
         self.dealer_hand = Hand() # ディーラーの手札（見えているもののみ）
 
+        # 接続後の最初のゲームでディーラーに伝えるセッションオプション（シューのシードなど）
+        self.session_options = {}
+        self.options_sent_to = None # セッションオプションを伝え済みの通信路（同じ接続の2ゲーム目以降は送らない）
+
     # 現在のプレイヤースコアを取得
     def get_score(self):
         return self.player_hand.get_score()
@@ -196,7 +453,7 @@ class Player:
 
     # 現在のプレイヤーカードの枚数を取得
     def get_num_player_cards(self):
-        return len(self.player_hand.cards)
+        return len(self.player_hand)
 
     # ベットの設定
     def set_bet(self):
@@ -223,11 +480,38 @@ class Player:
     def consume_money(self, price: int):
         self.money -= price
 
+    # カードセット（シュー）のシャッフルに使う乱数シードをディーラーに要求する
+    # 接続後の最初のゲームで伝えられ，そのセッションのカード列は他の接続の有無に関係なく再現可能になる（None で要求しない）
+    def set_shoe_seed(self, seed):
+        self.session_options['seed'] = seed
+
+    # ディーラーに着くテーブルのIDを要求する（英数字と '_', '-', '.' のみ．None で要求しない）
+    # 同じIDを指定した接続は同じシューの続きでゲームを行い，他の接続のカードの引き方の影響を受けない
+    def set_table(self, table_id):
+        self.session_options['table'] = table_id
+
+    # 同じ接続のまま次のゲームを開始するようディーラーに要求
+    # （前のゲームの決着後に呼び出す．この後は receive_card_shuffle_status から通常どおりゲームを進める）
+    #   - dsoc: ディーラーとの間でのメッセージを送受信するためのソケット（または DealerChannel）
+    def request_next_game(self, dsoc: socket.socket):
+        self.send_message(dsoc, 'next')
+
     # ディーラーから「カードシャッフルを行ったか否か」の情報を取得
     # シャッフルが行われた場合は True を, 行われなかった場合は False を返す
-    #   - dsoc: ディーラーとの間でのメッセージを送受信するためのソケット
+    # セッションオプションは接続後の最初のゲームでのみ伝える（ディーラーは2ゲーム目以降のオプションを使わないため）
+    #   - dsoc: ディーラーとの間でのメッセージを送受信するためのソケット（または DealerChannel）
     def receive_card_shuffle_status(self, dsoc: socket.socket):
+        options = ''
+        if dsoc is not self.options_sent_to:
+            options = format_session_options(self.session_options)
+            self.options_sent_to = dsoc
+        if isinstance(dsoc, DealerChannel):
+            return dsoc.recv_shuffle_status(options)
         msg = dsoc.recv(1024).decode("utf-8").split(',')
+        if options:
+            # 確認応答にセッションオプションを付けて返送すると，オプションを適用して配ったゲームのシャッフル状況が改めて通知される
+            dsoc.send(bytes('ack,' + options, 'utf-8'))
+            msg = dsoc.recv(1024).decode("utf-8").split(',')
         dsoc.send(bytes('ack', 'utf-8')) # 確認応答を返送
         if msg[1] == 'yes':
             return True
@@ -235,12 +519,15 @@ class Player:
             return False
 
     # ディーラーから初期カード情報を受信
-    #   - dsoc: ディーラーとの間でのメッセージを送受信するためのソケット
+    #   - dsoc: ディーラーとの間でのメッセージを送受信するためのソケット（または DealerChannel）
     def receive_init_cards(self, dsoc: socket.socket):
-        msg = dsoc.recv(1024).decode("utf-8").split(',')
-        dc = int(msg[0])
-        pc1 = int(msg[1])
-        pc2 = int(msg[2])
+        if isinstance(dsoc, DealerChannel):
+            dc, pc1, pc2 = dsoc.recv_init_cards()
+        else:
+            msg = dsoc.recv(1024).decode("utf-8").split(',')
+            dc = int(msg[0])
+            pc1 = int(msg[1])
+            pc2 = int(msg[2])
         self.dealer_hand.clear()
         self.player_hand.clear()
         self.dealer_hand.append(dc)
@@ -249,32 +536,44 @@ class Player:
         return dc, pc1, pc2
 
     # ディーラーへのメッセージ送信
-    #   - dsoc: ディーラーとの間でのメッセージを送受信するためのソケット
+    #   - dsoc: ディーラーとの間でのメッセージを送受信するためのソケット（または DealerChannel）
     #   - msg: ディーラーに送信するメッセージテキスト
     def send_message(self, dsoc: socket.socket, msg: str):
-        dsoc.send(bytes(msg, 'utf-8'))
+        if isinstance(dsoc, DealerChannel):
+            dsoc.send_command(msg)
+        else:
+            dsoc.send(bytes(msg, 'utf-8'))
+
+    # 複数のメッセージを応答を待たずにまとめて送信（can_pipeline が True の場合のみ使用できる）
+    # ゲームを決着させる行動と 'next' をまとめて送ると，次のゲームの要求に1往復分待たずに済む
+    #   - dsoc: ディーラーとの通信路（DealerChannel）
+    #   - msgs: ディーラーに送信するメッセージテキストのリスト
+    def send_messages(self, dsoc, msgs):
+        dsoc.send_commands(msgs)
+
+    # ディーラーとの通信路が複数のメッセージのまとめての送信（パイプライン化）に対応しているか否か
+    # （テキスト形式のソケットではメッセージの区切りがないため対応しない）
+    @staticmethod
+    def can_pipeline(dsoc):
+        return isinstance(dsoc, DealerChannel) and dsoc.supports_pipelining()
 
     # ディーラーからのメッセージ受信
-    #   - dsoc: ディーラーとの間でのメッセージを送受信するためのソケット
+    #   - dsoc: ディーラーとの間でのメッセージを送受信するためのソケット（または DealerChannel）
     #   - get_player_card: プレイヤーカードの種類を通知するか否か
     #   - get_dealer_cards: ディーラーの手札を通知するか否か
     #   - retry_mode: RETRY実行時か否か
     def receive_message(self, dsoc: socket.socket, get_player_card=False, get_dealer_cards=False, retry_mode=False):
-        msg = dsoc.recv(1024).decode("utf-8").split(',')
+        if isinstance(dsoc, DealerChannel):
+            player_card, score, status, rate, dealer_cards = dsoc.recv_result(with_player_card=get_player_card, with_dealer_cards=get_dealer_cards)
+        else:
+            msg = dsoc.recv(1024).decode("utf-8")
+            player_card, score, status, rate, dealer_cards = parse_result_message(msg, with_player_card=get_player_card, with_dealer_cards=get_dealer_cards)
         if get_player_card:
-            player_card = int(msg[0])
             if retry_mode:
                 self.player_hand.pop()
             self.player_hand.append(player_card)
-            msg = msg[1:]
-        status = msg[1]
-        score = int(msg[0])
-        rate = float(msg[2])
         if get_dealer_cards:
-            dealer_cards = []
-            for i in range(3, len(msg)):
-                dc = int(msg[i])
-                dealer_cards.append(dc)
+            for dc in dealer_cards:
                 self.dealer_hand.append(dc)
             if get_player_card:
                 return player_card, score, status, rate, dealer_cards
@@ -293,10 +592,13 @@ class QTable:
     # コンストラクタ
     #   - action_class: 行動クラスの名称
     #   - default_value: まだ一度も試していない行動の初期Q値
-    def __init__(self, action_class, default_value=0):
+    #   - rng: 同じQ値を持つ行動からの選択に使う乱数生成器（numpy.random.Generator）．省略時は numpy のグローバル乱数を使用
+    def __init__(self, action_class, default_value=0, rng=None):
         self.ActionClass = action_class
         self.default_value = default_value
         self.table = {}
+        self.actions = tuple(a for a in action_class if a != action_class.UNDEFINED) # 選択対象の行動（UNDEFINED 以外）
+        self.randint = rng.integers if rng is not None else np.random.randint
 
     # 状態 state の下で行動 action を実行する場合のQ値として value をセットする
     def set_Q_value(self, state, action, value):
@@ -305,40 +607,38 @@ class QTable:
 
     # 状態 state の下で行動 action を実行する場合のQ値
     def get_Q_value(self, state, action):
-        key = (state, action)
-        if key in self.table.keys():
-            return self.table[key]
-        else:
-            return self.default_value
+        return self.table.get((state, action), self.default_value)
 
     # 状態 state の下でQ値が最大となる行動を取得（同じQ値を持つ行動が複数ある場合は，その中からランダム選択）
+    # テーブルは変更しない（値をセットしていない行動は default_value として扱う）
+    # 同じQ値の行動の数を数えてから乱数で何番目かを決めるため，候補のリストは作らない
     #   - with_value: Trueの場合，Q値最大の行動とともに，そのときのQ値も返される
     def get_best_action(self, state, with_value=False):
-        # ensure the state has entries for all actions so Q-table is complete for selection
-        try:
-            self.ensure_state(state)
-        except Exception:
-            pass
-        best_actions = []
+        table = self.table
+        default = self.default_value
+        best_action = None
         best_value = -float('inf')
-        for a in self.ActionClass:
-            if a == self.ActionClass.UNDEFINED:
-                continue
-            q = self.get_Q_value(state, a)
-            if len(best_actions) == 0:
-                best_actions.append(a)
-                best_value = q
-            else:
-                if q < best_value:
-                    continue
-                elif q > best_value:
-                    best_actions.clear()
-                best_actions.append(a)
+        n_best = 0
+        for a in self.actions:
+            q = table.get((state, a), default)
+            if best_action is None or q > best_value:
+                best_action = a
                 best_value = q
+                n_best = 1
+            elif q == best_value:
+                n_best += 1
+        if n_best > 1:
+            k = self.randint(n_best)
+            for a in self.actions:
+                if table.get((state, a), default) == best_value:
+                    if k == 0:
+                        best_action = a
+                        break
+                    k -= 1
         if with_value:
-            return np.random.choice(best_actions), best_value
+            return best_action, best_value
         else:
-            return np.random.choice(best_actions)
+            return best_action
 
     # Qテーブルをファイルに保存
     def save(self, filename: str):
@@ -352,9 +652,182 @@ class QTable:
 
     # Ensure that for a given state there are Q entries for all possible actions
     def ensure_state(self, state):
-        for a in self.ActionClass:
-            if a == self.ActionClass.UNDEFINED:
-                continue
+        for a in self.actions:
             key = (state, a)
             if key not in self.table:
                 self.table[key] = self.default_value
+
+    # 指定した状態の全ての行動について，値をセットしていないものに default_value をセットする
+    # （全ての行動の値を持つ完全なテーブルとして保存したい場合に呼び出す．get_best_action はテーブルを変更しない）
+    #   - states: 対象の状態のリスト（省略時はテーブルに値が1つ以上ある全ての状態）
+    def materialize_states(self, states=None):
+        if states is None:
+            states = {state for state, _ in self.table}
+        for state in states:
+            self.ensure_state(state)
+
+
+# Qテーブルの状態 (スコア, 手札枚数, RETRYバケット) と配列の添字との対応
+# 範囲外の状態は ValueError とする（丸めると別の状態と同じ添字になり，Q値が混ざるため）
+class QStateEncoder:
+
+    # コンストラクタ
+    #   - n_scores, n_lengths, n_buckets: スコア，手札枚数，RETRYバケットの取り得る値の数
+    def __init__(self, n_scores=32, n_lengths=12, n_buckets=6):
+        self.shape = (n_scores, n_lengths, n_buckets)
+        self.size = n_scores * n_lengths * n_buckets
+
+    # 状態を添字（0 以上 size 未満の整数）に変換
+    # (スコア, 手札枚数) の2要素の状態は RETRYバケット 0 とみなす
+    def encode(self, state):
+        n_scores, n_lengths, n_buckets = self.shape
+        s = int(state[0])
+        l = int(state[1])
+        r = int(state[2]) if len(state) > 2 else 0
+        if not (0 <= s < n_scores and 0 <= l < n_lengths and 0 <= r < n_buckets):
+            raise ValueError('state {0} is outside the encoder shape {1}'.format(state, self.shape))
+        return (s * n_lengths + l) * n_buckets + r
+
+    # 添字を状態に変換
+    def decode(self, index: int):
+        n_scores, n_lengths, n_buckets = self.shape
+        return (index // (n_lengths * n_buckets), index // n_buckets % n_lengths, index % n_buckets)
+
+
+# Qテーブルを NumPy 配列で実現するクラス（QTable と同じメソッドで使える）
+# Q値は形状 (スコア数, 手札枚数の数, RETRYバケット数, 行動数) の float64 配列に格納し，
+# 状態と行動は QStateEncoder と行動の並び順で添字に変換する
+# 一度も値をセットしていない (状態, 行動) は default_value を持ち，to_dict には含めない
+# encoder の範囲外の状態（まれに出現する枚数の多い手札など）は，配列の代わりに辞書形式の QTable（overflow）で扱う
+class DenseQTable:
+
+    # コンストラクタ
+    #   - action_class: 行動クラスの名称
+    #   - default_value: まだ一度も試していない行動の初期Q値
+    #   - encoder: 状態の変換に使う QStateEncoder（省略時は既定の大きさ）
+    #   - rng: 同じQ値を持つ行動からの選択に使う乱数生成器（numpy.random.Generator）．省略時は numpy のグローバル乱数を使用
+    def __init__(self, action_class, default_value=0, encoder=None, rng=None):
+        self.ActionClass = action_class
+        self.default_value = default_value
+        self.encoder = encoder if encoder is not None else QStateEncoder()
+        self.actions = tuple(a for a in action_class if a != action_class.UNDEFINED)
+        self.action_index = {a: i for i, a in enumerate(self.actions)}
+        self.action_codes = np.array([a.value for a in self.actions], dtype=np.uint8)
+        self.values = np.full(self.encoder.shape + (len(self.actions),), default_value, dtype=np.float64)
+        self.flat_values = self.values.reshape(self.encoder.size, len(self.actions)) # 状態を添字で引くためのビュー（values と同じメモリ）
+        self.known = np.zeros((self.encoder.size, len(self.actions)), dtype=bool) # 値をセットしたか否か
+        self.randint = rng.integers if rng is not None else np.random.randint
+        self.overflow = QTable(action_class, default_value=default_value, rng=rng) # encoder の範囲外の状態のQ値
+
+    # Q値と設定済みフラグに，外部で用意した配列（numpy.memmap など）をコピーせずに使う
+    #   - values: 形状 (スコア数, 手札枚数の数, RETRYバケット数, 行動数) の float64 配列
+    #   - known: values と同じ形状の bool 配列
+    def attach(self, values, known):
+        shape = self.encoder.shape + (len(self.actions),)
+        if values.shape != shape or known.shape != shape:
+            raise ValueError('array shape {0} does not match {1}'.format(values.shape, shape))
+        self.values = values
+        self.flat_values = values.reshape(self.encoder.size, len(self.actions))
+        self.known = known.reshape(self.encoder.size, len(self.actions))
+
+    # 状態 state の下で行動 action を実行する場合のQ値として value をセットする
+    def set_Q_value(self, state, action, value):
+        try:
+            i = self.encoder.encode(state)
+        except ValueError:
+            self.overflow.set_Q_value(state, action, value)
+            return
+        j = self.action_index[action]
+        self.flat_values[i, j] = value
+        self.known[i, j] = True
+
+    # 状態 state の下で行動 action を実行する場合のQ値
+    def get_Q_value(self, state, action):
+        try:
+            i = self.encoder.encode(state)
+        except ValueError:
+            return self.overflow.get_Q_value(state, action)
+        return float(self.flat_values[i, self.action_index[action]])
+
+    # 状態 state の下でQ値が最大となる行動を取得（同じQ値を持つ行動が複数ある場合は，その中からランダム選択）
+    # 同点の行動の選択は QTable と同じ乱数の使い方のため，同じ乱数生成器（とシード）なら QTable と同じ行動を選ぶ
+    #   - with_value: Trueの場合，Q値最大の行動とともに，そのときのQ値も返される
+    def get_best_action(self, state, with_value=False):
+        try:
+            row = self.flat_values[self.encoder.encode(state)]
+        except ValueError:
+            return self.overflow.get_best_action(state, with_value=with_value)
+        best_value = row.max()
+        ties = np.flatnonzero(row == best_value)
+        j = ties[self.randint(len(ties))] if len(ties) > 1 else ties[0]
+        if with_value:
+            return self.actions[j], float(best_value)
+        else:
+            return self.actions[j]
+
+    # 複数の状態（encode で変換した添字の配列）について，Q値最大の行動コードをまとめて取得
+    # 同じQ値を持つ行動が複数ある場合は，乱数生成器 rng（numpy.random.Generator）でその中から一様に選ぶ
+    def best_action_codes(self, indices, rng):
+        rows = self.flat_values[indices]
+        is_best = rows == rows.max(axis=1, keepdims=True)
+        return self.action_codes[np.argmax(rng.random(rows.shape) * is_best, axis=1)]
+
+    # 方策テーブル（状態 -> Q値最大の行動コード．形状は encoder.shape）を作成
+    # 値をセットしていない状態と，Q値最大の行動が一意に定まらない状態には 0 を入れる（ai_player_Q.make_policy_table と同じ）
+    def greedy_policy(self):
+        best = self.flat_values.max(axis=1, keepdims=True)
+        is_best = self.flat_values == best
+        unique = (is_best.sum(axis=1) == 1) & self.known.any(axis=1)
+        policy = np.where(unique, self.action_codes[np.argmax(is_best, axis=1)], 0).astype(np.uint8)
+        return policy.reshape(self.encoder.shape)
+
+    # 辞書形式（QTable.table と同じ {(状態, 行動): Q値}）に変換（encoder の範囲外の状態の値も含める）
+    def to_dict(self):
+        table = {}
+        for i, j in zip(*np.nonzero(self.known)):
+            table[(self.encoder.decode(int(i)), self.actions[j])] = float(self.flat_values[i, j])
+        table.update(self.overflow.table)
+        return table
+
+    # 辞書形式のQテーブル（QTable.table や，それを保存したファイルの内容）から作成
+    # (スコア, 手札枚数) の2要素の状態は RETRYバケット 0 とみなす
+    @staticmethod
+    def from_dict(table, action_class, default_value=0, encoder=None, rng=None):
+        q_table = DenseQTable(action_class, default_value=default_value, encoder=encoder, rng=rng)
+        for (state, action), value in table.items():
+            q_table.set_Q_value(state, action, value)
+        return q_table
+
+    # Qテーブルをファイルに保存（QTable.save と同じ形式）
+    def save(self, filename: str):
+        with open(filename, 'wb') as f:
+            pickle.dump(self.to_dict(), f)
+
+    # ファイルからQテーブルをロード（QTable.save の形式と，{'meta': ..., 'table': ...} の形式に対応）
+    def load(self, filename: str):
+        with open(filename, 'rb') as f:
+            loaded = pickle.load(f)
+        if isinstance(loaded, dict) and 'table' in loaded:
+            loaded = loaded['table']
+        self.values.fill(self.default_value)
+        self.known.fill(False)
+        self.overflow.table = {}
+        for (state, action), value in loaded.items():
+            self.set_Q_value(state, action, value)
+
+    # 状態 state の全ての行動について値をセットしたことにする（値は変えない）
+    def ensure_state(self, state):
+        try:
+            self.known[self.encoder.encode(state)] = True
+        except ValueError:
+            self.overflow.ensure_state(state)
+
+    # 指定した状態の全ての行動について値をセットしたことにする（QTable.materialize_states と同じ）
+    #   - states: 対象の状態のリスト（省略時は値が1つ以上ある全ての状態）
+    def materialize_states(self, states=None):
+        if states is None:
+            self.known[self.known.any(axis=1)] = True
+            self.overflow.materialize_states()
+        else:
+            for state in states:
+                self.ensure_state(state)
@@ -1,12 +1,38 @@
+import os
+import sys
+import time
+import bisect
+import threading
+import signal
+import select
 import socket
+import struct
+import asyncio
+import argparse
+import itertools
+import multiprocessing
 import numpy as np
-from classes import Action, CardSet, Hand
+from collections import deque, namedtuple
+from classes import Action, CardSet, Hand, ShoeFactory, DealerChannel, parse_session_options, CARD_FACES, CARD_VALUES, CARD_IS_ACE
 from config import PORT, N_DECKS, SHUFFLE_INTERVAL, SHUFFLE_THRESHOLD, MAX_CARDS_PER_GAME
+from protocol import PROTOCOL_VERSION, HELLO_MAGIC, STATUS_CODES, STATUS_NAMES, FRAME_ACTION, FRAME_NEXT, FRAME_BATCH, FRAME_BATCH_END, BATCH_RECORDS_PER_FRAME, FrameBuffer
+from protocol import decode_hello, encode_frame, encode_game, encode_result, decode_batch_request, encode_batch_result
+from journal import JournalWriter
+
+
+# ディーラーの状態（Dealer.snapshot の戻り値）
+#   - card_set: CardSet.snapshot の戻り値（カード列は参照のみ保持する）
+#   - dealer_cards, player_cards: 各手札（Hand.snapshot の戻り値）
+#   - game_ID, game_start_pos, game_actions: ゲームIDと，ジャーナルへの記録用の現在のゲームの情報
+DealerSnapshot = namedtuple('DealerSnapshot', ['card_set', 'dealer_cards', 'player_cards', 'game_ID', 'game_start_pos', 'game_actions'])
 
 
 # ディーラークラス
 class Dealer():
 
+    __slots__ = ('n_decks', 'shuffle_interval', 'shuffle_threshold', 'max_cards_per_game', 'rng', 'shoe_factory', 'card_set',
+                 'dealer_hand', 'player_hand', 'game_ID', 'journal', 'journal_id', 'session_id', 'game_start_pos', 'game_actions')
+
     # カードIDからスートと数字の情報のみを抽出するスタティックメソッド
     # 戻り値の整数を13で割ったときの商 a, 余りを b として，
     #   - a: スート（0: スペード，1:クラブ，2:ダイヤ，3:ハート）
@@ -14,14 +40,18 @@ class Dealer():
     # となる
     @staticmethod
     def get_info(card):
-        return card % 52
+        return CARD_FACES[card]
 
     # コンストラクタ
     #   - n_decks: 使用するデッキの数
     #   - shuffle_interval: 何ゲームに1回の割合でカードシャッフルを行うか
     #   - shuffle_threshold: カードの残数が何枚を下回った時点で強制的にカードシャッフルを行うか
     #   - max_cards_per_game: 1ゲームで引けるカードの最大枚数
-    def __init__(self, n_decks: int, shuffle_interval: int, shuffle_threshold: int, max_cards_per_game: int):
+    #   - rng: 一括プレイ時のランダムな行動選択に使用する乱数生成器（numpy.random.Generator）．省略時は numpy のグローバル乱数を使用
+    #   - shoe_rng: カードシャッフルに使用する乱数生成器．省略時は numpy のグローバル乱数を使用
+    #   - shoe_pool_depth: 0 より大きい場合，この数のシャッフル済みシューを前もってまとめて生成しておく（ShoeFactory）
+    #   - journal: 指定した場合，シューと各ゲームの経過をこのジャーナル（journal.JournalWriter）に記録する
+    def __init__(self, n_decks: int, shuffle_interval: int, shuffle_threshold: int, max_cards_per_game: int, rng=None, shoe_rng=None, shoe_pool_depth=0, journal=None):
 
         # パラメータをメンバ変数にセット
         self.n_decks = n_decks
@@ -29,8 +59,15 @@ class Dealer():
         self.shuffle_threshold = shuffle_threshold
         self.max_cards_per_game = max_cards_per_game
 
+        # 乱数生成器
+        self.rng = rng
+
         # カードセットの用意
-        self.card_set = CardSet(n_decks=self.n_decks)
+        if shoe_pool_depth > 0:
+            self.shoe_factory = ShoeFactory(n_cards=52 * self.n_decks, depth=shoe_pool_depth, rng=shoe_rng)
+        else:
+            self.shoe_factory = None
+        self.card_set = CardSet(n_decks=self.n_decks, rng=shoe_rng, shoe_factory=self.shoe_factory)
 
         # 手札の用意
         self.dealer_hand = Hand() # ディーラーの手札
@@ -39,6 +76,13 @@ class Dealer():
         # ゲームID（現在が何回目のゲームかを示す変数）
         self.game_ID = 0
 
+        # ジャーナルへの記録用
+        self.journal = journal
+        self.journal_id = journal.new_stream_id() if journal is not None else 0 # ジャーナル内でこのディーラーのシューを識別する番号
+        self.session_id = 0 # 現在のプレイヤーのセッション番号
+        self.game_start_pos = 0 # 現在のゲームの開始時のカード位置
+        self.game_actions = bytearray() # 現在のゲームでの行動コードの列
+
     # 勝敗判定の実行
     # 戻り値は (status, rate) のタプル
     #   - status: 勝敗ステータス（'win', 'lose', 'draw' のいずれか）
@@ -82,32 +126,47 @@ class Dealer():
     # カードシャッフルを行った場合は True を，そうでない場合は False を返す
     def initialize_game(self):
 
-        return_value = False
-
         ### 必要ならカードシャッフル ###
-        # 何ゲームかに1回の割合で定期的にシャッフルする場合
-        if self.game_ID % self.shuffle_interval == 0:
+        return_value = self.needs_shuffle()
+        if return_value:
             self.card_set.shuffle()
-            return_value = True
-        # カードの残数が閾値を下回った時点で不定期にシャッフルする場合
-        elif self.get_num_remaining_cards() < self.shuffle_threshold:
-            self.card_set.shuffle()
-            return_value = True
 
         # ゲームIDを 1 増やす
         self.game_ID += 1
 
-        # 前ゲームの手札をクリア
+        # シャッフルした場合は新しいシューをジャーナルに記録
+        if self.journal is not None:
+            if return_value:
+                self.journal.write_shoe(self.journal_id, self.card_set.all_cards)
+            self.game_start_pos = self.card_set.pos
+            self.game_actions.clear() # 書き込み済みのため再利用する
+
+        self.deal_initial_cards()
+
+        return return_value
+
+    # 次のゲームの開始時にカードシャッフルを行うか否か（状態は変更しない）
+    def needs_shuffle(self):
+        # 何ゲームかに1回の割合で定期的にシャッフルする場合
+        if self.game_ID % self.shuffle_interval == 0:
+            return True
+        # カードの残数が閾値を下回った時点で不定期にシャッフルする場合
+        return self.get_num_remaining_cards() < self.shuffle_threshold
+
+    # 前ゲームの手札をクリアし，ディーラーとプレイヤーに2枚ずつカードを配る
+    def deal_initial_cards(self):
         self.dealer_hand.clear()
         self.player_hand.clear()
-
-        # ディーラーとプレイヤーに2枚ずつカードを配る
         self.dealer_hand.append(self.card_set.draw()) # ディーラーの1枚目
         self.dealer_hand.append(self.card_set.draw()) # ディーラーの2枚目
         self.player_hand.append(self.card_set.draw()) # プレイヤーの1枚目
         self.player_hand.append(self.card_set.draw()) # プレイヤーの2枚目
 
-        return return_value
+    # low 以上 high 未満の整数をランダムに選択
+    def random_integer(self, low: int, high: int):
+        if self.rng is not None:
+            return int(self.rng.integers(low, high))
+        return int(np.random.randint(low, high))
 
     # カードの残り枚数を取得
     def get_num_remaining_cards(self):
@@ -126,50 +185,270 @@ class Dealer():
     # ルールに従ってディーラーカードを追加
     # （ディーラーのスコアが17以上になるか，カード使用枚数の上限に達するまで追加）
     def draw_dealer_cards(self):
-        while self.dealer_hand.get_score() < 17 and len(self.dealer_hand.cards) < self.max_cards_per_game:
+        while self.dealer_hand.get_score() < 17 and len(self.dealer_hand) < self.max_cards_per_game:
             self.dealer_hand.append(self.card_set.draw())
 
-    # カードシャッフルを行ったか否かをプレイヤーに通知
-    def send_card_shuffle_status(self, psoc: socket.socket, status: bool):
-        if status:
-            psoc.send(bytes("shuffled,yes", 'utf-8'))
+    # プレイヤーの行動を処理する
+    # 戻り値は (status, rate, send_player_card, send_dealer_cards) のタプル
+    #   - status: 行動実行後のプレイヤーステータス（未定義の行動の場合は 'finished'）
+    #   - rate: 配当倍率
+    #   - send_player_card: プレイヤーカードの種類を通知するか否か
+    #   - send_dealer_cards: ディーラーの手札を通知するか否か
+    def apply_action(self, action: Action):
+        if self.journal is None:
+            return self.resolve_action(action)
+
+        # ジャーナルに記録する場合は行動を記憶しておき，決着したらゲームの経過を書き込む
+        result = self.resolve_action(action)
+        status, rate = result[0], result[1]
+        if status != 'finished':
+            self.game_actions.append(action.value)
+            if status != 'unsettled':
+                cards = self.card_set.all_cards[self.game_start_pos:self.card_set.pos]
+                self.journal.write_game(self.journal_id, self.session_id, self.game_ID, self.game_start_pos, self.game_actions, cards, status, rate)
+        return result
+
+    # プレイヤーの行動を処理する（戻り値は apply_action と同じ．ジャーナルへの記録は行わない）
+    def resolve_action(self, action: Action):
+
+        # HIT の場合
+        if action == Action.HIT:
+            # プレイヤーにカードを1枚配布
+            self.draw_player_card()
+            if self.player_is_busted():
+                return 'bust', 0.0, True, True # プレイヤーがバーストした場合
+            else:
+                return 'unsettled', 0.0, True, False # プレイヤーがバーストしなかった場合
+
+        # STAND の場合
+        elif action == Action.STAND:
+            # ルールに従ってディーラーにカードを追加し，勝敗を判定
+            self.draw_dealer_cards()
+            status, rate = self.judge()
+            return status, rate, False, True
+
+        # DOUBLE DOWNの場合
+        elif action == Action.DOUBLE_DOWN:
+            # プレイヤーにカードを1枚配布
+            self.draw_player_card()
+            if self.player_is_busted():
+                # プレイヤーがバーストした場合
+                status, rate = 'bust', 0.0
+            else:
+                # プレイヤーがバーストしなかった場合 => STAND の場合と同じ処理を実行
+                self.draw_dealer_cards()
+                status, rate = self.judge()
+            return status, rate, True, True
+
+        # SURRENDERの場合
+        elif action == Action.SURRENDER:
+            return 'surrendered', 0.5, False, True
+
+        # RETRYの場合
+        elif action == Action.RETRY:
+            # 最後のカードを破棄してプレイヤーにカードを1枚配布
+            self.draw_player_card(retry_mode=True)
+            if self.player_is_busted():
+                return 'bust', 0.0, True, True # プレイヤーがバーストした場合
+            else:
+                return 'unsettled', 0.0, True, False # プレイヤーがバーストしなかった場合
+
+        # 定義されていないアクションは終了要求とみなす
         else:
-            psoc.send(bytes("shuffled,no", 'utf-8'))
-        ack = psoc.recv(1024).decode("utf-8") # 確認応答を受信
+            return 'finished', 0.0, False, False
 
-    # プレイヤーに初期カード情報を送信
-    #   - psoc: プレイヤーとの間でのメッセージを送受信するためのソケット
-    def send_init_cards(self, psoc: socket.socket):
+    # 方策テーブルに従って現在のゲームを決着までプレイする（一括プレイ用）
+    # 状態は (プレイヤースコア, プレイヤー手札の枚数, RETRYバケット) とし，RETRYバケットは上限の値でまとめる（QLearningAgent.observe と同じ）
+    # スコアか手札枚数がテーブルの範囲外の状態は，値のない状態と同じく未定義として扱う（端の状態の行動は使わない）
+    # 戻り値は (初期スコア, 最初の行動コード, ステータス, 配当倍率, RETRY回数, ダブルダウンしたか否か) のタプル
+    #   - table: 方策テーブル（行動コードを C 順に並べた bytes）
+    #   - shape: 方策テーブルの形状 (スコア数, 手札枚数の数, RETRYバケット数)
+    #   - max_retries: 1ゲームあたりのRETRY回数の上限（上限到達後にRETRYが選ばれた場合は他の行動をランダムに選択）
+    def play_policy_game(self, table, shape, max_retries: int):
+        n_scores, n_lengths, n_buckets = shape
+        init_score = self.player_hand.get_score()
+        first_action = None
+        n_retries = 0
+        doubled = 0
+        while True:
+            s = self.player_hand.get_score()
+            l = len(self.player_hand)
+            r = min(n_retries, n_buckets - 1)
+            code = table[(s * n_lengths + l) * n_buckets + r] if s < n_scores and l < n_lengths else Action.UNDEFINED.value
+            if code == Action.UNDEFINED.value or code > Action.RETRY.value:
+                code = self.random_integer(1, Action.RETRY.value + 1) # 未定義の状態では全行動からランダムに選択
+            if code == Action.RETRY.value and n_retries >= max_retries:
+                code = self.random_integer(1, Action.RETRY.value) # RETRY以外からランダムに選択
+            action = Action(code)
+            if first_action is None:
+                first_action = code
+            status, rate, _, _ = self.apply_action(action)
+            if action == Action.RETRY:
+                n_retries += 1
+            elif action == Action.DOUBLE_DOWN:
+                doubled = 1
+            if status != 'unsettled':
+                return init_score, first_action, status, rate, n_retries, doubled
 
-        # ディーラーカード，プレイヤーカード1枚目，プレイヤーカード2枚目の順で送信
-        dc = Dealer.get_info(self.dealer_hand.cards[0])
-        pc1 = Dealer.get_info(self.player_hand.cards[0])
-        pc2 = Dealer.get_info(self.player_hand.cards[1])
-        psoc.send(bytes("{0},{1},{2}".format(dc, pc1, pc2), 'utf-8'))
+    # 現在の状態を取得（restore で元に戻せる）
+    # シューはコピーせずに参照を保持するため，ゲームの途中で何度呼び出しても負荷は小さい
+    # 乱数生成器の状態は含まない
+    def snapshot(self):
+        return DealerSnapshot(self.card_set.snapshot(), self.dealer_hand.snapshot(), self.player_hand.snapshot(),
+                              self.game_ID, self.game_start_pos, bytes(self.game_actions))
 
-    # プレイヤーへのメッセージ送信
-    #   - psoc: プレイヤーとの間でのメッセージを送受信するためのソケット
-    #   - rate: 配当倍率
-    #   - status: プレイヤーの現在ステータス（勝敗結果，バーストしたか否か，サレンダーを受け付けたか否か，などを表す文字列）
-    #   - send_player_card: プレイヤーカードの種類を通知するか否か
-    #   - send_dealer_cards: ディーラーの手札を通知するか否か
-    def send_message(self, psoc: socket.socket, rate: float, status: str, send_player_card=False, send_dealer_cards=False):
+    # snapshot で取得した状態に戻す
+    def restore(self, snap: DealerSnapshot):
+        self.card_set.restore(snap.card_set)
+        self.dealer_hand.restore(snap.dealer_cards)
+        self.player_hand.restore(snap.player_cards)
+        self.game_ID = snap.game_ID
+        self.game_start_pos = snap.game_start_pos
+        self.game_actions[:] = snap.game_actions
+
+    # 現在の状態（同じシュー・同じ手札）から複数の行動列をそれぞれ最後まで試し，結果を返す
+    # 試した後はディーラーの状態を呼び出し前に戻す（ジャーナルには記録しない）
+    # 戻り値は各行動列に対する (status, rate) のリスト（行動列が決着前に終わった場合は ('unsettled', 0.0)）
+    # HIT を0回以上行った後に STAND・DOUBLE_DOWN・SURRENDER のいずれかで終わる行動列は hit_stand_outcomes でまとめて評価する
+    #   - sequences: 行動（Action または行動コード）の列（リスト・タプル・numpy 配列など）のリスト
+    def rollout(self, sequences):
+        results = [None] * len(sequences)
+
+        # HIT の回数と最後の行動で表せる行動列をまとめる
+        simple = {}
+        for i, seq in enumerate(sequences):
+            last = Dealer.ROLLOUT_FINAL_ACTIONS.get(seq[-1]) if len(seq) > 0 else None
+            if last is not None and all(a in (Action.HIT, Action.HIT.value) for a in seq[:-1]):
+                simple[i] = (len(seq) - 1, last)
+        if simple:
+            outcomes = self.hit_stand_outcomes(max(n for n, a in simple.values()) + 1)
+            if outcomes is None:
+                simple = {} # シューの残りが少ない場合は1つずつ試す
+            else:
+                busted, codes, rates = outcomes
+                for i, (n_hits, last) in simple.items():
+                    k = n_hits + 1 if last == Action.DOUBLE_DOWN else n_hits
+                    if busted[k]:
+                        results[i] = ('bust', 0.0)
+                    elif last == Action.SURRENDER:
+                        results[i] = ('surrendered', 0.5)
+                    else:
+                        results[i] = (STATUS_NAMES[codes[k]], rates[k])
+
+        # それ以外の行動列は，状態を戻しながら1つずつ試す
+        if len(simple) < len(sequences):
+            snap = self.snapshot()
+            try:
+                for i, seq in enumerate(sequences):
+                    if i in simple:
+                        continue
+                    self.restore(snap)
+                    status, rate = 'unsettled', 0.0
+                    for action in seq:
+                        status, rate, _, _ = self.resolve_action(Action(action))
+                        if status != 'unsettled':
+                            break
+                    results[i] = (status, rate)
+            finally:
+                self.restore(snap)
+        return results
+
+    # rollout で hit_stand_outcomes を使って評価できる行動列の最後の行動（Action と行動コードのどちらでも引けるようにしておく）
+    ROLLOUT_FINAL_ACTIONS = {key: a for a in (Action.STAND, Action.DOUBLE_DOWN, Action.SURRENDER) for key in (a, a.value)}
+
+    # 現在の状態から「HIT を k 回行った後に STAND した場合」の結果を k = 0, 1, ..., max_hits についてまとめて計算する
+    # どの k でもプレイヤーはシュー上の位置 pos から順に引き，ディーラーは pos + k から引くため，
+    # プレイヤーの手札は k について累積的に，ディーラーの手札は k ごとに1回だけ計算すれば全ての行動列の結果が求まる
+    # （DOUBLE_DOWN は「HIT をもう1回行った後に STAND」と同じ結果になる）
+    # 戻り値は長さ max_hits+1 のリスト (busted, status_codes, rates) のタプル（状態は変更しない）
+    #   - busted: HIT を k 回行った時点でプレイヤーがバーストしているか否か（バーストしている場合，status_codes と rates の値は無意味）
+    #   - status_codes: STAND 後の勝敗ステータス（protocol.STATUS_CODES の値）
+    #   - rates: STAND 後の配当倍率
+    # シューの残りが足りず途中でカードが尽きる可能性がある場合は None を返す
+    def hit_stand_outcomes(self, max_hits: int):
+        pos = self.card_set.pos
+        if pos + max_hits + self.max_cards_per_game > self.card_set.n_cards:
+            return None
+        upcoming = self.card_set.all_cards[pos:pos + max_hits + self.max_cards_per_game].tolist()
+        values = [CARD_VALUES[c] for c in upcoming]
+        aces = [CARD_IS_ACE[c] for c in upcoming]
+
+        # ディーラーの初期手札（2枚で21ならナチュラルブラックジャックで，それ以上は引かない）
+        n_dealer = len(self.dealer_hand)
+        d_hard0 = self.dealer_hand.hard_total
+        d_ace0 = self.dealer_hand.n_aces > 0
+        d_nbj = self.dealer_hand.is_nbj()
+
+        p_hard = self.player_hand.hard_total
+        p_ace = self.player_hand.n_aces > 0
+        busted, codes, rates = [], [], []
+        for k in range(max_hits + 1):
+            if k > 0:
+                p_hard += values[k - 1]
+                p_ace = p_ace or aces[k - 1]
+            busted.append(p_hard > 21)
+            p_score = p_hard + 10 if p_ace and p_hard <= 11 else p_hard
+            p_nbj = k == 0 and len(self.player_hand) == 2 and p_score == 21
+
+            # ディーラーはシュー上の位置 pos + k から，スコアが17以上になるか手札の枚数が上限に達するまで引く
+            d_hard, d_ace, n, j = d_hard0, d_ace0, n_dealer, k
+            d_score = d_hard + 10 if d_ace and d_hard <= 11 else d_hard
+            while d_score < 17 and n < self.max_cards_per_game:
+                d_hard += values[j]
+                d_ace = d_ace or aces[j]
+                d_score = d_hard + 10 if d_ace and d_hard <= 11 else d_hard
+                n += 1
+                j += 1
+
+            # 勝敗判定（Dealer.judge と同じ順序）
+            if p_nbj:
+                status, rate = ('draw', 1.0) if d_nbj else ('win', 2.5)
+            elif d_score > 21:
+                status, rate = 'win', 2.0
+            elif d_nbj:
+                status, rate = 'lose', 0.0
+            elif p_score > d_score:
+                status, rate = 'win', 2.0
+            elif p_score < d_score:
+                status, rate = 'lose', 0.0
+            else:
+                status, rate = 'draw', 1.0
+            codes.append(STATUS_CODES[status])
+            rates.append(rate)
+        return busted, codes, rates
+
+    # カードシャッフルを行ったか否かを通知するメッセージを作成
+    @staticmethod
+    def make_card_shuffle_status(status: bool):
+        if status:
+            return "shuffled,yes"
+        else:
+            return "shuffled,no"
+
+    # 初期カード情報を通知するメッセージを作成
+    # ディーラーカード，プレイヤーカード1枚目，プレイヤーカード2枚目の順
+    def make_init_cards(self):
+        dc = Dealer.get_info(self.dealer_hand[0])
+        pc1 = Dealer.get_info(self.player_hand[0])
+        pc2 = Dealer.get_info(self.player_hand[1])
+        return "{0},{1},{2}".format(dc, pc1, pc2)
+
+    # プレイヤーへのメッセージを作成（引数の意味は send_message と同じ）
+    def make_message(self, rate: float, status: str, send_player_card=False, send_dealer_cards=False):
         if send_player_card:
-            msg = '{0},'.format(Dealer.get_info(self.player_hand.cards[-1]))
+            msg = '{0},'.format(Dealer.get_info(self.player_hand[-1]))
         else:
             msg = ''
         score = self.player_hand.get_score()
         msg += '{0},{1},{2}'.format(score, status, rate)
         if send_dealer_cards:
-            for i in range(1, len(self.dealer_hand.cards)):
-                msg += ',{0}'.format(Dealer.get_info(self.dealer_hand.cards[i]))
-        psoc.send(bytes(msg, 'utf-8'))
+            for i in range(1, len(self.dealer_hand)):
+                msg += ',{0}'.format(Dealer.get_info(self.dealer_hand[i]))
+        return msg
 
-    # プレイヤーからのメッセージ受信
-    # プレイヤーが選択した行動の種類を戻り値として返す
-    #   - psoc: プレイヤーとの間でのメッセージを送受信するためのソケット
-    def receive_message(self, psoc: socket.socket):
-        msg = psoc.recv(1024).decode("utf-8")
+    # プレイヤーから受信したメッセージを行動の種類に変換
+    @staticmethod
+    def parse_action(msg: str):
         if msg == 'hit':
             return Action.HIT
         elif msg == 'stand':
@@ -183,29 +462,869 @@ class Dealer():
         else:
             return Action.UNDEFINED
 
+    # カードシャッフルを行ったか否かをプレイヤーに通知
+    def send_card_shuffle_status(self, psoc: socket.socket, status: bool):
+        psoc.send(bytes(Dealer.make_card_shuffle_status(status), 'utf-8'))
+        ack = psoc.recv(1024).decode("utf-8") # 確認応答を受信
+
+    # プレイヤーに初期カード情報を送信
+    #   - psoc: プレイヤーとの間でのメッセージを送受信するためのソケット
+    def send_init_cards(self, psoc: socket.socket):
+        psoc.send(bytes(self.make_init_cards(), 'utf-8'))
+
+    # プレイヤーへのメッセージ送信
+    #   - psoc: プレイヤーとの間でのメッセージを送受信するためのソケット
+    #   - rate: 配当倍率
+    #   - status: プレイヤーの現在ステータス（勝敗結果，バーストしたか否か，サレンダーを受け付けたか否か，などを表す文字列）
+    #   - send_player_card: プレイヤーカードの種類を通知するか否か
+    #   - send_dealer_cards: ディーラーの手札を通知するか否か
+    def send_message(self, psoc: socket.socket, rate: float, status: str, send_player_card=False, send_dealer_cards=False):
+        msg = self.make_message(rate, status, send_player_card=send_player_card, send_dealer_cards=send_dealer_cards)
+        psoc.send(bytes(msg, 'utf-8'))
+
+    # プレイヤーからのメッセージ受信
+    # プレイヤーが選択した行動の種類を戻り値として返す
+    #   - psoc: プレイヤーとの間でのメッセージを送受信するためのソケット
+    def receive_message(self, psoc: socket.socket):
+        msg = psoc.recv(1024).decode("utf-8")
+        return Dealer.parse_action(msg)
+
+
+# プレイヤー1人分の接続（セッション）を管理するクラス
+# ソケット操作は行わず，プレイヤーから受信したバイト列を feed に渡すと，
+# プレイヤーへ送信すべきバイト列が返ってくる（同期サーバ・非同期サーバの両方から利用する）
+# 1つの接続で複数のゲームを続けて行うことができ，ゲーム決着後にプレイヤーから 'next' を受信すると次のゲームを開始する
+# （従来どおり1ゲームごとに接続を切るプレイヤーにもそのまま対応する）
+# 最初の確認応答の代わりに HELLO を受信した場合は，以降の通信をバイナリプロトコル（protocol.py）に切り替える
+# 最初のゲームの確認応答（'ack,seed=123'）または HELLO のオプションでシードが要求された場合は，
+# このセッション専用のディーラー（乱数生成器）を用意し，他の接続の有無に関係なく再現可能なカード列でゲームを行う
+# 最初のゲームはオプションを受信してから配る（接続直後のシャッフル状況の通知は，着いたテーブルで次に配る場合の見込みとなる）
+# オプション付きの確認応答には，実際に配ったゲームのシャッフル状況を改めて通知し，もう一度確認応答を受信してから初期カードを開示する
+# ゲームはテーブル（Table: 1つのシューとゲームID）の上で行い，どのテーブルに着くかは g_tables の方針と 'table=<ID>' オプションで決まる
+class PlayerSession():
+
+    # コンストラクタ
+    def __init__(self):
+        self.table = None # このセッションが使用中のテーブル
+        self.dealer = None # テーブルのディーラー（カードセット・ゲームIDを保持）
+        self.state = 'init' # 'init' -> 'ack'（確認応答待ち） -> 'playing'（行動待ち） -> 'settled'（次ゲーム要求待ち） -> ... -> 'finished'
+        self.finished = False
+        self.n_games = 0 # このセッションで開始したゲームの数
+        self.shuffled = False # 現在のゲームの開始前にカードシャッフルを行ったか否か
+        self.binary = False # バイナリプロトコルで通信中か否か
+        self.hello_buf = bytearray() # 受信途中の HELLO
+        self.rbuf = FrameBuffer() # バイナリプロトコルの受信バッファ
+        self.batch = None # 実行中の一括プレイ（結果フレームを少しずつ返すジェネレータ．resume で続きを進める）
+        self.session_id = next(g_session_ids) # セッション番号（ジャーナルに記録する）
+
+    # 接続直後の処理（シャッフル状況の通知メッセージを返す）
+    # 最初のゲームはセッションオプションを受信してから配るため，ここではカードを消費しない
+    def start(self):
+        if g_verbose:
+            print('A player has come.')
+        g_metrics.add('connections')
+        self.sit(g_tables.acquire())
+        self.shuffled = self.dealer.needs_shuffle()
+        self.state = 'ack'
+        return bytes(Dealer.make_card_shuffle_status(self.shuffled), 'utf-8')
+
+    # テーブルに着く（それまで使用していたテーブルは解放する）
+    def sit(self, table):
+        if self.table is not None:
+            g_tables.release(self.table)
+        self.table = table
+        self.dealer = table.dealer
+        self.dealer.session_id = self.session_id
+
+    # セッションの概要（ゲーム数と使用したテーブル）
+    def describe(self):
+        if self.table is None:
+            return '{0} games'.format(self.n_games)
+        return '{0} games, table {1}'.format(self.n_games, self.table.table_id)
+
+    # 使用中のテーブルを解放する（接続の終了時に呼び出す）
+    def close(self):
+        if self.table is not None:
+            g_tables.release(self.table)
+            self.table = None
+
+    # ゲームを開始する（ゲームを初期化し，シャッフル状況の通知メッセージを返す）
+    def start_game(self):
+        self.begin_game()
+        self.state = 'ack'
+        return bytes(Dealer.make_card_shuffle_status(self.shuffled), 'utf-8')
+
+    # ゲームの初期化
+    def begin_game(self):
+
+        # 手札を初期化
+        self.shuffled = self.dealer.initialize_game()
+        if self.shuffled is True:
+            g_metrics.add('shuffles')
+            self.table.metrics.add('shuffles')
+            if g_verbose:
+                print('Card set has been shuffled.') # 初期化中にカードをシャッフルした場合はメッセージを表示
+        self.n_games += 1
+        g_metrics.add('games')
+        self.table.metrics.add('games')
+
+    # セッションオプションを適用して最初のゲームを配る（2ゲーム目以降は何もしない）
+    #   - options: セッションオプション（apply_options を参照）
+    def begin_first_game(self, options: str):
+        if self.n_games == 0:
+            self.apply_options(options)
+            self.table.metrics.add('connections')
+            self.begin_game()
+
+    # セッションオプションを適用する（最初のゲームを配る前に呼び出す）
+    #   - options: 'seed=123,table=A' 形式の文字列（classes.parse_session_options を参照）
+    #     - table: 指定したIDのテーブルに着く（他の接続が使用中の場合は専用のテーブルに着く）
+    #     - seed: 専用のテーブル（または新たに作られる table のテーブル）のシューをこのシードでシャッフルする
+    def apply_options(self, options: str):
+        options = parse_session_options(options)
+        table_id, seed = options.get('table'), options.get('seed')
+        if table_id is None and seed is None:
+            return
+        if seed is not None:
+            try:
+                seed = int(seed)
+            except ValueError:
+                print('Invalid shoe seed: {0}'.format(seed))
+                seed = None
+        if table_id is not None and not TableRegistry.is_valid_id(table_id):
+            print('Invalid table ID: {0}'.format(table_id))
+            table_id = None
+        if table_id is None and seed is None:
+            return
+
+        # 接続時に着いたテーブルではまだカードを配っていないため，そのまま手放す（他のセッションのシューやゲームIDに影響しない）
+        g_tables.release(self.table)
+        self.table = None
+        table = g_tables.acquire(table_id, seed)
+        if table is None:
+            g_metrics.add('table_conflicts')
+            print('Table {0} is in use; a private table is used instead.'.format(table_id))
+            table = g_tables.acquire(None, seed, private=True)
+
+        # 最初のゲームは新しいテーブルで配る（既存のテーブルではそのシューの続きから配られる）
+        self.sit(table)
+        if g_verbose:
+            if seed is not None:
+                print('Shoe seed: {0}'.format(seed))
+            print('Table: {0}'.format(table.table_id))
+
+    # 初期カードを開示してゲームを進行状態にする
+    def open_game(self):
+        if g_verbose:
+            print('Num. remaining cards: ', self.dealer.get_num_remaining_cards() + 4)
+            print('Game start!!')
+        self.state = 'playing'
+
+    # プレイヤーの行動を処理する（戻り値は Dealer.apply_action と同じ）
+    def play(self, action: Action):
+        start_time = time.perf_counter()
+        if g_verbose and action != Action.UNDEFINED:
+            print("The player's action: {0}".format(action.name))
+        status, rate, send_player_card, send_dealer_cards = self.dealer.apply_action(action)
+        if g_verbose:
+            print("The player's status: ", status)
+        if status == 'finished':
+            self.finish()
+            return status, rate, send_player_card, send_dealer_cards
+        if status != 'unsettled':
+            # HITしてバーストしなかった場合を除き，ゲーム終了
+            self.state = 'settled'
+            g_metrics.add_result(status)
+            self.table.metrics.add_result(status)
+            if g_verbose:
+                print('The game has finished!')
+        g_metrics.add('actions')
+        self.table.metrics.add('actions')
+        g_metrics.add(DealerMetrics.ACTION_COUNTERS[action])
+        g_metrics.observe('action', time.perf_counter() - start_time)
+        return status, rate, send_player_card, send_dealer_cards
+
+    # プレイヤーから受信したデータを処理し，返送すべきデータを返す
+    def feed(self, data: bytes):
+
+        # バイナリプロトコルで通信中の場合
+        if self.binary:
+            return self.feed_frames(data)
+
+        # 確認応答を受信したら，ディーラーカード1枚とプレイヤーカード2枚をプレイヤーに開示
+        if self.state == 'ack':
+
+            # 確認応答の代わりに HELLO を受信した場合はバイナリプロトコルに切り替える
+            # （マジックが正しくない，または対応していないバージョンの HELLO の場合は接続を閉じる）
+            if self.hello_buf or data[:1] == HELLO_MAGIC[:1]:
+                self.hello_buf += data
+                try:
+                    hello = decode_hello(self.hello_buf)
+                except ValueError:
+                    print('Invalid HELLO from the player.')
+                    self.finish()
+                    return b''
+                if hello is None:
+                    return b'' # HELLO の残りを待つ
+                version, options, used = hello
+                if version != PROTOCOL_VERSION:
+                    print('Unsupported protocol version: {0}'.format(version))
+                    self.finish()
+                    return b''
+                rest = bytes(self.hello_buf[used:])
+                self.hello_buf = bytearray()
+                self.binary = True
+                self.begin_first_game(options.decode('utf-8', errors='replace'))
+                self.open_game()
+                return self.make_game_frame() + self.feed_frames(rest)
+
+            else:
+                # 確認応答に付与されたセッションオプション（'ack,seed=123'）
+                ack, sep, options = data.decode('utf-8', errors='replace').partition(',')
+                self.begin_first_game(options)
+                if sep:
+                    # オプションによって着くテーブルが変わる場合があるため，配ったゲームのシャッフル状況を改めて通知する
+                    return bytes(Dealer.make_card_shuffle_status(self.shuffled), 'utf-8')
+
+            self.open_game()
+            return bytes(self.dealer.make_init_cards(), 'utf-8')
+
+        # ゲーム決着後は次ゲームの要求を待つ（それ以外のメッセージは終了要求とみなす）
+        elif self.state == 'settled':
+            if data == b'next':
+                return self.start_game()
+            self.finish()
+            return b''
+
+        elif self.state != 'playing':
+            return b''
+
+        # プレイヤーのアクションを処理して応答する
+        status, rate, send_player_card, send_dealer_cards = self.play(Dealer.parse_action(data.decode('utf-8')))
+        if status == 'finished':
+            return b''
+        return bytes(self.dealer.make_message(rate=rate, status=status, send_player_card=send_player_card, send_dealer_cards=send_dealer_cards), 'utf-8')
+
+    # バイナリプロトコルで受信したデータを処理し，返送すべきデータを返す
+    # （プレイヤーが複数のフレームをまとめて送信してきた場合は，順番に全て処理する）
+    # 一括プレイの要求を受信した場合はそこで処理を止める（結果は resume で少しずつ返し，残りのフレームはその後で処理する）
+    def feed_frames(self, data: bytes):
+        self.rbuf.feed(data)
+        out = []
+        while not self.finished and self.batch is None:
+            try:
+                frame = self.rbuf.next_frame()
+            except ValueError:
+                self.finish() # フレーム境界が分からなくなったため，以降のデータは処理できない
+                break
+            if frame is None:
+                break
+            frame_type, payload = frame
+
+            # 行動
+            if self.state == 'playing' and frame_type == FRAME_ACTION and len(payload) == 1:
+                try:
+                    action = Action(payload[0])
+                except ValueError:
+                    action = Action.UNDEFINED
+                status, rate, send_player_card, send_dealer_cards = self.play(action)
+                if status != 'finished':
+                    out.append(self.make_result_frame(rate, status, send_player_card, send_dealer_cards))
+
+            # 次のゲームの要求（確認応答は不要なので，シャッフル有無と初期カードをまとめて送信）
+            elif self.state == 'settled' and frame_type == FRAME_NEXT:
+                self.begin_game()
+                self.open_game()
+                out.append(self.make_game_frame())
+
+            # 一括プレイの要求（行動前のゲームがあればそれを1ゲーム目として扱う）
+            elif self.state in ('playing', 'settled') and frame_type == FRAME_BATCH:
+                try:
+                    request = decode_batch_request(payload)
+                except (ValueError, struct.error):
+                    self.finish()
+                    break
+                self.batch = self.play_batch(*request)
+
+            # 終了要求・想定外のフレーム
+            else:
+                self.finish()
+        return b''.join(out)
+
+    # 実行中の一括プレイを少し進め，返送すべきデータを返す（一括プレイが終わったら，受信済みの残りのフレームを処理する）
+    # 一括プレイの要求を受信した後は，self.batch が None になるまで繰り返し呼び出す
+    # （非同期モードでは呼び出しの合間に他の接続の処理を行うため，大量のゲームの一括プレイ中も他の接続が待たされない）
+    def resume(self):
+        frames = next(self.batch, None)
+        if frames is None:
+            self.batch = None
+            return self.feed_frames(b'')
+        return frames
+
+    # 一括プレイ: 方策テーブルに従ってディーラー内で n_games 回のゲームを行い，結果フレームを返すジェネレータ
+    # BATCH_RECORDS_PER_FRAME ゲームごとに，その結果フレームを返す（最後は終了フレームを含む）
+    # 各ゲームの途中経過は表示しない
+    def play_batch(self, n_games: int, max_retries: int, shape, table):
+        if g_verbose:
+            print('Batch play: {0} games'.format(n_games))
+        records = []
+        for i in range(n_games):
+            if self.state != 'playing':
+                self.begin_game()
+            records.append(self.dealer.play_policy_game(table, shape, max_retries))
+            self.state = 'settled'
+            g_metrics.add_result(records[-1][2])
+            self.table.metrics.add_result(records[-1][2])
+            if len(records) >= BATCH_RECORDS_PER_FRAME and i < n_games - 1:
+                yield encode_batch_result(records)
+                records = []
+        frames = encode_batch_result(records) if records else b''
+        if g_verbose:
+            print('Batch play has finished.')
+        yield frames + encode_frame(FRAME_BATCH_END)
+
+    # ゲーム開始フレームを作成
+    def make_game_frame(self):
+        d = self.dealer
+        return encode_game(self.shuffled, Dealer.get_info(d.dealer_hand[0]), Dealer.get_info(d.player_hand[0]), Dealer.get_info(d.player_hand[1]))
+
+    # 行動結果フレームを作成（引数の意味は Dealer.send_message と同じ）
+    def make_result_frame(self, rate: float, status: str, send_player_card=False, send_dealer_cards=False):
+        d = self.dealer
+        player_card = Dealer.get_info(d.player_hand[-1]) if send_player_card else None
+        dealer_cards = [Dealer.get_info(d.dealer_hand[i]) for i in range(1, len(d.dealer_hand))] if send_dealer_cards else None
+        return encode_result(player_card, d.player_hand.get_score(), status, rate, dealer_cards)
+
+    # セッションを終了状態にする
+    def finish(self):
+        self.state = 'finished'
+        self.finished = True
+
+
+# ディーラーの動作状況（カウンターと処理時間のヒストグラム）
+# 全ての値を1つの整数配列に並べて格納する（通常はプロセス内のリスト，ワーカープロセスで動作する場合は共有メモリ multiprocessing.Array）
+# ヒストグラムは固定のバケット境界ごとの件数と，合計時間（マイクロ秒）・件数からなる
+class DealerMetrics():
+
+    # カウンターの種類
+    COUNTER_NAMES = ('connections', 'games', 'actions', 'errors', 'shuffles', 'busts',
+                     'win', 'lose', 'draw', 'surrendered',
+                     'hit', 'stand', 'double_down', 'surrender', 'retry', 'table_conflicts')
+
+    # ヒストグラムの種類
+    #   - first_send: 接続受付から最初のメッセージ送信までの時間
+    #   - action: 1回の行動の処理時間
+    HISTOGRAM_NAMES = ('first_send', 'action')
+
+    # ヒストグラムのバケット境界（マイクロ秒，最後のバケットは境界なし）
+    BUCKET_BOUNDS = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000)
+    N_BUCKETS = len(BUCKET_BOUNDS) + 1
+    HISTOGRAM_SIZE = N_BUCKETS + 2 # バケット + 合計時間 + 件数
+
+    INDEX = {name: i for i, name in enumerate(COUNTER_NAMES)}
+    HISTOGRAM_INDEX = dict(zip(HISTOGRAM_NAMES, range(len(COUNTER_NAMES), len(COUNTER_NAMES) + len(HISTOGRAM_NAMES) * HISTOGRAM_SIZE, HISTOGRAM_SIZE)))
+    SIZE = len(COUNTER_NAMES) + len(HISTOGRAM_NAMES) * HISTOGRAM_SIZE
+
+    # 行動の種類と，その行動を数えるカウンターの対応
+    ACTION_COUNTERS = {Action.HIT: 'hit', Action.STAND: 'stand', Action.DOUBLE_DOWN: 'double_down', Action.SURRENDER: 'surrender', Action.RETRY: 'retry'}
+
+    # コンストラクタ
+    #   - values: 値の格納先（省略時はプロセス内のリスト）
+    def __init__(self, values=None):
+        self.values = values if values is not None else [0] * DealerMetrics.SIZE
+
+    # カウンター name を n だけ増やす
+    def add(self, name: str, n=1):
+        self.values[DealerMetrics.INDEX[name]] += n
+
+    # ゲームの結果を数える
+    def add_result(self, status: str):
+        if status == 'bust':
+            self.values[DealerMetrics.INDEX['busts']] += 1
+            self.values[DealerMetrics.INDEX['lose']] += 1
+        elif status in DealerMetrics.INDEX:
+            self.values[DealerMetrics.INDEX[status]] += 1
+
+    # ヒストグラム name に処理時間 seconds（秒）を記録
+    def observe(self, name: str, seconds: float):
+        us = int(seconds * 1e6)
+        base = DealerMetrics.HISTOGRAM_INDEX[name]
+        self.values[base + bisect.bisect_left(DealerMetrics.BUCKET_BOUNDS, us)] += 1
+        self.values[base + DealerMetrics.N_BUCKETS] += us
+        self.values[base + DealerMetrics.N_BUCKETS + 1] += 1
+
+    # カウンターの現在値を辞書として取得
+    def as_dict(self):
+        return {name: self.values[i] for i, name in enumerate(DealerMetrics.COUNTER_NAMES)}
+
+    # ヒストグラム name の (バケットごとの件数, 合計時間[us], 件数) を取得
+    def histogram(self, name: str):
+        base = DealerMetrics.HISTOGRAM_INDEX[name]
+        buckets = [self.values[base + i] for i in range(DealerMetrics.N_BUCKETS)]
+        return buckets, self.values[base + DealerMetrics.N_BUCKETS], self.values[base + DealerMetrics.N_BUCKETS + 1]
+
+    # ヒストグラム name の q 分位点（マイクロ秒，該当するバケットの上側の境界で近似）
+    def percentile(self, name: str, q: float):
+        buckets, total, count = self.histogram(name)
+        if count == 0:
+            return 0
+        rank = q * count
+        acc = 0
+        for i, n in enumerate(buckets):
+            acc += n
+            if acc >= rank:
+                break
+        if i < len(DealerMetrics.BUCKET_BOUNDS):
+            return DealerMetrics.BUCKET_BOUNDS[i]
+        return DealerMetrics.BUCKET_BOUNDS[-1] # 最後のバケットは上限なし
+
+    # 1行の要約文字列
+    def summary(self):
+        c = self.as_dict()
+        items = ['{0}={1}'.format(k, c[k]) for k in ('connections', 'games', 'actions', 'errors', 'shuffles', 'busts')]
+        items.append('results={0}/{1}/{2}/{3}'.format(c['win'], c['lose'], c['draw'], c['surrendered']))
+        items.append('actions_by_type={0}/{1}/{2}/{3}/{4}'.format(c['hit'], c['stand'], c['double_down'], c['surrender'], c['retry']))
+        for name in DealerMetrics.HISTOGRAM_NAMES:
+            items.append('{0}_p50={1}us {0}_p99={2}us'.format(name, self.percentile(name, 0.5), self.percentile(name, 0.99)))
+        return ' '.join(items)
+
+    # スクレイプ用のテキスト（Prometheus のテキスト形式）
+    def render(self):
+        lines = []
+        for name, v in self.as_dict().items():
+            lines.append('# TYPE bj_dealer_{0}_total counter'.format(name))
+            lines.append('bj_dealer_{0}_total {1}'.format(name, v))
+        for name in DealerMetrics.HISTOGRAM_NAMES:
+            buckets, total, count = self.histogram(name)
+            lines.append('# TYPE bj_dealer_{0}_seconds histogram'.format(name))
+            acc = 0
+            for bound, n in zip(DealerMetrics.BUCKET_BOUNDS, buckets):
+                acc += n
+                lines.append('bj_dealer_{0}_seconds_bucket{{le="{1}"}} {2}'.format(name, bound / 1e6, acc))
+            lines.append('bj_dealer_{0}_seconds_bucket{{le="+Inf"}} {1}'.format(name, count))
+            lines.append('bj_dealer_{0}_seconds_sum {1}'.format(name, total / 1e6))
+            lines.append('bj_dealer_{0}_seconds_count {1}'.format(name, count))
+        return '\n'.join(lines) + '\n'
+
+    # 複数の格納先の値を合計した DealerMetrics を作成
+    @staticmethod
+    def aggregate(values_list):
+        total = DealerMetrics()
+        for values in values_list:
+            for i in range(DealerMetrics.SIZE):
+                total.values[i] += values[i]
+        return total
+
+
+# このプロセスの動作状況
+g_metrics = DealerMetrics()
+
+# 行動ごとの詳細を表示するか否か
+g_verbose = False
+
+
+# シャッフル済みシューのプールの深さ（0 の場合はプールを使わず，必要になった時点でシャッフルする）
+g_shoe_pool_depth = 0
+
+# シューと各ゲームの経過を記録するジャーナル（記録しない場合は None）
+g_journal = None
+
+# セッション番号の発行元
+g_session_ids = itertools.count(1)
+
+
+# ディーラークラスのインスタンスを作成
+#   - seed: 乱数シード（省略時は numpy のグローバル乱数を使用）
+#     シードからシャッフル用と行動選択用の2つの独立した乱数生成器を作るため，シューのプールの有無や深さに関係なく同じカード列になる
+def create_dealer(seed=None):
+    if seed is None:
+        rng, shoe_rng = None, None
+    else:
+        shoe_seq, action_seq = np.random.SeedSequence(seed).spawn(2)
+        rng, shoe_rng = np.random.default_rng(action_seq), np.random.default_rng(shoe_seq)
+    return Dealer(n_decks=N_DECKS, shuffle_interval=SHUFFLE_INTERVAL, shuffle_threshold=SHUFFLE_THRESHOLD, max_cards_per_game=MAX_CARDS_PER_GAME,
+                  rng=rng, shoe_rng=shoe_rng, shoe_pool_depth=g_shoe_pool_depth, journal=g_journal)
+
+
+# テーブル（1つのシューとゲームIDを持つディーラーと，そのテーブルでの動作状況）
+# 1つのテーブルを同時に使用できるセッションは1つだけで，他のセッションのカードの引き方がシューの消費やシャッフルの時期に影響しない
+class Table():
+
+    # コンストラクタ
+    #   - table_id: テーブルID
+    #   - dealer: このテーブルのディーラー
+    #   - private: セッション専用のテーブルか否か（True の場合は解放時に破棄される）
+    def __init__(self, table_id: str, dealer: Dealer, private: bool):
+        self.table_id = table_id
+        self.dealer = dealer
+        self.private = private
+        self.in_use = False
+        self.metrics = DealerMetrics() # このテーブルでの動作状況（connections はこのテーブルでゲームを行ったセッションの数）
+
+
+# テーブルの割り当てを管理するクラス
+# 割り当て方針
+#   - 'session': 接続ごとに専用のテーブルを用意し，接続が終わったら破棄する
+#   - 'shared': 全ての接続が共有テーブル（ID は SHARED_TABLE_ID）を順番に使う（使用中の場合は専用のテーブルを用意する）
+# いずれの方針でも，'table=<ID>' オプションを指定した接続はそのIDのテーブルに着く（無ければ作成し，以後のセッションでもシューの続きを使う）
+# ワーカープロセスで動作する場合，テーブルはワーカーごとに管理される
+class TableRegistry():
+
+    SHARED_TABLE_ID = 'shared'
+    MAX_ID_LENGTH = 64
+
+    # 各テーブルについてスクレイプ用に提供するカウンター
+    COUNTER_NAMES = ('connections', 'games', 'actions', 'shuffles', 'busts', 'win', 'lose', 'draw', 'surrendered')
+
+    # コンストラクタ
+    #   - policy: 割り当て方針（'session' または 'shared'）
+    def __init__(self, policy='session'):
+        self.policy = policy
+        self.tables = {} # テーブルID -> Table（名前付きのテーブルと，使用中の専用テーブル）
+        self.private_ids = itertools.count(1)
+        self.lock = threading.Lock() # スクレイプ用のスレッドからも参照するため
+
+    # テーブルIDとして使用できる文字列か否か（英数字と '_', '-', '.' のみ）
+    @staticmethod
+    def is_valid_id(table_id: str):
+        return 0 < len(table_id) <= TableRegistry.MAX_ID_LENGTH and all(c.isascii() and (c.isalnum() or c in '_-.') for c in table_id)
+
+    # テーブルを確保する
+    # 指定したIDのテーブルが他のセッションで使用中の場合は None を返す
+    #   - table_id: テーブルID（None の場合は割り当て方針に従う．共有テーブルが使用中の場合は専用のテーブルを用意する）
+    #   - seed: テーブルを新たに作成する場合のシャッフル用の乱数シード（指定した場合，table_id が None なら専用のテーブルを用意する）
+    #   - private: True の場合は割り当て方針に関係なく専用のテーブルを用意する
+    def acquire(self, table_id=None, seed=None, private=False):
+        with self.lock:
+            if table_id is None and not private and seed is None and self.policy == 'shared':
+                shared = self.tables.get(TableRegistry.SHARED_TABLE_ID)
+                if shared is None or not shared.in_use:
+                    table_id = TableRegistry.SHARED_TABLE_ID
+            if table_id is None:
+                table = Table('s{0}'.format(next(self.private_ids)), create_dealer(seed), private=True)
+                self.tables[table.table_id] = table
+            else:
+                table = self.tables.get(table_id)
+                if table is None:
+                    table = Table(table_id, create_dealer(seed), private=False)
+                    self.tables[table_id] = table
+                elif table.in_use:
+                    return None
+            table.in_use = True
+            return table
+
+    # テーブルを解放する（専用のテーブルは破棄する）
+    def release(self, table: Table):
+        with self.lock:
+            table.in_use = False
+            if table.private:
+                self.tables.pop(table.table_id, None)
+
+    # スクレイプ用のテキスト（Prometheus のテキスト形式．テーブルごとの値に table ラベルを付ける）
+    def render(self):
+        with self.lock:
+            tables = list(self.tables.values())
+        lines = []
+        for name in TableRegistry.COUNTER_NAMES:
+            lines.append('# TYPE bj_dealer_table_{0}_total counter'.format(name))
+            for table in tables:
+                lines.append('bj_dealer_table_{0}_total{{table="{1}"}} {2}'.format(name, table.table_id, table.metrics.values[DealerMetrics.INDEX[name]]))
+        lines.append('# TYPE bj_dealer_table_remaining_cards gauge')
+        for table in tables:
+            lines.append('bj_dealer_table_remaining_cards{{table="{0}"}} {1}'.format(table.table_id, table.dealer.get_num_remaining_cards()))
+        lines.append('# TYPE bj_dealer_table_in_use gauge')
+        for table in tables:
+            lines.append('bj_dealer_table_in_use{{table="{0}"}} {1}'.format(table.table_id, int(table.in_use)))
+        return '\n'.join(lines) + '\n'
+
+
+# テーブルの割り当て（main で --table_policy に従って方針を設定する）
+g_tables = TableRegistry()
+
+
+# 同じプロセス内のディーラーと直接やり取りする通信路
+# ソケット・エンコード・スレッドを一切使わず，Player の各メソッドの dsoc 引数として渡すとディーラークラスを直接呼び出す
+# ゲームの進め方（シャッフル通知 -> 初期カード -> 行動 -> ... -> 'next' で次ゲーム）はソケット経由の場合と同じ
+class LocalDealerChannel(DealerChannel):
+
+    # コンストラクタ
+    #   - dealer: 使用するディーラー（省略時は最初のゲームの開始時に config.py の設定で新たに作成）
+    def __init__(self, dealer=None):
+        self.dealer = dealer
+        self.table = None # 'table=<ID>' オプションで着いたテーブル（g_tables から確保する）
+        self.state = 'init' # 'init'（ゲーム開始待ち） -> 'playing'（行動待ち） -> 'settled'（次ゲーム要求待ち） -> ... -> 'finished'
+        self.results = deque() # 送信済みの行動に対する結果（応答を待たずに複数の行動を送った場合に備えて順番に保持）
+
+    # ゲームを開始する（シャッフルを行ったか否かを返す）
+    def start_game(self):
+        shuffled = self.dealer.initialize_game()
+        self.state = 'playing'
+        if self.table is not None:
+            self.table.metrics.add('games')
+            if shuffled:
+                self.table.metrics.add('shuffles')
+        return shuffled
+
+    def send_command(self, cmd: str):
+        if self.state == 'settled' and cmd == 'next':
+            self.state = 'init'
+            return
+        if self.state != 'playing':
+            self.close() # ゲーム決着後の 'next' 以外のメッセージは終了要求とみなす
+            return
+        status, rate, send_player_card, send_dealer_cards = self.play(Dealer.parse_action(cmd))
+        if status != 'finished':
+            self.results.append(self.make_result(rate, status, send_player_card, send_dealer_cards))
+
+    # 行動を処理する（戻り値は Dealer.apply_action と同じ．結果のメッセージは作らない）
+    # ゲームの状態とテーブルの動作状況は send_command の場合と同じく更新する（メッセージを介さずにディーラーを操作する場合に使用）
+    def play(self, action: Action):
+        result = self.dealer.apply_action(action)
+        status = result[0]
+        if status == 'finished':
+            self.close()
+            return result
+        if status != 'unsettled':
+            self.state = 'settled'
+        if self.table is not None:
+            self.table.metrics.add('actions')
+            if status != 'unsettled':
+                self.table.metrics.add_result(status)
+        return result
+
+    def recv_shuffle_status(self, options=''):
+        if self.state != 'init':
+            raise ConnectionError('no game is waiting to start')
+
+        # 最初のゲームの前にテーブルやシードが要求された場合は，そのテーブルまたはシード付きの専用ディーラーを使用する
+        # （プレイヤー側の乱数と干渉しないよう，ディーラーの作成はここまで遅らせる）
+        options = parse_session_options(options)
+        table_id, seed = options.get('table'), options.get('seed')
+        first = self.dealer is None or self.dealer.game_ID == 0
+        if table_id is not None and first and self.table is None and TableRegistry.is_valid_id(table_id):
+            self.table = g_tables.acquire(table_id, None if seed is None else int(seed))
+            if self.table is not None:
+                self.table.metrics.add('connections')
+                self.dealer = self.table.dealer
+        if self.table is None and seed is not None and first:
+            self.dealer = create_dealer(seed=int(seed))
+        elif self.dealer is None:
+            self.dealer = create_dealer()
+        return self.start_game()
+
+    def recv_init_cards(self):
+        d = self.dealer
+        return Dealer.get_info(d.dealer_hand[0]), Dealer.get_info(d.player_hand[0]), Dealer.get_info(d.player_hand[1])
+
+    def recv_result(self, with_player_card=False, with_dealer_cards=False):
+        if not self.results:
+            raise ConnectionError('no action has been sent to the dealer')
+        return self.results.popleft()
+
+    # 行動結果を作成（戻り値は parse_result_message と同じ形式，引数の意味は Dealer.send_message と同じ）
+    def make_result(self, rate: float, status: str, send_player_card=False, send_dealer_cards=False):
+        d = self.dealer
+        player_card = Dealer.get_info(d.player_hand[-1]) if send_player_card else None
+        dealer_cards = [Dealer.get_info(d.dealer_hand[i]) for i in range(1, len(d.dealer_hand))] if send_dealer_cards else []
+        return player_card, d.player_hand.get_score(), status, rate, dealer_cards
+
+    # 方策テーブルに従って n_games 回のゲームを一括プレイする（BinaryChannel.play_batch と同じ形式で結果を返すジェネレータ）
+    #   - policy, n_games, max_retries: protocol.encode_batch_request を参照
+    def play_batch(self, policy, n_games: int, max_retries: int):
+        policy = np.ascontiguousarray(policy, dtype=np.uint8)
+        table = policy.tobytes()
+        shape = policy.shape
+        records = []
+        for i in range(n_games):
+            if self.state != 'playing':
+                self.start_game()
+            records.append(self.dealer.play_policy_game(table, shape, max_retries))
+            self.state = 'settled'
+            if self.table is not None:
+                self.table.metrics.add_result(records[-1][2])
+            if len(records) >= BATCH_RECORDS_PER_FRAME:
+                yield records
+                records = []
+        if records:
+            yield records
+
+    def close(self):
+        self.state = 'finished'
+        self.results.clear()
+        if self.table is not None:
+            g_tables.release(self.table)
+            self.table = None
+
 
 ### ここから処理開始 ###
 
-def main():
+# 1つの接続を同期的に処理する（プレイヤーが接続を切るか終了を要求するまで）
+#   - player_soc: プレイヤーとの間でのメッセージを送受信するためのソケット
+#   - session: このプレイヤー用のセッション
+#   - accepted_at: 接続を受け付けた時刻（time.perf_counter の値．最初の送信までの時間の計測に使用）
+def serve_player(player_soc: socket.socket, session: PlayerSession, accepted_at=None):
+    player_soc.sendall(session.start())
+    if accepted_at is not None:
+        g_metrics.observe('first_send', time.perf_counter() - accepted_at)
+    while not session.finished:
+        data = player_soc.recv(1024)
+        if not data:
+            break # クライアント側で接続が切れた
+        out = session.feed(data)
+        if out:
+            player_soc.sendall(out)
+        while session.batch is not None:
+            out = session.resume()
+            if out:
+                player_soc.sendall(out)
 
-    # 乱数シードを固定する場合は以下をアンコメント（「314」の部分には適当なシード値を入れる）
-    #np.random.seed(314)
 
-    # ディーラークラスのインスタンスを作成
-    dealer = Dealer(n_decks=N_DECKS, shuffle_interval=SHUFFLE_INTERVAL, shuffle_threshold=SHUFFLE_THRESHOLD, max_cards_per_game=MAX_CARDS_PER_GAME)
+# 1つの接続をコルーチンとして処理する（非同期モード用）
+# 各接続は別々のテーブル（カードセット・ゲームID）に着くため，複数のプレイヤーが並行してゲームを進められる
+async def serve_player_async(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    accepted_at = time.perf_counter()
+    session = PlayerSession()
+    try:
+        writer.write(session.start())
+        await writer.drain()
+        g_metrics.observe('first_send', time.perf_counter() - accepted_at)
+        while not session.finished:
+            data = await reader.read(1024)
+            if not data:
+                break # クライアント側で接続が切れた
+            out = session.feed(data)
+            if out:
+                writer.write(out)
+                await writer.drain()
+            while session.batch is not None:
+                out = session.resume()
+                if out:
+                    writer.write(out)
+                    await writer.drain()
+                await asyncio.sleep(0) # 一括プレイ中も他の接続を処理する
+    except (ConnectionResetError, BrokenPipeError):
+        print('Player connection reset.')
+    except Exception as e:
+        # 予期しないエラーがあってもサーバーは生かす
+        g_metrics.add('errors')
+        print(f'Error during player session: {e}')
+    finally:
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
+        if g_verbose:
+            print('The player has left. ({0})'.format(session.describe()))
+        session.close()
+
 
-    # プレイヤーからの接続を受け付けるソケットを用意
+# プレイヤーからの接続を受け付けるソケットを用意
+#   - backlog: 接続待ち行列の長さ
+#   - reuse_port: SO_REUSEPORT を設定するか否か（複数プロセスで同じポートを待ち受ける場合に使用）
+def create_server_socket(backlog: int, reuse_port=False):
     soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # プレイヤーからの通信受付用ソケット
     try:
         soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     except Exception:
         pass
-    # 接続待ちタイムアウト: 短すぎると頻繁に例外発生→煩雑。少し長めに設定。
-    soc.settimeout(5.0)
+    if reuse_port:
+        soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     # 全インターフェースで待受け（hostname/localhost/127.0.0.1 いずれでも接続可）
     soc.bind(('', PORT))
     # 同時接続待ち行列を拡大（複数クライアントが並列に接続要求しても落ちにくくする）
-    soc.listen(16)
+    soc.listen(backlog)
+    return soc
+
+
+# Unixドメインソケットで接続を受け付けるソケットを用意（同一マシン上のプレイヤー向け）
+#   - path: ソケットファイルのパス（既に存在する場合は削除してから作成）
+#   - backlog: 接続待ち行列の長さ
+def create_uds_server_socket(path: str, backlog: int):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    soc = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    soc.bind(path)
+    soc.listen(backlog)
+    return soc
+
+
+# 動作状況をスクレイプ用に提供する（別スレッドで動作）
+# 接続ごとに HTTP/1.0 のリクエストを1つ読み捨て，render の戻り値（DealerMetrics.render などの内容）を返して接続を閉じる
+#   - soc: 待ち受け用ソケット（TCP / Unixドメインソケット）
+#   - render: スクレイプ用のテキストを返す関数
+def serve_metrics(soc: socket.socket, render):
+    while True:
+        try:
+            conn, _ = soc.accept()
+        except OSError:
+            return # ソケットが閉じられた
+        try:
+            conn.settimeout(2.0)
+            conn.recv(4096)
+            body = bytes(render(), 'utf-8')
+            header = 'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {0}\r\n\r\n'.format(len(body))
+            conn.sendall(bytes(header, 'utf-8') + body)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+
+# スクレイプ用のエンドポイントを用意し，別スレッドで応答を開始する
+# 作成したソケットのリストを返す
+#   - port: HTTPで提供する場合のポート番号（127.0.0.1 で待ち受ける．0 の場合は使用しない）
+#   - uds_path: Unixドメインソケットで提供する場合のパス（空文字列の場合は使用しない）
+#   - render: スクレイプ用のテキストを返す関数
+def start_metrics_server(port: int, uds_path: str, render):
+    socs = []
+    if port > 0:
+        soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        soc.bind(('127.0.0.1', port))
+        soc.listen(16)
+        socs.append(soc)
+    if uds_path:
+        socs.append(create_uds_server_socket(uds_path, 16))
+    for soc in socs:
+        threading.Thread(target=serve_metrics, args=(soc, render), daemon=True).start()
+    return socs
+
+
+# 一定間隔で動作状況の要約を1行で表示する（別スレッドで動作．前回から変化がない場合は表示しない）
+#   - interval: 表示間隔（秒）
+#   - get_metrics: 現在の DealerMetrics を返す関数
+def report_metrics(interval: float, get_metrics):
+    last = None
+    while True:
+        time.sleep(interval)
+        summary = get_metrics().summary()
+        if summary != last:
+            print('[metrics] {0}'.format(summary), flush=True)
+            last = summary
+
+
+# 非同期モードのディーラーを起動する
+#   - socs: 接続受付用ソケットのリスト（TCP / Unixドメインソケット）
+async def run_async_server(socs):
+    servers = []
+    for soc in socs:
+        if soc.family == getattr(socket, 'AF_UNIX', None):
+            servers.append(await asyncio.start_unix_server(serve_player_async, sock=soc))
+        else:
+            servers.append(await asyncio.start_server(serve_player_async, sock=soc))
+    print('The dealer program has started!! (async mode)')
+    print()
+    print('Waiting for players ...')
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+# 同期モード（従来どおり，1つのディーラーで1人ずつ順番にゲームを処理する）のディーラーを起動する
+#   - socs: 接続受付用ソケットのリスト（TCP / Unixドメインソケット）
+def run_single_server(socs):
+
     print('The dealer program has started!!')
     print()
     print('Waiting for a new player ...')
@@ -214,140 +1333,218 @@ def main():
     while True:
 
         try:
-            player_soc, address = soc.accept()  # プレイヤーからの通信待ち状態に入る
-        except (socket.timeout, TimeoutError):
-            # タイムアウトは単に再ループ (ディーラー常駐運転)
+            # 接続待ちタイムアウト: 短すぎると頻繁に例外発生→煩雑。少し長めに設定。
+            readable, _, _ = select.select(socs, [], [], 5.0)
+            if not readable:
+                # タイムアウトは単に再ループ (ディーラー常駐運転)
+                continue
+            player_soc, address = readable[0].accept()  # プレイヤーからの通信待ち状態に入る
+            accepted_at = time.perf_counter()
+            player_soc.setblocking(True)
+        except (socket.timeout, TimeoutError, BlockingIOError):
             continue
         except KeyboardInterrupt:
             # 明示的中断
-            soc.close()
+            for soc in socs:
+                soc.close()
             raise
         except Exception:
             # 予期しない例外はソケットを閉じて再送出
-            soc.close()
+            for soc in socs:
+                soc.close()
             raise
         else:
 
+            session = PlayerSession()
             try:
-                print('A player has come.')
-
-                # 手札を初期化
-                cardset_shuffled = dealer.initialize_game()
-                if cardset_shuffled is True:
-                    print('Card set has been shuffled.') # 初期化中にカードをシャッフルした場合はメッセージを表示
-                dealer.send_card_shuffle_status(player_soc, status=cardset_shuffled)
-
-                print('Num. remaining cards: ', dealer.get_num_remaining_cards() + 4)
-                print('Game start!!')
-
-                # ディーラーカード1枚とプレイヤーカード2枚をプレイヤーに開示
-                dealer.send_init_cards(player_soc)
-
-                # プレイヤーのアクションを受信して応答する（ループ処理）
-                while True:
-
-                    action = dealer.receive_message(player_soc)
-
-                    # HIT の場合
-                    if action == Action.HIT:
-                        print("The player's action: HIT")
-
-                        # プレイヤーにカードを1枚配布
-                        dealer.draw_player_card()
-
-                        if dealer.player_is_busted():
-                            # プレイヤーがバーストした場合
-                            status = 'bust'
-                            dealer.send_message(psoc=player_soc, rate=0.0, status=status, send_player_card=True, send_dealer_cards=True)
-                        else:
-                            # プレイヤーがバーストしなかった場合
-                            status = 'unsettled'
-                            dealer.send_message(psoc=player_soc, rate=0.0, status=status, send_player_card=True)
-
-                    # STAND の場合
-                    elif action == Action.STAND:
-                        print("The player's action: STAND")
-
-                        # ルールに従ってディーラーにカードを追加
-                        dealer.draw_dealer_cards()
-
-                        # 勝敗を判定
-                        status, rate = dealer.judge()
-                        dealer.send_message(psoc=player_soc, rate=rate, status=status, send_dealer_cards=True)
-
-                    # DOUBLE DOWNの場合
-                    elif action == Action.DOUBLE_DOWN:
-                        print("The player's action: DOUBLE_DOWN")
-
-                        # プレイヤーにカードを1枚配布
-                        dealer.draw_player_card()
-
-                        if dealer.player_is_busted():
-                            # プレイヤーがバーストした場合
-                            status = 'bust'
-                            rate = 0.0
-                        else:
-                            # プレイヤーがバーストしなかった場合 => STAND の場合と同じ処理を実行
-                            dealer.draw_dealer_cards()
-                            status, rate = dealer.judge()
-                        dealer.send_message(psoc=player_soc, rate=rate, status=status, send_player_card=True, send_dealer_cards=True)
-
-                    # SURRENDERの場合
-                    elif action == Action.SURRENDER:
-                        print("The player's action: SURRENDER")
-                        status = 'surrendered'
-                        dealer.send_message(psoc=player_soc, rate=0.5, status=status, send_dealer_cards=True)
-
-                    # RETRYの場合
-                    elif action == Action.RETRY:
-                        print("The player's action: RETRY")
-
-                        # プレイヤーにカードを1枚配布
-                        dealer.draw_player_card(retry_mode=True)
-
-                        if dealer.player_is_busted():
-                            # プレイヤーがバーストした場合
-                            status = 'bust'
-                            dealer.send_message(psoc=player_soc, rate=0.0, status=status, send_player_card=True, send_dealer_cards=True)
-                        else:
-                            # プレイヤーがバーストしなかった場合
-                            status = 'unsettled'
-                            dealer.send_message(psoc=player_soc, rate=0.0, status=status, send_player_card=True)
-
-                    # 定義されていないアクションは終了要求とみなす
-                    else:
-                        status = 'finished'
-
-                    print("The player's status: ", status)
-                    if status != 'unsettled':
-                        break # HITしてバーストしなかった場合を除き，ゲーム終了
-
+                serve_player(player_soc, session, accepted_at)
             except ConnectionResetError:
                 # クライアント側で接続が切れた
-                try:
-                    player_soc.close()
-                except Exception:
-                    pass
-                print('Player connection reset. Waiting for a new player ...')
-                continue
+                print('Player connection reset.')
             except Exception as e:
                 # 予期しないエラーがあってもサーバーは生かす
-                try:
-                    player_soc.close()
-                except Exception:
-                    pass
+                g_metrics.add('errors')
                 print(f'Error during player session: {e}')
-                print('Waiting for a new player ...')
-                continue
             finally:
                 # 通信終了
                 try:
                     player_soc.close()
                 except Exception:
                     pass
-                print('The game has finished!')
-                print()
-                print('Waiting for a new player ...')
+                if g_verbose:
+                    print('The player has left. ({0})'.format(session.describe()))
+                session.close()
+                if g_verbose:
+                    print()
+                    print('Waiting for a new player ...')
+
+
+# ディーラーを起動する（指定されたモードで，Ctrl+C で停止されるまで動作）
+#   - socs: 接続受付用ソケットのリスト
+#   - mode: 'single' または 'async'
+def run_server(socs, mode: str):
+    if mode == 'async':
+        try:
+            asyncio.run(run_async_server(socs))
+        except KeyboardInterrupt:
+            pass
+    else:
+        try:
+            run_single_server(socs)
+        except KeyboardInterrupt:
+            pass
+
+
+# ワーカープロセスの処理（SO_REUSEPORT を設定したソケットで同じポートを待ち受ける）
+#   - worker_id: ワーカー番号
+#   - shared_values: このワーカーのカウンター値を格納する共有メモリ（スーパーバイザーが集計する）
+#   - uds_soc: スーパーバイザーが用意したUnixドメインソケット（全ワーカーで共有．使用しない場合は None）
+#   - journal_path: ジャーナルのファイル名（ワーカーごとに '<journal_path>.<worker_id>' に記録する．記録しない場合は空文字列）
+def run_worker(worker_id: int, shared_values, mode: str, backlog: int, uds_soc=None, journal_path=''):
+    global g_metrics, g_journal
+    if journal_path:
+        g_journal = JournalWriter('{0}.{1}'.format(journal_path, worker_id), 52 * N_DECKS)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # 停止要求を受けたらジャーナルを書き出してから終了
+    else:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL) # スーパーバイザーから停止要求を受けたら即座に終了
+    g_metrics = DealerMetrics(shared_values)
+    socs = [create_server_socket(backlog, reuse_port=True)]
+    if uds_soc is not None:
+        socs.append(uds_soc)
+    print('Worker {0} (pid {1}) is ready.'.format(worker_id, os.getpid()))
+    try:
+        run_server(socs, mode)
+    finally:
+        if g_journal is not None:
+            g_journal.close()
+
+
+# 複数のワーカープロセスを起動し，監視する（スーパーバイザー）
+# 異常終了したワーカーは再起動し，一定間隔で全ワーカーのカウンターを集計して表示する
+#   - n_workers: ワーカープロセスの数
+#   - report_interval: 集計結果を表示する間隔（秒）
+#   - uds_path: Unixドメインソケットのパス（使用しない場合は空文字列）
+#   - metrics_port, metrics_uds: 全ワーカーの動作状況を集計して提供するエンドポイント（start_metrics_server を参照）
+#   - journal_path: ジャーナルのファイル名（run_worker を参照）
+def run_supervisor(n_workers: int, mode: str, backlog: int, report_interval: float, uds_path='', metrics_port=0, metrics_uds='', journal_path=''):
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        print('SO_REUSEPORT is not available on this platform; --workers cannot be used.')
+        return
+
+    # Unixドメインソケットは SO_REUSEPORT を使えないため，1つのソケットを全ワーカーで共有する
+    uds_soc = create_uds_server_socket(uds_path, backlog) if uds_path else None
+
+    # ワーカーごとのカウンター（ワーカーを再起動しても値は引き継がれる）
+    shared = [multiprocessing.Array('q', DealerMetrics.SIZE, lock=False) for i in range(n_workers)]
+    workers = [None] * n_workers
+    n_restarts = 0
+
+    def spawn(i):
+        p = multiprocessing.Process(target=run_worker, args=(i, shared[i], mode, backlog, uds_soc, journal_path), daemon=True)
+        p.start()
+        workers[i] = p
+
+    # SIGTERM で停止された場合もワーカーを終了させる
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    for i in range(n_workers):
+        spawn(i)
+    metrics_socs = start_metrics_server(metrics_port, metrics_uds, lambda: DealerMetrics.aggregate(shared).render())
+    print('The dealer supervisor has started!! ({0} workers, {1} mode)'.format(n_workers, mode))
+
+    last_report = time.time()
+    try:
+        while True:
+            time.sleep(0.5)
+            for i, p in enumerate(workers):
+                if not p.is_alive():
+                    print('Worker {0} exited (code {1}); restarting.'.format(i, p.exitcode))
+                    n_restarts += 1
+                    spawn(i)
+            if report_interval > 0 and time.time() - last_report >= report_interval:
+                last_report = time.time()
+                total = DealerMetrics.aggregate(shared)
+                alive = sum(1 for p in workers if p.is_alive())
+                print('[supervisor] workers={0}/{1} restarts={2} {3}'.format(alive, n_workers, n_restarts, total.summary()))
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for p in workers:
+            if p is not None and p.is_alive():
+                p.terminate()
+        for p in workers:
+            if p is not None:
+                p.join(timeout=1.0)
+        print('[supervisor] final {0}'.format(DealerMetrics.aggregate(shared).summary()))
+        for soc in metrics_socs:
+            soc.close()
+        if metrics_uds:
+            try:
+                os.unlink(metrics_uds)
+            except OSError:
+                pass
+        if uds_soc is not None:
+            uds_soc.close()
+            try:
+                os.unlink(uds_path)
+            except OSError:
+                pass
+
+
+def main():
+    global g_shoe_pool_depth, g_verbose, g_journal
+
+    parser = argparse.ArgumentParser(description='Black Jack Dealer')
+    parser.add_argument('--mode', choices=['single', 'async'], default='single', help='single: one game at a time (default), async: serve every connection concurrently on an event loop')
+    parser.add_argument('--backlog', type=int, default=128, help='listen backlog of the dealer socket')
+    parser.add_argument('--workers', type=int, default=0, help='pre-fork this many worker processes sharing PORT via SO_REUSEPORT (0: run in this process)')
+    parser.add_argument('--report_interval', type=float, default=10.0, help='seconds between one-line metrics summaries (0: never)')
+    parser.add_argument('--uds', type=str, default='', help='also listen on this Unix domain socket path (for players on the same machine)')
+    parser.add_argument('--shoe_pool', type=int, default=0, help='pre-shuffle this many shoes per dealer in one vectorized call and refill them in the background (0: shuffle inline)')
+    parser.add_argument('--metrics_port', type=int, default=0, help='serve metrics for scraping over HTTP on 127.0.0.1:<port> (0: disabled)')
+    parser.add_argument('--metrics_uds', type=str, default='', help='serve metrics for scraping on this Unix domain socket path')
+    parser.add_argument('--verbose', action='store_true', help='print every game start, action and result')
+    parser.add_argument('--journal', type=str, default='', help='append every shoe and settled game to this binary journal (per-worker files with --workers)')
+    parser.add_argument('--table_policy', choices=['auto', 'session', 'shared'], default='auto',
+                        help='session: a private shoe per connection, shared: connections take turns on one shoe (auto: shared in single mode, session in async mode)')
+    args = parser.parse_args()
+
+    g_shoe_pool_depth = max(0, args.shoe_pool)
+    g_verbose = args.verbose
+    if args.table_policy == 'auto':
+        g_tables.policy = 'shared' if args.mode == 'single' else 'session'
+    else:
+        g_tables.policy = args.table_policy
+
+    # 乱数シードを固定する場合は以下をアンコメント（「314」の部分には適当なシード値を入れる）
+    #np.random.seed(314)
+
+    if args.workers > 0:
+        run_supervisor(args.workers, args.mode, args.backlog, args.report_interval, uds_path=args.uds,
+                       metrics_port=args.metrics_port, metrics_uds=args.metrics_uds, journal_path=args.journal)
+    else:
+        socs = [create_server_socket(args.backlog)]
+        if args.uds:
+            socs.append(create_uds_server_socket(args.uds, args.backlog))
+        if args.journal:
+            g_journal = JournalWriter(args.journal, 52 * N_DECKS)
+        if args.uds or args.metrics_uds or args.journal:
+            # SIGTERM で停止された場合もソケットファイルの削除・ジャーナルの書き出しを行う
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        start_metrics_server(args.metrics_port, args.metrics_uds, lambda: g_metrics.render() + g_tables.render())
+        if args.report_interval > 0:
+            threading.Thread(target=report_metrics, args=(args.report_interval, lambda: g_metrics), daemon=True).start()
+        try:
+            run_server(socs, args.mode)
+        finally:
+            if g_journal is not None:
+                g_journal.close()
+            for path in (args.uds, args.metrics_uds):
+                if path:
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
 
 
 if __name__ == '__main__':
@@ -1,15 +1,11 @@
-import pickle
 import csv
 from pathlib import Path
 from classes import Action
+from qtable_file import load_table_dict
 
 def load_qtable(path: Path):
-    with path.open('rb') as f:
-        obj = pickle.load(f)
-    if isinstance(obj, dict) and 'table' in obj:
-        table = obj['table']
-    else:
-        table = obj
+    # pickle (bare or with meta) or the binary format of qtable_file.py
+    table, _ = load_table_dict(str(path))
     # table is mapping of (state, Action)->Q_value
     # Reconstruct state-> {Action:Q}
     state_map = {}
@@ -71,7 +67,9 @@ def main():
         'rep_a015_g095_ps07_10k',
     ]
     for run in runs:
-        qpath = base / run / 'qtable.pkl'
+        qpath = base / run / 'qtable.qtable'
+        if not qpath.exists():
+            qpath = base / run / 'qtable.pkl'
         if not qpath.exists():
             print(f'[WARN] missing qtable for {run}')
             continue
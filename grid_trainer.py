@@ -0,0 +1,227 @@
+import math
+import numpy as np
+from batch_sim import BatchTables, UNSETTLED, WIN, DRAW, hand_scores
+from classes import Action, DenseQTable, QStateEncoder, CARD_VALUES
+from ai_player_Q import RETRY_MAX, RETRY_BUCKET_MAX, RETRY_PENALTY_SCALE, POLICY_N_SCORES, POLICY_N_LENGTHS, EPS_DECAY_EPISODES
+
+
+# ε の減衰の仕方（ai_player_Q.py の --eps_decay_type と同じ）
+EPS_DECAY_TYPES = ('const', 'linear', 'exp')
+
+# 直近の平均報酬を計算するゲーム数
+RECENT_WINDOW = 100
+
+# 乱数の列の種類（np.random.SeedSequence の spawn_key の先頭の値）
+SHOE_STREAM = 0
+EXPLORE_STREAM = 1
+
+# 探索用の乱数を列ごとにまとめて生成しておく数
+RANDOM_BUFFER = 4096
+
+
+# プレイヤーの手札の枚数の上限（シューの小さいカードから順に引いてバーストしない最大の枚数と，バーストさせる1枚）
+def max_hand_length():
+    total, n = 0, 0
+    for v in sorted(CARD_VALUES):
+        if total + v > 21:
+            break
+        total += v
+        n += 1
+    return n + 1
+
+
+# GridTrainer の状態の範囲（スコアは最大 21 + 10，手札枚数は max_hand_length まで．RETRYバケットは ai_player_Q と同じ）
+# ai_player_Q.make_dense_qtable の範囲（POLICY_N_SCORES, POLICY_N_LENGTHS）を含み，出現し得る全ての状態を丸めずに表せる
+GRID_SHAPE = (max(POLICY_N_SCORES, 21 + 10 + 1), max(POLICY_N_LENGTHS, max_hand_length() + 1), RETRY_BUCKET_MAX + 1)
+
+
+# 複数の設定（学習率，割引率，ε の減衰方法，シード）のQ学習を1つのプロセスでまとめて行うクラス
+# K 個の設定のQテーブルを形状 (K, 状態数, 行動数) の1つの配列で持ち，batch_sim.BatchTables の K 個のテーブルで
+# 各設定のゲームを同時に進める（1ステップごとに，設定ごとの alpha, gamma, ε の配列を使って行動選択と更新をまとめて行う）
+# 状態，報酬（RETRYペナルティを含む），ε の減衰，RETRY回数の上限の扱いは ai_player_Q.QLearningAgent と同じ
+# 状態の範囲は出現し得る全ての状態を含むため，dense のQテーブルでは範囲外（overflow）になる枚数の多い手札も別の状態として学習する
+class GridTrainer:
+
+    # コンストラクタ
+    #   - configs: 設定の辞書のリスト．キーは alpha, gamma, eps_start, eps_end, eps_decay_episodes, eps_decay_type, seed
+    #              （eps_decay_episodes は省略時 1000，seed は省略時 0）
+    #              シューの列と探索用の乱数は各設定の seed から作るため，同じ設定のリストからは同じ結果になる
+    #   - common_random: True の場合，seed の値が同じ設定どうしで同じシューの列と同じ探索用の乱数を使う
+    #                    （設定の違いだけが結果の違いになるため，設定どうしを直接比較できる）
+    #                    False の場合は seed の値が同じ設定どうしでも，その seed の何番目の設定かによって別の列を使う
+    #   - max_retries: 1ゲームあたりのRETRY回数の上限
+    #   - retry_penalty_scale: RETRYペナルティのエスカレーション係数
+    def __init__(self, configs, common_random=False, max_retries=RETRY_MAX, retry_penalty_scale=RETRY_PENALTY_SCALE):
+        self.configs = list(configs)
+        self.n_configs = K = len(self.configs)
+        self.alpha = np.array([c['alpha'] for c in self.configs], dtype=np.float64)
+        self.gamma = np.array([c['gamma'] for c in self.configs], dtype=np.float64)
+        self.eps_start = np.array([c['eps_start'] for c in self.configs], dtype=np.float64)
+        self.eps_end = np.array([c['eps_end'] for c in self.configs], dtype=np.float64)
+        self.eps_decay_episodes = np.array([max(1, c.get('eps_decay_episodes', EPS_DECAY_EPISODES)) for c in self.configs], dtype=np.float64)
+        self.eps_decay_type = np.array([EPS_DECAY_TYPES.index(c['eps_decay_type']) for c in self.configs])
+        self.max_retries = max(0, max_retries)
+        self.retry_penalty_scale = max(0.0, retry_penalty_scale)
+
+        # Qテーブル（状態の範囲は GRID_SHAPE．行動の並びは DenseQTable と同じ）
+        self.encoder = QStateEncoder(*GRID_SHAPE)
+        self.actions = tuple(a for a in Action if a != Action.UNDEFINED)
+        self.action_codes = np.array([a.value for a in self.actions], dtype=np.uint8)
+        self.values = np.zeros((K, self.encoder.size, len(self.actions)), dtype=np.float64)
+        self.known = np.zeros((K, self.encoder.size, len(self.actions)), dtype=bool) # 値をセットしたか否か
+
+        # 乱数を共有するグループ（common_random の場合は seed の値が同じ設定，それ以外は設定ごと）
+        # グループの乱数の列は (seed, その seed の何番目のグループか) から作る
+        streams = {} # (seed, 番号) -> グループの番号
+        counts = {}
+        groups = []
+        for c in self.configs:
+            seed = int(c.get('seed', 0))
+            n = 0 if common_random else counts.get(seed, 0)
+            counts[seed] = n + 1
+            groups.append(streams.setdefault((seed, n), len(streams)))
+        self.groups = np.array(groups, dtype=np.int64)
+        self.n_groups = len(streams)
+        keys = list(streams)
+        self.tables = BatchTables(K, shoe_seeds=[np.random.SeedSequence(keys[g][0], spawn_key=(SHOE_STREAM, keys[g][1])) for g in groups])
+        self.rngs = [np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(EXPLORE_STREAM, n))) for seed, n in keys]
+        self.random_buffer = np.zeros((self.n_groups, RANDOM_BUFFER), dtype=np.float64)
+        self.random_pos = np.full(self.n_groups, RANDOM_BUFFER, dtype=np.int64) # 次に使う位置（RANDOM_BUFFER なら空）
+
+        # 成績
+        self.n_games = 0
+        self.total_rewards = np.zeros(K, dtype=np.int64)
+        self.recent_rewards = np.zeros((K, RECENT_WINDOW), dtype=np.int64) # 直近 RECENT_WINDOW ゲームの報酬（リングバッファ）
+        self.wins = np.zeros(K, dtype=np.int64)
+        self.draws = np.zeros(K, dtype=np.int64)
+
+    # n ゲーム目の各設定の ε（QLearningAgent.epsilon と同じ）
+    def epsilons(self, n: int):
+        fraction = np.minimum(1.0, (n - 1) / self.eps_decay_episodes)
+        linear = self.eps_start + fraction * (self.eps_end - self.eps_start)
+        tau = np.maximum(1.0, self.eps_decay_episodes / 5.0)
+        exp = self.eps_end + (self.eps_start - self.eps_end) * np.exp(-(n - 1) / tau)
+        return np.select([self.eps_decay_type == 1, self.eps_decay_type == 2], [linear, exp], self.eps_start)
+
+    # 指定したテーブルの現在の状態 (スコア, 手札枚数, RETRYバケット) を添字に変換
+    # スコアと手札枚数は GRID_SHAPE の範囲に必ず収まる．RETRYバケットは QLearningAgent.observe と同じく上限の値でまとめる
+    def encode(self, idx):
+        t = self.tables
+        _, n_lengths, n_buckets = self.encoder.shape
+        s = hand_scores(t.p_hard[idx], t.p_aces[idx])
+        l = t.p_n[idx]
+        r = np.minimum(t.retries[idx], n_buckets - 1)
+        return (s.astype(np.int64) * n_lengths + l) * n_buckets + r
+
+    # 一様乱数を指定した形状でグループごとに引き，各テーブルに配る
+    # 乱数を消費するのは idx のテーブルを含むグループの列だけなので，各グループの乱数の列は他のグループの進み方によらない
+    def group_random(self, idx, *shape):
+        n = math.prod(shape)
+        active = np.zeros(self.n_groups, dtype=bool)
+        active[self.groups[idx]] = True
+        groups = np.flatnonzero(active)
+        inverse = (np.cumsum(active) - 1)[self.groups[idx]]
+        pos = self.random_pos
+        for g in groups[pos[groups] + n > RANDOM_BUFFER]:
+            rest = RANDOM_BUFFER - pos[g]
+            self.random_buffer[g, :rest] = self.random_buffer[g, pos[g]:]
+            self.random_buffer[g, rest:] = self.rngs[g].random(RANDOM_BUFFER - rest)
+            pos[g] = 0
+        values = self.random_buffer[groups[:, None], pos[groups][:, None] + np.arange(n)]
+        pos[groups] += n
+        return values[inverse].reshape((len(idx),) + shape)
+
+    # 全設定で1ゲームずつ決着までプレイし，Qテーブルを更新する
+    def play_game(self):
+        t = self.tables
+        K = self.n_configs
+        self.n_games += 1
+        eps = self.epsilons(self.n_games)
+        t.deal()
+
+        rows = np.arange(K)
+        state = self.encode(rows)
+        game_rewards = np.zeros(K, dtype=np.int64)
+        actions = np.zeros(K, dtype=np.uint8)
+        idx = rows
+        while len(idx) > 0:
+            s = state[idx]
+            retries = t.retries[idx]
+
+            # ε-greedy で行動を選択（同じQ値の行動からはランダムに選ぶ．RETRY上限到達時はランダム行動から RETRY を除く）
+            q = self.values[idx, s]
+            is_best = q == q.max(axis=1, keepdims=True)
+            greedy = np.argmax(self.group_random(idx, len(self.actions)) * is_best, axis=1)
+            can_retry = retries < self.max_retries
+            n_options = np.where(can_retry, len(self.actions), len(self.actions) - 1)
+            explore = np.minimum((self.group_random(idx) * n_options).astype(np.int64), n_options - 1)
+            j = np.where(self.group_random(idx) < eps[idx], explore, greedy)
+
+            # RETRY上限到達後に RETRY を選んだ場合は他の行動からランダムに選択
+            capped = (self.action_codes[j] == Action.RETRY.value) & ~can_retry
+            if capped.any():
+                j[capped] = np.minimum((self.group_random(idx)[capped] * (len(self.actions) - 1)).astype(np.int64), len(self.actions) - 2)
+            code = self.action_codes[j]
+
+            # RETRYペナルティ（QLearningAgent.retry と同じ）
+            is_retry = code == Action.RETRY.value
+            penalty = np.where(is_retry, (t.bets[idx] / 4.0 * (1.0 + self.retry_penalty_scale * retries)).astype(np.int64), 0)
+
+            # 行動を実行
+            actions[idx] = code
+            t.step(actions)
+            done = t.status[idx] != UNSETTLED
+            bets = t.bets[idx]
+            rewards = np.where(done, (bets * t.rates[idx]).astype(np.int64) - bets, 0) - penalty
+
+            # Qテーブルを更新
+            s2 = self.encode(idx)
+            self.update(idx, s, j, rewards, s2)
+
+            state[idx] = s2
+            game_rewards[idx] += rewards
+            idx = idx[~done]
+
+        # 成績を記録
+        self.total_rewards += game_rewards
+        self.recent_rewards[:, (self.n_games - 1) % RECENT_WINDOW] = game_rewards
+        self.wins += t.status == WIN
+        self.draws += t.status == DRAW
+        return game_rewards
+
+    # 設定 idx のQテーブルを更新（状態の添字 s で行動の添字 j を実行し，報酬 rewards を得て状態の添字 s2 に遷移した場合）
+    # 決着した遷移でも遷移後の状態の最大Q値を使う（QLearningAgent.update と同じ）
+    def update(self, idx, s, j, rewards, s2):
+        V = self.values[idx, s2].max(axis=1)
+        Q = self.values[idx, s, j]
+        self.values[idx, s, j] = (1 - self.alpha[idx]) * Q + self.alpha[idx] * (rewards + self.gamma[idx] * V)
+        self.known[idx, s, j] = True
+
+    # 全設定で n_games ゲームずつプレイする
+    def train(self, n_games: int):
+        for _ in range(n_games):
+            self.play_game()
+
+    # k 番目の設定のQテーブル（配列をコピーせずに使う DenseQTable．encoder は GRID_SHAPE の大きさ）
+    # to_dict の内容は，QLearningAgent の dense のQテーブル（配列と範囲外の状態の辞書）の to_dict と同じ形になる
+    def q_table(self, k: int):
+        q_table = DenseQTable(Action, default_value=0, encoder=self.encoder)
+        shape = self.encoder.shape + (len(self.actions),)
+        q_table.attach(self.values[k].reshape(shape), self.known[k].reshape(shape))
+        return q_table
+
+    # 各設定の成績
+    # 戻り値は辞書のリスト（キーは episodes, avg_reward, mov_avg_100, win_rate, draw_rate と，設定の各キー）
+    def results(self):
+        n = self.n_games
+        recent = self.recent_rewards[:, :min(n, RECENT_WINDOW)]
+        results = []
+        for k, config in enumerate(self.configs):
+            result = dict(config)
+            result['episodes'] = n
+            result['avg_reward'] = float(self.total_rewards[k]) / n if n else 0.0
+            result['mov_avg_100'] = float(recent[k].mean()) if n else 0.0
+            result['win_rate'] = float(self.wins[k]) / n if n else 0.0
+            result['draw_rate'] = float(self.draws[k]) / n if n else 0.0
+            results.append(result)
+        return results
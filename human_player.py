@@ -1,4 +1,3 @@
-import copy
 import socket
 import argparse
 import tkinter as tk
@@ -176,8 +175,9 @@ class HumanPlayerWindow():
         self.state = self.get_state()
 
     # 現時点での手札情報（ディーラー手札は見えているもののみ）を取得
+    # 手札はコピーせず，読み出し専用のビュー（classes.HandView）を返す
     def get_current_hands(self):
-        return copy.deepcopy(self.player.player_hand), copy.deepcopy(self.player.dealer_hand)
+        return self.player.player_hand.view(), self.player.dealer_hand.view()
 
     # HITを実行する
     def hit(self):
@@ -0,0 +1,221 @@
+import time
+import queue
+import struct
+import threading
+import numpy as np
+from collections import namedtuple
+from classes import Action
+from protocol import STATUS_CODES, STATUS_NAMES
+
+
+# ディーラーのジャーナル（シューと各ゲームの経過を記録する追記専用のバイナリファイル）
+#
+# ファイル: [ヘッダ] [レコード] [レコード] ...
+#   ヘッダ: [マジック 'BJJ'(3バイト)] [バージョン(1バイト)] [1シューのカード枚数(2バイト)]
+#   レコード: [種別(1バイト)] [ペイロード長(4バイト)] [ペイロード]   （数値はすべてビッグエンディアン）
+#
+# レコード種別
+#   - RUN: ジャーナルを開いたことを示す（同じファイルに追記した場合，ディーラー番号はここから振り直される）
+#   - SHOE: シャッフル後のカード列（ディーラー番号 + カードID の列）
+#   - GAME: 決着した1ゲームの経過（ディーラー番号，セッション番号，ゲームID，開始時のカード位置，配当倍率，ステータス，行動コードの列，配られたカードの列）
+# 配られたカードの列には，RETRY で破棄されたカードも含めて引いた順に全て記録する
+# バージョン 1 では GAME の行動数とカード数が各1バイトだった（読み込みのみ対応）
+
+JOURNAL_MAGIC = b'BJJ'
+JOURNAL_VERSION = 2
+FILE_HEADER = struct.Struct('!3sBH')
+RECORD_HEADER = struct.Struct('!BI')
+
+RECORD_RUN = 1
+RECORD_SHOE = 2
+RECORD_GAME = 3
+
+RUN_PAYLOAD = struct.Struct('!d')  # ジャーナルを開いた時刻（UNIX時間）
+SHOE_PAYLOAD = struct.Struct('!I') # ディーラー番号（カードID の uint16 配列が後に続く）
+GAME_PAYLOAD = struct.Struct('!IIIHfBHH') # ディーラー番号, セッション番号, ゲームID, 開始位置, 配当倍率, ステータス, 行動数, カード数（行動コードとカードID が後に続く）
+GAME_PAYLOADS = {1: struct.Struct('!IIIHfBBB'), JOURNAL_VERSION: GAME_PAYLOAD} # バージョンごとの GAME のペイロード
+
+CARD_DTYPE = np.dtype('>u2')
+
+# 1ゲーム分の記録
+#   - actions: 行動コードの bytes
+#   - cards: 配られたカードID の配列（引いた順）
+GameRecord = namedtuple('GameRecord', ['stream_id', 'session_id', 'game_id', 'start_pos', 'rate', 'status', 'actions', 'cards'])
+
+
+# ジャーナルを書き込むクラス
+# レコードはメモリ上のバッファに貯め，一定量を超えたらバックグラウンドスレッドがまとめてファイルに書き出す
+# （ディーラーの処理中にディスクへの書き込みを待たないようにする）
+#   - path: ファイル名（既に存在する場合は追記する．別のバージョンのジャーナルには追記できない）
+#   - n_cards: 1つのシューのカード枚数
+#   - buffer_size: バックグラウンドスレッドに書き出しを依頼するバッファのサイズ（バイト）
+class JournalWriter:
+
+    def __init__(self, path: str, n_cards: int, buffer_size=1 << 16):
+        self.path = path
+        self.n_cards = n_cards
+        self.buffer_size = buffer_size
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(FILE_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, n_cards))
+        else:
+            with open(path, 'rb') as f:
+                header = f.read(FILE_HEADER.size)
+            if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header)[:2] != (JOURNAL_MAGIC, JOURNAL_VERSION):
+                self.file.close()
+                raise ValueError('cannot append to {0}: not a journal file of version {1}'.format(path, JOURNAL_VERSION))
+        self.buf = bytearray()
+        self.lock = threading.Lock()
+        self.queue = queue.SimpleQueue()
+        self.n_streams = 0
+        self.n_games = 0
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+        self.append(RECORD_RUN, RUN_PAYLOAD.pack(time.time()))
+
+    # バックグラウンドスレッドの処理（依頼されたデータを順番にファイルに書き出す）
+    def write_loop(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            self.file.write(data)
+        self.file.flush()
+
+    # 新しいディーラー番号を取得
+    def new_stream_id(self):
+        with self.lock:
+            self.n_streams += 1
+            return self.n_streams
+
+    # レコードを1つ追加
+    def append(self, record_type: int, payload: bytes):
+        data = None
+        with self.lock:
+            self.buf += RECORD_HEADER.pack(record_type, len(payload))
+            self.buf += payload
+            if record_type == RECORD_GAME:
+                self.n_games += 1
+            if len(self.buf) >= self.buffer_size:
+                data, self.buf = self.buf, bytearray()
+        if data is not None:
+            self.queue.put(data)
+
+    # シャッフル後のシューを記録
+    def write_shoe(self, stream_id: int, cards):
+        self.append(RECORD_SHOE, SHOE_PAYLOAD.pack(stream_id) + np.asarray(cards, dtype=CARD_DTYPE).tobytes())
+
+    # 決着した1ゲームの経過を記録
+    def write_game(self, stream_id: int, session_id: int, game_id: int, start_pos: int, actions, cards, status: str, rate: float):
+        header = GAME_PAYLOAD.pack(stream_id, session_id, game_id, start_pos, rate, STATUS_CODES[status], len(actions), len(cards))
+        self.append(RECORD_GAME, header + bytes(actions) + np.asarray(cards, dtype=CARD_DTYPE).tobytes())
+
+    # バッファに残っているレコードの書き出しを依頼
+    def flush(self):
+        with self.lock:
+            data, self.buf = self.buf, bytearray()
+        if data:
+            self.queue.put(data)
+
+    # 残りのレコードを全て書き出してファイルを閉じる
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+
+# ジャーナルを読み込み，レコードを順番に返すジェネレータ
+# ファイル全体をメモリに読み込んでから解析する（書き込み途中で切れた末尾のレコードは無視する）
+# 戻り値は (種別, 内容) のタプル
+#   - RECORD_RUN: 開いた時刻
+#   - RECORD_SHOE: (ディーラー番号, カードID の配列)
+#   - RECORD_GAME: GameRecord
+def read_journal(path: str):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < FILE_HEADER.size:
+        raise ValueError('{0} is not a journal file'.format(path))
+    magic, version, n_cards = FILE_HEADER.unpack_from(data, 0)
+    if magic != JOURNAL_MAGIC or version not in GAME_PAYLOADS:
+        raise ValueError('{0} is not a journal file (version {1})'.format(path, ', '.join(str(v) for v in sorted(GAME_PAYLOADS))))
+    game_payload = GAME_PAYLOADS[version]
+    pos = FILE_HEADER.size
+    while pos + RECORD_HEADER.size <= len(data):
+        record_type, length = RECORD_HEADER.unpack_from(data, pos)
+        start = pos + RECORD_HEADER.size
+        end = start + length
+        if end > len(data):
+            break
+        if record_type == RECORD_RUN:
+            yield record_type, RUN_PAYLOAD.unpack_from(data, start)[0]
+        elif record_type == RECORD_SHOE:
+            stream_id, = SHOE_PAYLOAD.unpack_from(data, start)
+            cards = np.frombuffer(data, dtype=CARD_DTYPE, count=(length - SHOE_PAYLOAD.size) // 2, offset=start + SHOE_PAYLOAD.size).astype(np.int64)
+            yield record_type, (stream_id, cards)
+        elif record_type == RECORD_GAME:
+            stream_id, session_id, game_id, start_pos, rate, status, n_actions, n_dealt = game_payload.unpack_from(data, start)
+            p = start + game_payload.size
+            actions = data[p:p + n_actions]
+            cards = np.frombuffer(data, dtype=CARD_DTYPE, count=n_dealt, offset=p + n_actions)
+            yield record_type, GameRecord(stream_id, session_id, game_id, start_pos, rate, STATUS_NAMES[status], actions, cards)
+        pos = end
+
+
+# ジャーナルに記録された各ゲームを，そのゲームで使われていたシューとともに順番に返すジェネレータ
+# 戻り値は (シュー, GameRecord) のタプル
+def journal_games(path: str):
+    shoes = {}
+    for record_type, record in read_journal(path):
+        if record_type == RECORD_RUN:
+            shoes = {}
+        elif record_type == RECORD_SHOE:
+            shoes[record[0]] = record[1]
+        elif record_type == RECORD_GAME and record.stream_id in shoes:
+            yield shoes[record.stream_id], record
+
+
+# ディーラーのシューをジャーナルの記録の状態に戻し，初期カードを配る
+#   - dealer: 再現に使用するディーラー（カード枚数はジャーナルと同じであること）
+def restore_game(dealer, shoe, start_pos: int):
+    dealer.card_set.restore((shoe, start_pos))
+    dealer.deal_initial_cards()
+
+
+# ジャーナルに記録された行動をディーラーで再実行し，記録どおりの結果になるかを確認する
+# 戻り値は (再実行したゲーム数, 記録と一致しなかったゲーム数)
+#   - dealer: 再現に使用するディーラー（dealer.create_dealer などで作成．ジャーナルへの記録は行わないこと）
+def replay_verify(path: str, dealer):
+    n_games = 0
+    n_mismatches = 0
+    for shoe, game in journal_games(path):
+        restore_game(dealer, shoe, game.start_pos)
+        status, rate = 'unsettled', 0.0
+        for code in game.actions:
+            status, rate, _, _ = dealer.apply_action(Action(code))
+        dealt = dealer.card_set.all_cards[game.start_pos:dealer.card_set.pos]
+        if status != game.status or abs(rate - game.rate) > 1e-6 or not np.array_equal(dealt, game.cards):
+            n_mismatches += 1
+        n_games += 1
+    return n_games, n_mismatches
+
+
+# ジャーナルに記録された各ゲームを，同じシュー・同じ開始位置から別の方策でプレイし直す
+# 戻り値は (記録された GameRecord, Dealer.play_policy_game の戻り値) のリスト
+# （新しい方策が記録より多くのカードを引いてシューの末尾を超えたゲームは除く）
+#   - dealer: 再現に使用するディーラー（一括プレイと同様，未定義の状態での行動選択にはディーラーの乱数を使う）
+#   - policy: 方策テーブル（protocol.encode_batch_request と同じ形式の uint8 配列）
+#   - max_retries: 1ゲームあたりのRETRY回数の上限
+def replay_policy(path: str, dealer, policy, max_retries: int):
+    policy = np.ascontiguousarray(policy, dtype=np.uint8)
+    table = policy.tobytes()
+    results = []
+    for shoe, game in journal_games(path):
+        restore_game(dealer, shoe, game.start_pos)
+        try:
+            results.append((game, dealer.play_policy_game(table, policy.shape, max_retries)))
+        except IndexError:
+            continue
+    return results
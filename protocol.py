@@ -0,0 +1,347 @@
+import socket
+import struct
+from classes import Action, DealerChannel, parse_result_message
+
+
+# ディーラー・プレイヤー間のバイナリプロトコル（長さ付きフレーム形式）
+#
+# 接続直後の最初のゲームでは，従来どおりディーラーから "shuffled,yes/no" がテキストで送られてくる．
+# プレイヤーは確認応答 'ack' の代わりに HELLO（'BJP' + バージョン番号 + オプション）を返すことで，
+# 以降の通信をバイナリ形式に切り替えることができる（HELLO を知らない従来のディーラーの場合はテキストのまま）．
+# マジックが正しくない HELLO や，対応していないバージョンの HELLO を受信したディーラーは接続を閉じる．
+#
+# フレーム: [長さ(2バイト)] [種別(1バイト)] [ペイロード]   （長さは種別とペイロードの合計バイト数，ビッグエンディアン）
+# 長さは1以上（種別を含まない長さ0のフレームは不正なフレームとして扱う）．
+# バイナリ形式では "shuffled" の通知と確認応答は不要になり，シャッフル有無は初期カードと同じフレームで送られる．
+# また，プレイヤーは応答を待たずに複数のフレームを続けて送信できる（パイプライン化）．
+# 例えばゲームを決着させる行動（STAND など）と次のゲームの要求を1回でまとめて送ると，行動結果に続けて次のゲームの開始フレームが届く．
+
+# プロトコルのバージョン
+PROTOCOL_VERSION = 1
+
+# HELLO: [マジック(3バイト)] [バージョン(1バイト)] [オプション長(2バイト)] [オプション]
+# オプションはテキスト形式の確認応答 'ack,<オプション>' と同じセッションオプション（例: b'seed=123'，classes.parse_session_options）
+HELLO_MAGIC = b'BJP'
+HELLO_HEADER = struct.Struct('!3sBH')
+
+# フレームヘッダ
+FRAME_HEADER = struct.Struct('!HB')
+
+# フレーム種別
+FRAME_GAME = 1   # ディーラー→プレイヤー: ゲーム開始（シャッフル有無, ディーラーカード, プレイヤーカード1, プレイヤーカード2）
+FRAME_RESULT = 2 # ディーラー→プレイヤー: 行動結果（フラグ, プレイヤーカード, スコア, ステータス, 配当倍率, ディーラーカード...）
+FRAME_ACTION = 3 # プレイヤー→ディーラー: 行動（行動コード）
+FRAME_NEXT = 4   # プレイヤー→ディーラー: 次のゲームを要求
+FRAME_QUIT = 5   # プレイヤー→ディーラー: セッション終了
+FRAME_BATCH = 6         # プレイヤー→ディーラー: 方策テーブルを渡して複数ゲームの一括プレイを要求
+FRAME_BATCH_RESULT = 7  # ディーラー→プレイヤー: 一括プレイの結果（1ゲーム1レコード，複数レコードをまとめて送信）
+FRAME_BATCH_END = 8     # ディーラー→プレイヤー: 一括プレイの終了
+
+GAME_PAYLOAD = struct.Struct('!BBBB')
+RESULT_PAYLOAD = struct.Struct('!BBBBf') # ディーラーカード（1枚1バイト）が後に続く
+
+# 一括プレイ要求: [ゲーム数(4バイト)] [RETRY上限(1バイト)] [スコア数, 手札枚数の数, RETRYバケット数(各1バイト)] + 方策テーブル
+# 方策テーブルは (score, hand_length, retry_bucket) -> 行動コード の uint8 配列を C 順に並べたもの
+# 行動コード 0 (UNDEFINED) は「全行動からランダムに選択」を表す
+BATCH_REQUEST = struct.Struct('!IBBBB')
+
+# 一括プレイ要求で指定できるRETRY上限の最大値（1バイトに収まる範囲．結果レコードのRETRY回数も1バイト）
+BATCH_MAX_RETRIES = 0xFF
+
+# 一括プレイ結果の1レコード: [初期スコア] [最初の行動コード] [ステータス] [配当倍率] [RETRY回数] [ダブルダウンしたか否か]
+BATCH_RECORD = struct.Struct('!BBBfBB')
+
+# 1つの FRAME_BATCH_RESULT フレームに含める最大レコード数
+BATCH_RECORDS_PER_FRAME = 1024
+
+# RESULT フレームのフラグ
+RESULT_HAS_PLAYER_CARD = 0x01
+RESULT_HAS_DEALER_CARDS = 0x02
+
+# ステータス文字列とステータスコードの対応
+STATUS_CODES = {'unsettled': 0, 'win': 1, 'lose': 2, 'draw': 3, 'bust': 4, 'surrendered': 5}
+STATUS_NAMES = {v: k for k, v in STATUS_CODES.items()}
+
+# コマンド文字列と行動コードの対応（行動コードは Action の値）
+COMMAND_ACTIONS = {
+    'hit': Action.HIT,
+    'stand': Action.STAND,
+    'double_down': Action.DOUBLE_DOWN,
+    'surrender': Action.SURRENDER,
+    'retry': Action.RETRY,
+}
+
+
+# HELLO を作成
+#   - options: オプション（bytes）
+def encode_hello(options=b'', version=PROTOCOL_VERSION):
+    return HELLO_HEADER.pack(HELLO_MAGIC, version, len(options)) + options
+
+
+# 受信データの先頭から HELLO を解析
+# 戻り値は (version, options, 消費したバイト数)．データが足りない場合は None
+# マジックが正しくない場合は ValueError を送出する
+def decode_hello(data):
+    if bytes(data[:len(HELLO_MAGIC)]) != HELLO_MAGIC[:len(data)]:
+        raise ValueError('bad HELLO magic')
+    if len(data) < HELLO_HEADER.size:
+        return None
+    magic, version, opt_len = HELLO_HEADER.unpack_from(data, 0)
+    end = HELLO_HEADER.size + opt_len
+    if len(data) < end:
+        return None
+    return version, bytes(data[HELLO_HEADER.size:end]), end
+
+
+# フレームを作成
+def encode_frame(frame_type: int, payload=b''):
+    return FRAME_HEADER.pack(len(payload) + 1, frame_type) + payload
+
+
+# ゲーム開始フレームを作成
+def encode_game(shuffled: bool, dc: int, pc1: int, pc2: int):
+    return encode_frame(FRAME_GAME, GAME_PAYLOAD.pack(1 if shuffled else 0, dc, pc1, pc2))
+
+
+# ゲーム開始フレームのペイロードを解析
+# 戻り値は (shuffled, dc, pc1, pc2)
+def decode_game(payload):
+    shuffled, dc, pc1, pc2 = GAME_PAYLOAD.unpack_from(payload, 0)
+    return shuffled != 0, dc, pc1, pc2
+
+
+# 行動結果フレームを作成
+#   - player_card: 通知するプレイヤーカード（通知しない場合は None）
+#   - dealer_cards: 通知するディーラーカードのリスト（通知しない場合は None）
+def encode_result(player_card, score: int, status: str, rate: float, dealer_cards=None):
+    flags = 0
+    if player_card is not None:
+        flags |= RESULT_HAS_PLAYER_CARD
+    else:
+        player_card = 0
+    if dealer_cards is not None:
+        flags |= RESULT_HAS_DEALER_CARDS
+    else:
+        dealer_cards = []
+    payload = RESULT_PAYLOAD.pack(flags, player_card, score, STATUS_CODES[status], rate) + bytes(dealer_cards)
+    return encode_frame(FRAME_RESULT, payload)
+
+
+# 行動結果フレームのペイロードを解析
+# 戻り値は parse_result_message と同じ (player_card, score, status, rate, dealer_cards) のタプル
+def decode_result(payload):
+    flags, player_card, score, status, rate = RESULT_PAYLOAD.unpack_from(payload, 0)
+    if not flags & RESULT_HAS_PLAYER_CARD:
+        player_card = None
+    dealer_cards = list(payload[RESULT_PAYLOAD.size:])
+    return player_card, score, STATUS_NAMES[status], rate, dealer_cards
+
+
+# 一括プレイ要求フレームを作成
+#   - policy: 方策テーブル（形状 (スコア数, 手札枚数の数, RETRYバケット数) の uint8 配列, 値は行動コード）
+#   - n_games: プレイするゲーム数
+#   - max_retries: 1ゲームあたりのRETRY回数の上限（0 以上 BATCH_MAX_RETRIES 以下）
+# 各値がヘッダのフィールドに収まらない場合は ValueError を送出する
+def encode_batch_request(policy, n_games: int, max_retries: int):
+    n_scores, n_lengths, n_buckets = policy.shape
+    if not 0 <= max_retries <= BATCH_MAX_RETRIES:
+        raise ValueError('max_retries must be between 0 and {0} for batch play, got {1}'.format(BATCH_MAX_RETRIES, max_retries))
+    if not 0 <= n_games <= 0xFFFFFFFF:
+        raise ValueError('n_games must be between 0 and {0} for batch play, got {1}'.format(0xFFFFFFFF, n_games))
+    if not all(1 <= n <= 0xFF for n in policy.shape):
+        raise ValueError('policy table shape {0} does not fit the batch request header (1 to 255 per dimension)'.format(policy.shape))
+    if 1 + BATCH_REQUEST.size + policy.size > 0xFFFF:
+        raise ValueError('policy table of {0} entries does not fit in one frame'.format(policy.size))
+    header = BATCH_REQUEST.pack(n_games, max_retries, n_scores, n_lengths, n_buckets)
+    return encode_frame(FRAME_BATCH, header + bytes(policy.astype('uint8').tobytes(order='C')))
+
+
+# 一括プレイ要求フレームのペイロードを解析
+# 戻り値は (n_games, max_retries, shape, table)．table は方策テーブルを平坦化した bytes
+def decode_batch_request(payload):
+    n_games, max_retries, n_scores, n_lengths, n_buckets = BATCH_REQUEST.unpack_from(payload, 0)
+    table = payload[BATCH_REQUEST.size:]
+    if len(table) != n_scores * n_lengths * n_buckets:
+        raise ValueError('policy table size mismatch')
+    return n_games, max_retries, (n_scores, n_lengths, n_buckets), table
+
+
+# 一括プレイ結果フレームを作成
+#   - records: (初期スコア, 最初の行動コード, ステータス, 配当倍率, RETRY回数, ダブルダウンしたか否か) のリスト
+def encode_batch_result(records):
+    payload = b''.join(BATCH_RECORD.pack(s, a, STATUS_CODES[st], r, n, d) for s, a, st, r, n, d in records)
+    return encode_frame(FRAME_BATCH_RESULT, payload)
+
+
+# 一括プレイ結果フレームのペイロードを解析（戻り値は encode_batch_result の records と同じ形式）
+def decode_batch_result(payload):
+    records = []
+    for s, a, st, r, n, d in BATCH_RECORD.iter_unpack(payload):
+        records.append((s, a, STATUS_NAMES[st], r, n, d))
+    return records
+
+
+# コマンド文字列（'hit', 'next' など）をフレームに変換
+def encode_command(cmd: str):
+    if cmd == 'next':
+        return encode_frame(FRAME_NEXT)
+    elif cmd in COMMAND_ACTIONS:
+        return encode_frame(FRAME_ACTION, bytes([COMMAND_ACTIONS[cmd].value]))
+    else:
+        return encode_frame(FRAME_QUIT)
+
+
+# 受信バッファ
+# TCPではデータが任意の位置で分割・結合されて届くため，受信データを溜めておき，完全なフレームだけを取り出す
+class FrameBuffer:
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    # 受信データを追加
+    def feed(self, data):
+        self.buf += data
+
+    # 完全なフレームが1つ以上溜まっているか否か
+    # 先頭のフレームの長さが0の場合は，以降のフレーム境界が分からなくなるため ValueError を送出する
+    def has_frame(self):
+        if len(self.buf) < 2:
+            return False
+        length = int.from_bytes(self.buf[:2], 'big')
+        if length == 0:
+            raise ValueError('empty frame')
+        return len(self.buf) >= 2 + length
+
+    # 先頭のフレームを取り出す
+    # 戻り値は (種別, ペイロード)．完全なフレームがない場合は None（不正なフレームの場合は has_frame と同じく ValueError）
+    def next_frame(self):
+        if not self.has_frame():
+            return None
+        length, frame_type = FRAME_HEADER.unpack_from(self.buf, 0)
+        payload = bytes(self.buf[FRAME_HEADER.size:2 + length])
+        del self.buf[:2 + length]
+        return frame_type, payload
+
+
+# バイナリプロトコルでディーラーとやり取りするための通信路（プレイヤー側）
+# Player の各メソッドにソケットの代わりに渡して使用する
+class BinaryChannel(DealerChannel):
+
+    # コンストラクタ
+    #   - sock: ディーラーと接続済みのソケット
+    #   - options: HELLO に付与するオプション
+    def __init__(self, sock: socket.socket, options=b''):
+        self.sock = sock
+        self.options = options
+        self.rbuf = FrameBuffer()
+        self.negotiated = False # HELLO を送信済みか否か
+        self.binary = False # ディーラーがバイナリ形式を受け入れたか否か
+        self.init_cards = None # ゲーム開始フレームで受信した初期カード
+
+    # ソケットから1フレームを受信
+    def recv_frame(self):
+        try:
+            while not self.rbuf.has_frame():
+                data = self.sock.recv(4096)
+                if not data:
+                    raise ConnectionError('connection closed by the dealer')
+                self.rbuf.feed(data)
+            return self.rbuf.next_frame()
+        except ValueError as e:
+            raise ConnectionError('malformed frame from the dealer: {0}'.format(e))
+
+    # 指定した種別のフレームを受信
+    def expect_frame(self, frame_type: int):
+        t, payload = self.recv_frame()
+        if t != frame_type:
+            raise ConnectionError('unexpected frame type {0} (expected {1})'.format(t, frame_type))
+        return payload
+
+    def send_command(self, cmd: str):
+        if self.binary:
+            self.sock.sendall(encode_command(cmd))
+        else:
+            self.sock.send(bytes(cmd, 'utf-8'))
+
+    def send_commands(self, cmds):
+        if self.binary:
+            self.sock.sendall(b''.join(encode_command(c) for c in cmds)) # 1回のシステムコールでまとめて送信
+        else:
+            super().send_commands(cmds) # テキスト形式ではフレーム境界がないためパイプライン化できない
+
+    def supports_pipelining(self):
+        return self.binary
+
+    def recv_shuffle_status(self, options=''):
+
+        # バイナリ形式: ゲーム開始フレームにシャッフル有無と初期カードが含まれる
+        if self.binary:
+            shuffled, dc, pc1, pc2 = decode_game(self.expect_frame(FRAME_GAME))
+            self.init_cards = (dc, pc1, pc2)
+            return shuffled
+
+        # テキスト形式
+        msg = self.sock.recv(1024).decode('utf-8').split(',')
+        if self.negotiated:
+            self.sock.send(bytes('ack', 'utf-8'))
+            return msg[1] == 'yes'
+
+        # 確認応答の代わりに HELLO を送信し，バイナリ形式への切り替えを提案（セッションオプションは HELLO に付与する）
+        self.sock.sendall(encode_hello(self.options or bytes(options, 'utf-8')))
+        self.negotiated = True
+
+        # 先頭バイトでディーラーの応答形式を判定
+        # （フレームの先頭は長さの上位バイト = 0，テキスト形式の初期カードは数字で始まる）
+        while len(self.rbuf.buf) == 0:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionError('connection closed by the dealer')
+            self.rbuf.feed(data)
+        if self.rbuf.buf[0] != 0:
+            # HELLO を知らないディーラー: テキスト形式の初期カード（シャッフル有無は最初の通知のとおり）
+            cards = self.rbuf.buf.decode('utf-8').split(',')
+            self.rbuf.buf.clear()
+            self.init_cards = (int(cards[0]), int(cards[1]), int(cards[2]))
+            return msg[1] == 'yes'
+
+        # バイナリ形式に切り替わった: 実際に配られたゲームのシャッフル有無は最初の通知ではなく，ゲーム開始フレームのものを使う
+        # （セッションオプションによって，接続時とは別のテーブルで配られる場合がある）
+        self.binary = True
+        return self.recv_shuffle_status()
+
+    def recv_init_cards(self):
+        if self.init_cards is None:
+            raise ConnectionError('initial cards have not been received')
+        cards = self.init_cards
+        self.init_cards = None
+        return cards
+
+    def recv_result(self, with_player_card=False, with_dealer_cards=False):
+        if self.binary:
+            return decode_result(self.expect_frame(FRAME_RESULT))
+        msg = self.sock.recv(1024).decode('utf-8')
+        return parse_result_message(msg, with_player_card=with_player_card, with_dealer_cards=with_dealer_cards)
+
+    # ディーラーに方策テーブルを渡して n_games 回のゲームを一括プレイしてもらう
+    # 結果はレコードのリスト単位で順次返される（ジェネレータ）．ゲームの決着後，または最初のゲームの行動前に呼び出すこと
+    #   - policy, n_games, max_retries: encode_batch_request を参照
+    def play_batch(self, policy, n_games: int, max_retries: int):
+        if not self.binary:
+            raise ConnectionError('batch play requires the binary protocol')
+        self.init_cards = None
+        self.sock.sendall(encode_batch_request(policy, n_games, max_retries))
+        while True:
+            frame_type, payload = self.recv_frame()
+            if frame_type == FRAME_BATCH_END:
+                return
+            if frame_type != FRAME_BATCH_RESULT:
+                raise ConnectionError('unexpected frame type {0} during batch play'.format(frame_type))
+            yield decode_batch_result(payload)
+
+    def close(self):
+        if self.binary:
+            try:
+                self.sock.sendall(encode_frame(FRAME_QUIT))
+            except OSError:
+                pass
+        self.sock.close()
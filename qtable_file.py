@@ -0,0 +1,130 @@
+import os
+import json
+import pickle
+import struct
+import numpy as np
+from classes import Action, DenseQTable, QStateEncoder
+
+
+# Qテーブルのバイナリファイル（DenseQTable の配列をそのまま格納し，numpy.memmap で読み込める形式）
+#
+# ファイル: [マジック 'BJQ'(3バイト)] [バージョン(1バイト)] [ヘッダ長(4バイト，ビッグエンディアン)] [ヘッダ] [パディング] [Q値] [設定済みフラグ]
+#   ヘッダ: 以下のキーを持つ JSON（UTF-8）
+#     - meta: ai_player_Q.py が保存するメタ情報（学習率など．無い場合は空）
+#     - encoder: 状態の変換方法（{'shape': [スコア数, 手札枚数の数, RETRYバケット数]}．QStateEncoder を参照）
+#     - actions: 行動名（Action の名前）の並び（配列の最後の軸の順番）
+#     - default_value: 値をセットしていない (状態, 行動) の値
+#   Q値: 形状 (スコア数, 手札枚数の数, RETRYバケット数, 行動数) の float64（リトルエンディアン，C 順）
+#   設定済みフラグ: Q値と同じ形状の uint8（1: 値をセット済み．辞書形式に戻す際にこの (状態, 行動) だけを含める）
+# Q値の開始位置は DATA_ALIGN バイトの倍数に揃える
+
+QTABLE_MAGIC = b'BJQ'
+QTABLE_VERSION = 1
+QTABLE_SUFFIX = '.qtable'
+FILE_HEADER = struct.Struct('!3sBI')
+DATA_ALIGN = 64
+VALUE_DTYPE = np.dtype('<f8')
+
+
+# ファイルがQテーブルのバイナリファイルか否かを判定（先頭のマジックで判定する）
+def is_qtable_file(path: str):
+    with open(path, 'rb') as f:
+        return f.read(len(QTABLE_MAGIC)) == QTABLE_MAGIC
+
+
+# ヘッダを読み込む
+# 戻り値は (ヘッダの辞書, Q値の開始位置) のタプル
+def read_header(path: str):
+    with open(path, 'rb') as f:
+        head = f.read(FILE_HEADER.size)
+        if len(head) < FILE_HEADER.size:
+            raise ValueError('{0}: not a Q-table file'.format(path))
+        magic, version, header_len = FILE_HEADER.unpack(head)
+        if magic != QTABLE_MAGIC:
+            raise ValueError('{0}: not a Q-table file'.format(path))
+        if version != QTABLE_VERSION:
+            raise ValueError('{0}: unsupported Q-table file version {1}'.format(path, version))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    return header, data_offset(header_len)
+
+
+# Q値の開始位置
+def data_offset(header_len: int):
+    end = FILE_HEADER.size + header_len
+    return (end + DATA_ALIGN - 1) // DATA_ALIGN * DATA_ALIGN
+
+
+# Qテーブルをファイルに書き込む（一時ファイルに書いてから置き換えるため，読み込み中の他のプロセスが書きかけの内容を見ることはない）
+#   - q_table: 書き込む DenseQTable（encoder の範囲外の状態の値を持つ場合は，全ての状態を表せる大きさに広げて書き込む）
+#   - meta: ヘッダに含めるメタ情報（JSON に変換できる値の辞書）
+def write_qtable(path: str, q_table: DenseQTable, meta=None):
+    if q_table.overflow.table:
+        table = q_table.to_dict()
+        q_table = DenseQTable.from_dict(table, q_table.ActionClass, default_value=q_table.default_value, encoder=fit_encoder(table, q_table.encoder.shape))
+    header = json.dumps({
+        'meta': meta if meta is not None else {},
+        'encoder': {'shape': list(q_table.encoder.shape)},
+        'actions': [a.name for a in q_table.actions],
+        'default_value': q_table.default_value,
+    }).encode('utf-8')
+    offset = data_offset(len(header))
+    tmp = '{0}.tmp{1}'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(FILE_HEADER.pack(QTABLE_MAGIC, QTABLE_VERSION, len(header)))
+        f.write(header)
+        f.write(b'\0' * (offset - FILE_HEADER.size - len(header)))
+        f.write(np.ascontiguousarray(q_table.values, dtype=VALUE_DTYPE).tobytes())
+        f.write(q_table.known.astype(np.uint8).tobytes())
+    os.replace(tmp, path)
+
+
+# ファイルを numpy.memmap で開き，その配列をそのまま使う DenseQTable を作成（ファイル全体は読み込まない）
+# 戻り値は (DenseQTable, メタ情報) のタプル
+#   - writable: True の場合はQ値の変更がファイルに反映される（False の場合，Q値を変更しようとするとエラーになる）
+def open_qtable(path: str, writable=False, action_class=Action):
+    header, offset = read_header(path)
+    q_table = DenseQTable(action_class, default_value=header['default_value'], encoder=QStateEncoder(*header['encoder']['shape']))
+    names = [a.name for a in q_table.actions]
+    if header['actions'] != names:
+        raise ValueError('{0}: actions {1} do not match {2}'.format(path, header['actions'], names))
+    shape = q_table.values.shape
+    mode = 'r+' if writable else 'r'
+    values = np.memmap(path, dtype=VALUE_DTYPE, mode=mode, offset=offset, shape=shape)
+    known = np.memmap(path, dtype=np.uint8, mode=mode, offset=offset + values.nbytes, shape=shape).view(bool)
+    q_table.attach(values, known)
+    return q_table, header['meta']
+
+
+# ファイルからQテーブルを読み込む（メモリ上にコピーするため，読み込み後はファイルと無関係に変更できる）
+# 戻り値は (DenseQTable, メタ情報) のタプル
+def load_qtable(path: str, action_class=Action):
+    q_table, meta = open_qtable(path, action_class=action_class)
+    q_table.attach(np.array(q_table.values, dtype=np.float64), np.array(q_table.known).reshape(q_table.values.shape))
+    return q_table, meta
+
+
+# 辞書形式のQテーブルの全ての状態を表せる QStateEncoder を作成（min_shape（省略時は既定の大きさ）より小さくはしない）
+def fit_encoder(table, min_shape=None):
+    shape = list(min_shape if min_shape is not None else QStateEncoder().shape)
+    for state, _ in table:
+        for i, v in enumerate(state[:3]):
+            shape[i] = max(shape[i], int(v) + 1)
+    return QStateEncoder(*shape)
+
+
+# 辞書形式のQテーブルを DenseQTable に変換（全ての状態を丸めずに表せる大きさにする）
+def dense_from_dict(table, action_class=Action, default_value=0):
+    return DenseQTable.from_dict(table, action_class, default_value=default_value, encoder=fit_encoder(table))
+
+
+# バイナリファイル，メタ情報付きの pickle（{'meta': ..., 'table': ...}），辞書のみの pickle のいずれかを読み込む
+# 戻り値は (辞書形式のQテーブル, メタ情報) のタプル
+def load_table_dict(path: str):
+    if is_qtable_file(path):
+        q_table, meta = open_qtable(path)
+        return q_table.to_dict(), meta
+    with open(path, 'rb') as f:
+        loaded = pickle.load(f)
+    if isinstance(loaded, dict) and 'table' in loaded:
+        return loaded['table'], loaded.get('meta', {})
+    return loaded, {}
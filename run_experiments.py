@@ -3,8 +3,13 @@
 
 Creates logs/<run_name>.txt and a summary CSV results.csv with basic metrics.
 
+With --vectorized the whole grid is trained in this process by grid_trainer.GridTrainer
+(one Q-table array for all grid points, games played on batch_sim.BatchTables) instead of
+one ai_player_Q.py subprocess per grid point; no per-run logs are written in that mode.
+
 Usage:
     python run_experiments.py --quick --script ai_player_Q.py
+    python run_experiments.py --vectorized --games 20000 --seeds 0,1,2 --common-random
 """
 import argparse
 import itertools
@@ -15,6 +20,7 @@ import time
 import csv
 import re
 import concurrent.futures
+import pickle
 
 
 def make_run_name(params):
@@ -140,6 +146,40 @@ def run_one(py_exec, script_path, params, out_dir, games, timeout=None, qtables_
     }
 
 
+def run_grid(all_params, games, qtables_dir=None, common_random=False):
+    # Train every grid point in one process; returns result rows with the same fields as run_one.
+    from grid_trainer import GridTrainer
+
+    print(f"Training {len(all_params)} grid points x {games} games in one process")
+    start = time.time()
+    trainer = GridTrainer(all_params, common_random=common_random)
+    trainer.train(games)
+    print(f"Finished in {time.time() - start:.1f}s")
+
+    results = []
+    for k, (params, res) in enumerate(zip(all_params, trainer.results())):
+        run_name = make_run_name(params)
+        if qtables_dir is not None:
+            meta = {key: params[key] for key in ('alpha', 'gamma', 'eps_start', 'eps_end', 'eps_decay_episodes', 'eps_decay_type')}
+            meta['games'] = games
+            with open(os.path.join(qtables_dir, run_name + '.pkl'), 'wb') as f:
+                pickle.dump({'meta': meta, 'table': trainer.q_table(k).to_dict()}, f)
+        results.append({
+            'run_name': run_name,
+            'alpha': params['alpha'],
+            'gamma': params['gamma'],
+            'eps_start': params['eps_start'],
+            'eps_end': params['eps_end'],
+            'eps_decay_type': params['eps_decay_type'],
+            'seed': params.get('seed', ''),
+            'episodes': res['episodes'],
+            'avg_reward': res['avg_reward'],
+            'mov_avg_100': res['mov_avg_100'],
+            'logfile': '',
+        })
+    return results
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--quick', action='store_true', help='Run a quick small grid for smoke test')
@@ -153,6 +193,8 @@ def main():
     parser.add_argument('--alphas', type=str, default=None, help='Optional comma-separated alpha values to override default grid, e.g. "0.1,0.2,0.3"')
     parser.add_argument('--stagger-ms', type=int, default=0, help='Milliseconds to wait between submitting each job to avoid startup bursts')
     parser.add_argument('--timeout', type=int, default=0, help='Timeout in seconds for each run subprocess; 0 means no timeout')
+    parser.add_argument('--vectorized', action='store_true', help='train the whole grid in this process with grid_trainer.GridTrainer instead of one subprocess per run')
+    parser.add_argument('--common-random', action='store_true', help='with --vectorized, grid points with the same seed share the card stream and exploration random numbers')
 
     py_exec = sys.executable
     parser.add_argument('--script', default='CartPole_v1.py', help='script to run for experiments (file name in same dir)')
@@ -219,6 +261,17 @@ def main():
         qtables_dir = os.path.join(args.out_dir, 'qtables')
         os.makedirs(qtables_dir, exist_ok=True)
 
+    if args.vectorized:
+        results = run_grid(all_params, games, qtables_dir, common_random=args.common_random)
+        with open(args.results, 'a', newline='', encoding='utf-8') as csvf:
+            writer = csv.DictWriter(csvf, fieldnames=fieldnames)
+            if write_header:
+                writer.writeheader()
+            for res in results:
+                writer.writerow({k: res.get(k) for k in fieldnames})
+        print('All runs finished. Summary written to', args.results)
+        return
+
     # determine timeout to pass to run_one (None means no timeout)
     timeout_arg = None if args.timeout == 0 else int(args.timeout)
 
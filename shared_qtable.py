@@ -0,0 +1,210 @@
+import json
+import os
+import struct
+import sys
+import threading
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+from classes import Action, DenseQTable, QStateEncoder
+
+
+# 共有メモリ上のQテーブル（複数のプロセスが同じ DenseQTable の配列をコピーせずに参照する）
+#
+# 名前 name に対して，以下の共有メモリを作成する
+#   - name: 制御ブロック [公開中の世代番号(8バイト)] [ヘッダ長(4バイト)] [ヘッダ]（いずれもビッグエンディアン）
+#       ヘッダは qtable_file.py と同じキー（meta, encoder, actions, default_value）を持つ JSON（UTF-8）
+#   - name.<世代番号>: その世代の [Q値(float64)] [設定済みフラグ(uint8)]（形状は qtable_file.py と同じ）
+# 新しい世代は，別の共有メモリに全ての値を書き込んでから制御ブロックの世代番号を書き換えることで公開する
+# このため，参照側が書きかけの値を見ることはない（参照側は refresh を呼んだ時点で新しい世代に切り替わる）
+# 公開側は直前の世代までを残し，それより古い世代を削除する
+
+CONTROL = struct.Struct('!QI')
+VALUE_DTYPE = np.dtype('<f8')
+
+
+# 世代 generation の値を格納する共有メモリの名前
+def segment_name(name: str, generation: int):
+    return '{0}.{1}'.format(name, generation)
+
+
+# resource_tracker への登録と解除を同じプロセスの他のスレッドと交互に行わないためのロック
+tracker_lock = threading.Lock()
+
+# このプロセスが作成し，まだ削除していない共有メモリの名前
+created_segments = set()
+
+
+# 共有メモリを作成
+def create_segment(name: str, size: int):
+    with tracker_lock:
+        segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        created_segments.add(name)
+    return segment
+
+
+# 作成した共有メモリを閉じて削除
+def unlink_segment(segment):
+    segment.close()
+    with tracker_lock:
+        segment.unlink()
+        created_segments.discard(segment.name)
+
+
+# 既存の共有メモリに接続
+# 接続したプロセスの終了時に共有メモリが削除されないよう，resource_tracker には登録しない（削除は作成したプロセスが行う）
+# Python 3.13 以降は track=False を指定し，それより前は接続直後にこの共有メモリの登録だけを解除する
+# （同じプロセスで作成した共有メモリは作成時の登録を残す）
+def open_segment(name: str):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    with tracker_lock:
+        segment = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix' and name not in created_segments:
+            resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+
+class SharedQTable:
+
+    # コンストラクタ（直接は使わず，create か attach を使う）
+    def __init__(self, name: str, control, owner: bool, readonly: bool, action_class=Action, rng=None):
+        self.name = name
+        self.control = control
+        self.owner = owner
+        self.readonly = readonly
+        self.ActionClass = action_class
+        self.rng = rng
+        header_len = CONTROL.unpack_from(control.buf, 0)[1]
+        header = json.loads(bytes(control.buf[CONTROL.size:CONTROL.size + header_len]).decode('utf-8'))
+        self.meta = header['meta']
+        self.encoder = QStateEncoder(*header['encoder']['shape'])
+        self.default_value = header['default_value']
+        self.shape = self.encoder.shape + (len(header['actions']),)
+        names = [a.name for a in action_class if a != action_class.UNDEFINED]
+        if header['actions'] != names:
+            raise ValueError('{0}: actions {1} do not match {2}'.format(name, header['actions'], names))
+        self.generation = 0 # 参照中（公開側は最後に公開した）世代
+        self.segment = None # 参照中の世代の共有メモリ
+        self.retired = [] # 切り替え前の世代の共有メモリ（配列が参照されている間は閉じられないため，ここで保持する）
+        self.published = {} # 公開側: 世代番号 -> 共有メモリ
+        self.q_table = None # 参照中の世代の値をそのまま使う DenseQTable
+
+    # 共有メモリを作成し，q_table の値を最初の世代として公開する
+    #   - name: 共有メモリの名前（他のプロセスはこの名前で attach する）
+    #   - q_table: 公開する DenseQTable（以降の publish でも同じ形状のものを渡す）
+    #   - meta: ヘッダに含めるメタ情報（JSON に変換できる値の辞書）
+    @staticmethod
+    def create(name: str, q_table: DenseQTable, meta=None):
+        header = json.dumps({
+            'meta': meta if meta is not None else {},
+            'encoder': {'shape': list(q_table.encoder.shape)},
+            'actions': [a.name for a in q_table.actions],
+            'default_value': q_table.default_value,
+        }).encode('utf-8')
+        control = create_segment(name, CONTROL.size + len(header))
+        CONTROL.pack_into(control.buf, 0, 0, len(header))
+        control.buf[CONTROL.size:CONTROL.size + len(header)] = header
+        shared = SharedQTable(name, control, owner=True, readonly=False, action_class=q_table.ActionClass)
+        shared.publish(q_table)
+        return shared
+
+    # 名前 name で公開されているQテーブルに接続し，公開中の世代を参照する
+    #   - readonly: True の場合，q_table の値を変更しようとするとエラーになる（False の場合は変更が他のプロセスにも見える）
+    #   - rng: q_table が同じQ値を持つ行動からの選択に使う乱数生成器（DenseQTable を参照）
+    @staticmethod
+    def attach(name: str, readonly=True, action_class=Action, rng=None):
+        shared = SharedQTable(name, open_segment(name), owner=False, readonly=readonly, action_class=action_class, rng=rng)
+        shared.refresh()
+        return shared
+
+    # 公開中の世代番号
+    def latest_generation(self):
+        return CONTROL.unpack_from(self.control.buf, 0)[0]
+
+    # q_table の値を新しい世代として公開（create したプロセスのみ）
+    # 共有するのは配列の値だけで，encoder の範囲外の状態の値（q_table.overflow）は共有しない
+    def publish(self, q_table: DenseQTable):
+        if not self.owner:
+            raise RuntimeError('{0}: only the creating process can publish'.format(self.name))
+        if q_table.values.shape != self.shape:
+            raise ValueError('array shape {0} does not match {1}'.format(q_table.values.shape, self.shape))
+        generation = self.generation + 1
+        values_size = q_table.values.size * VALUE_DTYPE.itemsize
+        segment = create_segment(segment_name(self.name, generation), values_size + q_table.values.size)
+        np.ndarray(self.shape, dtype=VALUE_DTYPE, buffer=segment.buf)[...] = q_table.values
+        np.ndarray(self.shape, dtype=np.uint8, buffer=segment.buf, offset=values_size)[...] = q_table.known.reshape(self.shape)
+        CONTROL.pack_into(self.control.buf, 0, generation, CONTROL.unpack_from(self.control.buf, 0)[1])
+        self.published[generation] = segment
+        self.generation = generation
+        # 接続途中のプロセスのために直前の世代は残す
+        old = self.published.pop(generation - 2, None)
+        if old is not None:
+            unlink_segment(old)
+
+    # 新しい世代が公開されていれば，q_table をその世代の値に切り替える
+    # 戻り値は切り替えたか否か（切り替えた場合，以前の q_table は使わないこと）
+    # 切り替え前の世代は，以前の q_table が手放された後の refresh（または close）で閉じる
+    def refresh(self):
+        if self.owner:
+            return False
+        if self.retired:
+            self.release_retired()
+        while True:
+            generation = self.latest_generation()
+            if self.q_table is not None and generation == self.generation:
+                return False
+            try:
+                segment = open_segment(segment_name(self.name, generation))
+                break
+            except FileNotFoundError:
+                continue # 接続する前に削除された（さらに新しい世代が公開されている）
+        # np.frombuffer の配列は共有メモリのバッファを参照し続けるため，配列が残っている間は close が BufferError になる
+        # （np.ndarray(buffer=...) の配列はバッファを参照しないため，close 後に使うとメモリ違反になる）
+        n_values = int(np.prod(self.shape))
+        values = np.frombuffer(segment.buf, dtype=VALUE_DTYPE, count=n_values).reshape(self.shape)
+        known = np.frombuffer(segment.buf, dtype=np.uint8, count=n_values, offset=n_values * VALUE_DTYPE.itemsize).view(bool).reshape(self.shape)
+        if self.readonly:
+            values.flags.writeable = False
+            known.flags.writeable = False
+        q_table = DenseQTable(self.ActionClass, default_value=self.default_value, encoder=self.encoder, rng=self.rng)
+        q_table.attach(values, known)
+        self.q_table = q_table
+        if self.segment is not None:
+            self.retired.append(self.segment)
+        self.segment = segment
+        self.generation = generation
+        self.release_retired()
+        return True
+
+    # 切り替え前の世代の共有メモリのうち，配列が参照されなくなったものを閉じる
+    def release_retired(self):
+        still_used = []
+        for segment in self.retired:
+            try:
+                segment.close()
+            except BufferError:
+                still_used.append(segment)
+        self.retired = still_used
+
+    # 共有メモリとの接続を閉じる（公開側は unlink=True で共有メモリを削除する）
+    # q_table の配列は使えなくなるため，閉じる前に参照を手放しておくこと
+    def close(self, unlink=None):
+        if unlink is None:
+            unlink = self.owner
+        self.q_table = None
+        if self.segment is not None:
+            self.retired.append(self.segment)
+            self.segment = None
+        self.release_retired()
+        for segment in list(self.published.values()) + [self.control]:
+            if unlink:
+                unlink_segment(segment)
+            else:
+                segment.close()
+        self.published = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
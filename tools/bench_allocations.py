@@ -0,0 +1,156 @@
+"""Allocation benchmark: memory allocated per game on the dealer / player hot path.
+
+Plays whole games in-process (initialize_game, HIT below 17 then STAND) while a Player
+mirrors the cards the way the player scripts do and reads its state before every action
+through get_current_hands (score and length). Two configurations are compared on the same
+seeded shoe:
+  - legacy:  list-backed hands that allocate a new list on every clear, and
+             copy.deepcopy of both hands on every state read (the previous get_current_hands)
+  - current: slotted Hand with a preallocated card buffer and read-only HandView
+tracemalloc counts bytes, not allocation calls, so for each game the benchmark reports the
+high-water mark of memory allocated during the game (reset_peak before every game) and the
+number of blocks still allocated after it; it also reports the time per game with tracing off.
+
+Usage:
+    python tools/bench_allocations.py --games 20000
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from classes import Action, Hand, Player, CARD_VALUES, CARD_IS_ACE
+from config import BET, INITIAL_MONEY
+from dealer import create_dealer
+
+
+class LegacyHand:
+    """Hand as it was before the preallocated buffer: a plain list re-created by clear()."""
+
+    def __init__(self):
+        self.clear()
+
+    def __getitem__(self, i):
+        return self.cards[i]
+
+    def __len__(self):
+        return len(self.cards)
+
+    def length(self):
+        return len(self.cards)
+
+    def append(self, c):
+        self.cards.append(c)
+        self.hard_total += CARD_VALUES[c]
+        if CARD_IS_ACE[c]:
+            self.n_aces += 1
+
+    def pop(self):
+        c = self.cards.pop()
+        self.hard_total -= CARD_VALUES[c]
+        if CARD_IS_ACE[c]:
+            self.n_aces -= 1
+
+    def clear(self):
+        self.cards = []
+        self.hard_total = 0
+        self.n_aces = 0
+
+    def get_score(self):
+        if self.n_aces > 0 and self.hard_total <= 11:
+            return self.hard_total + 10
+        return self.hard_total
+
+    def is_nbj(self):
+        return len(self.cards) == 2 and self.get_score() == 21
+
+    def is_busted(self):
+        return self.hard_total > 21
+
+
+def legacy_hands(player):
+    return copy.deepcopy(player.player_hand), copy.deepcopy(player.dealer_hand)
+
+
+def current_hands(player):
+    return player.player_hand.view(), player.dealer_hand.view()
+
+
+def make_game(hand_class, get_current_hands, seed: int):
+    """Return a function that plays one game and its result."""
+    dealer = create_dealer(seed=seed)
+    dealer.dealer_hand = hand_class()
+    dealer.player_hand = hand_class()
+    player = Player(initial_money=INITIAL_MONEY, basic_bet=BET)
+    player.player_hand = hand_class()
+    player.dealer_hand = hand_class()
+
+    def play():
+        dealer.initialize_game()
+        # プレイヤー側の receive_init_cards と同じ手札の更新
+        player.dealer_hand.clear()
+        player.player_hand.clear()
+        player.dealer_hand.append(dealer.dealer_hand[0])
+        player.player_hand.append(dealer.player_hand[0])
+        player.player_hand.append(dealer.player_hand[1])
+        while True:
+            # プレイヤー側の get_state と同じ読み出し
+            p_hand, _ = get_current_hands(player)
+            score = p_hand.get_score()
+            p_hand.length()
+            status, rate, _, _ = dealer.apply_action(Action.HIT if score < 17 else Action.STAND)
+            if status != 'unsettled':
+                return status, rate
+            player.player_hand.append(dealer.player_hand[-1])
+
+    return play
+
+
+def measure(hand_class, get_current_hands, n_games: int, seed: int):
+    """Return (peak bytes per game, blocks left per game, us per game, results)."""
+    play = make_game(hand_class, get_current_hands, seed)
+    start = time.perf_counter()
+    results = [play() for _ in range(n_games)]
+    us = (time.perf_counter() - start) / n_games * 1e6
+
+    play = make_game(hand_class, get_current_hands, seed)
+    play()  # 最初のゲームで生成されるキャッシュ等を除く
+    tracemalloc.start()
+    base_blocks = len(tracemalloc.take_snapshot().traces)
+    peak_total = 0
+    for _ in range(n_games):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        play()
+        peak_total += tracemalloc.get_traced_memory()[1] - current
+    blocks = len(tracemalloc.take_snapshot().traces) - base_blocks
+    tracemalloc.stop()
+    return peak_total / n_games, blocks / n_games, us, results
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Measure memory allocated per game before and after the allocation-free hand objects')
+    ap.add_argument('--games', type=int, default=20000)
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    legacy = measure(LegacyHand, legacy_hands, args.games, args.seed)
+    current = measure(Hand, current_hands, args.games, args.seed)
+    if legacy[3] != current[3]:
+        print('ERROR: results differ between the two configurations')
+        sys.exit(1)
+    print('config,peak_bytes_per_game,blocks_left_per_game,us_per_game')
+    for name, r in (('legacy', legacy), ('current', current)):
+        print('{0},{1:.0f},{2:.3f},{3:.2f}'.format(name, r[0], r[1], r[2]))
+    print('games={0} peak bytes/game {1:.0f} -> {2:.0f} ({3:.1f}% less), {4:.2f}us -> {5:.2f}us per game'.format(
+        args.games, legacy[0], current[0], 100 * (legacy[0] - current[0]) / max(legacy[0], 1e-9), legacy[2], current[2]))
+
+
+if __name__ == '__main__':
+    main()
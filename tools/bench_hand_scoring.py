@@ -0,0 +1,137 @@
+"""Micro-benchmark: incremental Hand scoring vs the previous re-scanning implementation.
+
+LegacyHand reproduces the old Hand.get_score (rebuild a list and scan every card on each
+call, with is_busted / is_nbj going through it). The benchmark measures
+  1. a single get_score / is_busted call on hands of 2..6 cards, and
+  2. whole games on the dealer hot path (initialize_game, HIT below 17 then STAND, judge)
+     together with the player-side get_state reads (score and length before every action),
+with both Hand classes on the same seeded shoe, and checks that both produce the same results.
+
+Usage:
+    python tools/bench_hand_scoring.py --games 50000
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from classes import Action, Hand
+from dealer import create_dealer
+
+
+class LegacyHand:
+    """Hand with the previous O(n) scoring: every call re-scans all cards."""
+
+    def __init__(self):
+        self.cards = []
+
+    def __getitem__(self, i):
+        return self.cards[i]
+
+    def __len__(self):
+        return len(self.cards)
+
+    def length(self):
+        return len(self.cards)
+
+    def append(self, c):
+        self.cards.append(c)
+
+    def pop(self):
+        self.cards.pop()
+
+    def clear(self):
+        self.cards = []
+
+    def get_score(self):
+        tmp = []
+        have_ace = False
+        for i in self.cards:
+            j = min(10, (i % 13) + 1)
+            if j != 1:
+                tmp.append(j)
+            else:
+                if have_ace:
+                    tmp.append(1)
+                else:
+                    have_ace = True
+        score = sum(tmp)
+        if have_ace:
+            if score + 11 > 21:
+                score += 1
+            else:
+                score += 11
+        return score
+
+    def is_nbj(self):
+        return self.get_score() == 21 and len(self.cards) == 2
+
+    def is_busted(self):
+        return self.get_score() > 21
+
+
+def bench_calls(hand_class, n_calls: int):
+    """Return ns per get_score + is_busted call for each hand size."""
+    out = {}
+    for size in range(2, 7):
+        hand = hand_class()
+        for c in range(size):
+            hand.append(c * 7 % 52)
+        start = time.perf_counter()
+        for _ in range(n_calls):
+            hand.get_score()
+            hand.is_busted()
+        out[size] = (time.perf_counter() - start) / n_calls * 1e9
+    return out
+
+
+def bench_games(hand_class, n_games: int, seed: int):
+    """Play n_games on one dealer; return (seconds, per-game results)."""
+    dealer = create_dealer(seed=seed)
+    dealer.dealer_hand = hand_class()
+    dealer.player_hand = hand_class()
+    results = []
+    start = time.perf_counter()
+    for _ in range(n_games):
+        dealer.initialize_game()
+        while True:
+            # プレイヤー側の get_state と同じ読み出し
+            score = dealer.player_hand.get_score()
+            dealer.player_hand.length()
+            status, rate, _, _ = dealer.apply_action(Action.HIT if score < 17 else Action.STAND)
+            if status != 'unsettled':
+                break
+        results.append((status, rate))
+    return time.perf_counter() - start, results
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark incremental Hand scoring against the previous implementation')
+    ap.add_argument('--games', type=int, default=50000)
+    ap.add_argument('--calls', type=int, default=200000, help='get_score calls per hand size')
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    legacy = bench_calls(LegacyHand, args.calls)
+    current = bench_calls(Hand, args.calls)
+    print('cards,legacy_ns_per_call,incremental_ns_per_call')
+    for size in legacy:
+        print('{0},{1:.0f},{2:.0f}'.format(size, legacy[size], current[size]))
+
+    t_legacy, r_legacy = bench_games(LegacyHand, args.games, args.seed)
+    t_current, r_current = bench_games(Hand, args.games, args.seed)
+    if r_legacy != r_current:
+        print('ERROR: results differ between the two Hand implementations')
+        sys.exit(1)
+    us_legacy = t_legacy / args.games * 1e6
+    us_current = t_current / args.games * 1e6
+    print('games={0} legacy={1:.2f}us/game incremental={2:.2f}us/game saving={3:.2f}us/game ({4:.1f}%)'.format(
+        args.games, us_legacy, us_current, us_legacy - us_current, 100 * (us_legacy - us_current) / us_legacy))
+
+
+if __name__ == '__main__':
+    main()
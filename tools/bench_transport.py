@@ -0,0 +1,142 @@
+"""Benchmark: compare TCP and Unix domain socket transports to the dealer.
+
+Starts dealer.py (async mode, listening on both TCP and a Unix domain socket) as a
+subprocess unless --no_spawn is given, then plays the same number of games over each
+transport with a fixed strategy (HIT below 17, otherwise STAND) on one session.
+Reports games/sec and per-action round-trip latency for each transport.
+
+Usage:
+    python tools/bench_transport.py --games 2000 --protocol binary
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from statistics import median
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from classes import Player, open_dealer_socket
+from config import PORT, BET, INITIAL_MONEY
+from protocol import BinaryChannel
+
+
+def wait_for_dealer(uds_path: str, timeout: float = 10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            s = open_dealer_socket('127.0.0.1', PORT, timeout=0.5)
+            s.close()
+            if os.path.exists(uds_path):
+                return True
+        except OSError:
+            pass
+        time.sleep(0.1)
+    return False
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[idx]
+
+
+def play_session(sock, games: int, protocol: str):
+    """Play `games` games on one connection; return (elapsed_sec, per-action latencies)."""
+    dsoc = BinaryChannel(sock) if protocol == 'binary' else sock
+    player = Player(initial_money=INITIAL_MONEY, basic_bet=BET)
+    latencies = []
+    start = time.perf_counter()
+    for n in range(games):
+        if n > 0:
+            player.request_next_game(dsoc)
+        player.set_bet()
+        player.receive_card_shuffle_status(dsoc)
+        player.receive_init_cards(dsoc)
+        while True:
+            t0 = time.perf_counter()
+            if player.get_score() < 17:
+                player.send_message(dsoc, 'hit')
+                pc, score, status, rate, dc = player.receive_message(dsoc, get_player_card=True, get_dealer_cards=True)
+            else:
+                player.send_message(dsoc, 'stand')
+                score, status, rate, dc = player.receive_message(dsoc, get_dealer_cards=True)
+            latencies.append(time.perf_counter() - t0)
+            if status != 'unsettled':
+                player.update_money(rate)
+                break
+    elapsed = time.perf_counter() - start
+    if isinstance(dsoc, BinaryChannel):
+        dsoc.close()
+    else:
+        sock.close()
+    return elapsed, latencies
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Compare TCP and Unix domain socket transports to the dealer')
+    ap.add_argument('--games', type=int, default=2000, help='games per transport')
+    ap.add_argument('--repeats', type=int, default=3, help='sessions per transport (best is reported)')
+    ap.add_argument('--protocol', choices=['text', 'binary'], default='binary')
+    ap.add_argument('--uds', type=str, default='', help='dealer Unix domain socket path (default: a temp path)')
+    ap.add_argument('--no_spawn', action='store_true', help='use an already running dealer instead of starting one')
+    args = ap.parse_args()
+
+    if not hasattr(socket, 'AF_UNIX'):
+        print('Unix domain sockets are not available on this platform.')
+        sys.exit(2)
+
+    uds_path = args.uds or os.path.join(tempfile.gettempdir(), f'bj_dealer_bench_{os.getpid()}.sock')
+    proc = None
+    if not args.no_spawn:
+        proc = subprocess.Popen([sys.executable, str(ROOT / 'dealer.py'), '--mode', 'async', '--uds', uds_path],
+                                cwd=str(ROOT), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_dealer(uds_path):
+            print('Dealer is not reachable on both TCP and', uds_path)
+            sys.exit(1)
+
+        results = {}
+        for transport in ['tcp', 'uds']:
+            best = None
+            for r in range(args.repeats):
+                if transport == 'tcp':
+                    sock = open_dealer_socket('127.0.0.1', PORT)
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                else:
+                    sock = open_dealer_socket('', PORT, uds_path=uds_path)
+                elapsed, lat = play_session(sock, args.games, args.protocol)
+                if best is None or elapsed < best[0]:
+                    best = (elapsed, lat)
+            elapsed, lat = best
+            results[transport] = {
+                'games_per_sec': args.games / elapsed,
+                'p50_us': median(lat) * 1e6,
+                'p99_us': percentile(lat, 0.99) * 1e6,
+            }
+
+        print(f'games={args.games} protocol={args.protocol} (best of {args.repeats})')
+        print('transport,games_per_sec,action_p50_us,action_p99_us')
+        for transport, r in results.items():
+            print(f"{transport},{r['games_per_sec']:.1f},{r['p50_us']:.1f},{r['p99_us']:.1f}")
+        speedup = results['uds']['games_per_sec'] / results['tcp']['games_per_sec']
+        print(f'UDS / TCP throughput: {speedup:.2f}x')
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+if __name__ == '__main__':
+    main()
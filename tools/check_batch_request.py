@@ -0,0 +1,84 @@
+"""Boundary check for protocol.encode_batch_request / decode_batch_request.
+
+The batch request header packs the game count into 4 bytes and the RETRY cap and the
+policy table shape into 1 byte each, and the whole request must fit in one frame (2-byte
+length). Values at the edges of these fields must round-trip unchanged. Values just outside them must be rejected by encode_batch_request with a
+ValueError (not a struct.error from deep inside the packing code).
+
+Usage:
+    python tools/check_batch_request.py
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from protocol import BATCH_MAX_RETRIES, FRAME_BATCH, FRAME_HEADER, decode_batch_request, encode_batch_request
+
+POLICY = np.zeros((32, 12, 6), dtype=np.uint8)
+
+
+def round_trip(policy, n_games, max_retries):
+    frame = encode_batch_request(policy, n_games, max_retries)
+    length, frame_type = FRAME_HEADER.unpack_from(frame, 0)
+    if frame_type != FRAME_BATCH or length != len(frame) - FRAME_HEADER.size + 1:
+        raise ValueError('bad frame header ({0}, {1})'.format(length, frame_type))
+    return decode_batch_request(frame[FRAME_HEADER.size:])
+
+
+def check_accepted():
+    """Boundary values must round-trip. Return failures."""
+    failures = 0
+    cases = [(POLICY, 0, 0), (POLICY, 1, BATCH_MAX_RETRIES), (POLICY, 0xFFFFFFFF, 10),
+             (np.zeros((1, 1, 1), dtype=np.uint8), 5, 3), (np.zeros((255, 2, 128), dtype=np.uint8), 5, 3)]
+    for policy, n_games, max_retries in cases:
+        try:
+            got = round_trip(policy, n_games, max_retries)
+        except Exception as e:
+            failures += 1
+            print('  n_games={0}, max_retries={1}, shape={2} raised {3!r}'.format(n_games, max_retries, policy.shape, e))
+            continue
+        if got[:3] != (n_games, max_retries, policy.shape) or got[3] != policy.tobytes():
+            failures += 1
+            print('  n_games={0}, max_retries={1}, shape={2} decoded as {3}'.format(n_games, max_retries, policy.shape, got[:3]))
+    return len(cases), failures
+
+
+def check_rejected():
+    """Out-of-range values must raise ValueError. Return failures."""
+    failures = 0
+    cases = [(POLICY, 10, BATCH_MAX_RETRIES + 1), (POLICY, 10, 1000), (POLICY, 10, -1),
+             (POLICY, 0x100000000, 10), (POLICY, -1, 10),
+             (np.zeros((256, 12, 6), dtype=np.uint8), 10, 10), (np.zeros((255, 2, 129), dtype=np.uint8), 10, 10)]
+    for policy, n_games, max_retries in cases:
+        try:
+            encode_batch_request(policy, n_games, max_retries)
+        except ValueError:
+            continue
+        except Exception as e:
+            print('  n_games={0}, max_retries={1}, shape={2} raised {3!r} instead of ValueError'.format(n_games, max_retries, policy.shape, e))
+        else:
+            print('  n_games={0}, max_retries={1}, shape={2} was accepted'.format(n_games, max_retries, policy.shape))
+        failures += 1
+    return len(cases), failures
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Check the value ranges of the batch request header')
+    ap.parse_args()
+
+    n_accepted, f_accepted = check_accepted()
+    print('accepted: {0} boundary cases, {1} failures'.format(n_accepted, f_accepted))
+    n_rejected, f_rejected = check_rejected()
+    print('rejected: {0} out-of-range cases, {1} failures'.format(n_rejected, f_rejected))
+    if f_accepted or f_rejected:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
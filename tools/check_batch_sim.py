@@ -0,0 +1,192 @@
+"""Conformance check and throughput benchmark for batch_sim.BatchTables.
+
+Conformance: M tables play G games each through BatchTables with random actions (RETRY
+capped per game, as the players do). Every shoe a table shuffles is recorded, and each
+table's games are then replayed through dealer.Dealer with the same shoes (fed in through
+a CardSet shoe factory) and the same actions. Shuffle timing, card positions, player and
+dealer totals, status and payout rate must all match. The same is done for
+BatchTables.play_policy against Dealer.play_policy_game with a deterministic policy table.
+
+Throughput: hands per second of BatchTables.play_policy on one core for the given number
+of tables, compared with Dealer.play_policy_game on the same policy.
+
+Usage:
+    python tools/check_batch_sim.py --tables 64 --games 2000
+    python tools/check_batch_sim.py --skip_check --bench_tables 100000 --bench_rounds 20
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from batch_sim import BatchTables, UNSETTLED
+from classes import Action, CardSet
+from config import N_DECKS
+from dealer import create_dealer
+from protocol import STATUS_CODES
+
+MAX_RETRIES = 10
+N_SCORES, N_LENGTHS, N_BUCKETS = 32, 12, 6
+
+
+class ReplayShoes:
+    """Shoe factory for CardSet that hands out recorded shoes in order."""
+
+    def __init__(self, shoes):
+        self.shoes = list(shoes)
+        self.i = 0
+
+    def next_shoe(self):
+        shoe = self.shoes[self.i]
+        self.i += 1
+        return shoe
+
+
+def replay_dealer(shoes):
+    dealer = create_dealer(seed=0)
+    # CardSet は作成時に1回シャッフルするため，最初の1つはダミー
+    dealer.card_set = CardSet(n_decks=N_DECKS, shoe_factory=ReplayShoes([np.arange(52 * N_DECKS)] + shoes))
+    return dealer
+
+
+def make_policy():
+    """A fixed policy without undefined states or RETRY, so both sides choose the same actions."""
+    policy = np.empty((N_SCORES, N_LENGTHS, N_BUCKETS), dtype=np.uint8)
+    for s in range(N_SCORES):
+        if s <= 8:
+            code = Action.DOUBLE_DOWN.value if s == 8 else Action.HIT.value
+        elif s <= 11:
+            code = Action.DOUBLE_DOWN.value
+        elif s <= 16:
+            code = Action.HIT.value if s < 15 else Action.SURRENDER.value
+        else:
+            code = Action.STAND.value
+        policy[s] = code
+    return policy
+
+
+def check_actions(n_tables: int, n_games: int, seed: int):
+    """Random actions; return (games checked, mismatches)."""
+    sim = BatchTables(n_tables, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    shoes = [[] for _ in range(n_tables)]
+    games = [[] for _ in range(n_tables)]
+    for _ in range(n_games):
+        shuffled = sim.deal()
+        for m in np.flatnonzero(shuffled):
+            shoes[m].append(sim.shoes[m].copy())
+        actions_log = [[] for _ in range(n_tables)]
+        while True:
+            active = np.flatnonzero(sim.unsettled())
+            if len(active) == 0:
+                break
+            actions = rng.integers(1, Action.RETRY.value + 1, size=n_tables)
+            capped = sim.retries >= MAX_RETRIES
+            actions[capped & (actions == Action.RETRY.value)] = Action.STAND.value
+            for m in active:
+                actions_log[m].append(int(actions[m]))
+            sim.step(actions)
+        for m in range(n_tables):
+            games[m].append((bool(shuffled[m]), actions_log[m], int(sim.pos[m]), int(sim.p_hard[m]), int(sim.d_hard[m]),
+                             int(sim.status[m]), float(sim.rates[m])))
+
+    n_checked, n_mismatches = 0, 0
+    for m in range(n_tables):
+        dealer = replay_dealer(shoes[m])
+        for shuffled, actions, pos, p_hard, d_hard, status, rate in games[m]:
+            d_shuffled = dealer.initialize_game()
+            d_status, d_rate = 'unsettled', 0.0
+            for a in actions:
+                d_status, d_rate, _, _ = dealer.resolve_action(Action(a))
+            got = (d_shuffled, dealer.card_set.pos, dealer.player_hand.hard_total, dealer.dealer_hand.hard_total, STATUS_CODES[d_status], d_rate)
+            if got != (shuffled, pos, p_hard, d_hard, status, rate):
+                n_mismatches += 1
+                if n_mismatches <= 5:
+                    print('  mismatch on table {0}: actions={1} batch={2} dealer={3}'.format(m, actions, (shuffled, pos, p_hard, d_hard, status, rate), got))
+            n_checked += 1
+    return n_checked, n_mismatches
+
+
+def check_policy(n_tables: int, n_games: int, seed: int):
+    """play_policy against Dealer.play_policy_game; return (games checked, mismatches)."""
+    policy = make_policy()
+    sim = BatchTables(n_tables, seed=seed)
+    shoes = [[] for _ in range(n_tables)]
+    records = [[] for _ in range(n_tables)]
+    for _ in range(n_games):
+        shuffled = sim.game_ids % sim.shuffle_interval == 0
+        shuffled |= sim.n_cards - sim.pos < sim.shuffle_threshold
+        result = sim.play_policy(policy, MAX_RETRIES)
+        for m in np.flatnonzero(shuffled):
+            shoes[m].append(sim.shoes[m].copy())
+        for m in range(n_tables):
+            records[m].append(tuple(x[m].item() for x in result))
+
+    table, shape = policy.tobytes(), policy.shape
+    n_checked, n_mismatches = 0, 0
+    for m in range(n_tables):
+        dealer = replay_dealer(shoes[m])
+        for rec in records[m]:
+            dealer.initialize_game()
+            init_score, first, status, rate, n_retries, doubled = dealer.play_policy_game(table, shape, MAX_RETRIES)
+            got = (init_score, first, STATUS_CODES[status], rate, n_retries, doubled)
+            if got != rec:
+                n_mismatches += 1
+                if n_mismatches <= 5:
+                    print('  mismatch on table {0}: batch={1} dealer={2}'.format(m, rec, got))
+            n_checked += 1
+    return n_checked, n_mismatches
+
+
+def bench(n_tables: int, n_rounds: int, seed: int):
+    policy = make_policy()
+    sim = BatchTables(n_tables, seed=seed)
+    sim.play_policy(policy, MAX_RETRIES)
+    start = time.perf_counter()
+    for _ in range(n_rounds):
+        status = sim.play_policy(policy, MAX_RETRIES)[2]
+    batch_rate = n_tables * n_rounds / (time.perf_counter() - start)
+    assert not (status == UNSETTLED).any()
+
+    dealer = create_dealer(seed=seed)
+    table, shape = policy.tobytes(), policy.shape
+    n_games = 50000
+    start = time.perf_counter()
+    for _ in range(n_games):
+        dealer.initialize_game()
+        dealer.play_policy_game(table, shape, MAX_RETRIES)
+    dealer_rate = n_games / (time.perf_counter() - start)
+    print('throughput: BatchTables {0:,.0f} hands/sec ({1} tables), Dealer.play_policy_game {2:,.0f} hands/sec ({3:.0f}x)'.format(
+        batch_rate, n_tables, dealer_rate, batch_rate / dealer_rate))
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Check batch_sim.BatchTables against dealer.Dealer and measure its throughput')
+    ap.add_argument('--tables', type=int, default=64, help='tables in the conformance check')
+    ap.add_argument('--games', type=int, default=2000, help='games per table in the conformance check')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--skip_check', action='store_true')
+    ap.add_argument('--bench_tables', type=int, default=100000, help='tables in the throughput benchmark (0: skip)')
+    ap.add_argument('--bench_rounds', type=int, default=20, help='games per table in the throughput benchmark')
+    args = ap.parse_args()
+
+    failed = False
+    if not args.skip_check:
+        for name, check in (('random actions', check_actions), ('policy play', check_policy)):
+            n_checked, n_mismatches = check(args.tables, args.games, args.seed)
+            print('{0}: {1} games checked against Dealer, {2} mismatches'.format(name, n_checked, n_mismatches))
+            failed = failed or n_mismatches > 0
+    if args.bench_tables > 0:
+        bench(args.bench_tables, args.bench_rounds, args.seed)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Consistency check for classes.DenseQTable against the dict-backed classes.QTable.
+
+QStateEncoder must reject states outside its shape instead of mapping them onto the edge
+of the grid. DenseQTable keeps such states in its dict fallback (DenseQTable.overflow), so
+it has to behave exactly like QTable for every state, inside the grid or not.
+
+The check drives a QTable and a DenseQTable with the same operations and the same
+tie-breaking random generator seed. States are drawn from a range wider than the grid.
+Every Q-value, every best action (with its value) and the final to_dict() must match.
+The binary file format (qtable_file.write_qtable / load_qtable) must keep the
+out-of-grid entries as well.
+
+Usage:
+    python tools/check_dense_qtable.py
+    python tools/check_dense_qtable.py --steps 200000 --seed 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from classes import Action, DenseQTable, QStateEncoder, QTable
+from qtable_file import load_qtable, write_qtable
+
+SHAPE = (32, 12, 6)
+
+
+def check_encoder():
+    """Out-of-range states must raise; in-range indices must round-trip. Return failures."""
+    encoder = QStateEncoder(*SHAPE)
+    failures = 0
+    for state in [(32, 0, 0), (0, 12, 0), (0, 0, 6), (-1, 0, 0), (0, -1, 0), (0, 0, -1), (40, 20)]:
+        try:
+            encoder.encode(state)
+        except ValueError:
+            continue
+        failures += 1
+        print('  encode{0} did not raise'.format(state))
+    for i in range(encoder.size):
+        if encoder.encode(encoder.decode(i)) != i:
+            failures += 1
+            print('  index {0} does not round-trip'.format(i))
+    return failures
+
+
+def random_state(rng):
+    # about a quarter of the states fall outside the grid in at least one dimension
+    return (int(rng.integers(0, 40)), int(rng.integers(0, 15)), int(rng.integers(0, 8)))
+
+
+def check_tables(n_steps, seed):
+    """Random set/get/best-action operations on both tables; return (operations, mismatches, dense table)."""
+    rng = np.random.default_rng(seed)
+    q_dict = QTable(Action, default_value=0, rng=np.random.default_rng(seed + 1))
+    q_dense = DenseQTable(Action, default_value=0, encoder=QStateEncoder(*SHAPE), rng=np.random.default_rng(seed + 1))
+    actions = q_dict.actions
+    mismatches = 0
+    for step in range(n_steps):
+        state = random_state(rng)
+        op = rng.integers(3)
+        if op == 0:
+            # small integer values so that ties (and the random tie-break) are common
+            action = actions[rng.integers(len(actions))]
+            value = float(rng.integers(-2, 3))
+            q_dict.set_Q_value(state, action, value)
+            q_dense.set_Q_value(state, action, value)
+            continue
+        if op == 1:
+            action = actions[rng.integers(len(actions))]
+            got = (q_dict.get_Q_value(state, action), q_dense.get_Q_value(state, action))
+        else:
+            got = (q_dict.get_best_action(state, with_value=True), q_dense.get_best_action(state, with_value=True))
+        if got[0] != got[1]:
+            mismatches += 1
+            if mismatches <= 5:
+                print('  mismatch at step {0} for state {1}: QTable={2} DenseQTable={3}'.format(step, state, got[0], got[1]))
+    q_dict.materialize_states()
+    q_dense.materialize_states()
+    if q_dict.table != q_dense.to_dict():
+        mismatches += 1
+        print('  to_dict() differs: {0} vs {1} entries'.format(len(q_dict.table), len(q_dense.to_dict())))
+    return n_steps, mismatches, q_dense
+
+
+def check_file(q_dense):
+    """write_qtable / load_qtable must keep every entry, including the out-of-grid ones. Return failures."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'check.qtable')
+        write_qtable(path, q_dense)
+        loaded, _ = load_qtable(path)
+    if loaded.to_dict() != q_dense.to_dict():
+        print('  binary file lost entries: {0} vs {1}'.format(len(loaded.to_dict()), len(q_dense.to_dict())))
+        return 1
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Check DenseQTable (including states outside its encoder) against QTable')
+    ap.add_argument('--steps', type=int, default=100000, help='random operations on each table')
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    failures = check_encoder()
+    print('encoder: {0} failures'.format(failures))
+    n_ops, n_mismatches, q_dense = check_tables(args.steps, args.seed)
+    print('tables: {0} operations compared with QTable, {1} mismatches ({2} out-of-grid entries)'.format(n_ops, n_mismatches, len(q_dense.overflow.table)))
+    n_file = check_file(q_dense)
+    print('binary file: {0} failures'.format(n_file))
+    if failures or n_mismatches or n_file:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Q-update check for grid_trainer.GridTrainer against ai_player_Q.QLearningAgent.
+
+GridTrainer keeps the Q-tables of all grid points in one array whose state range
+(grid_trainer.GRID_SHAPE) covers every reachable state, so hands with more cards than the
+agent's dense grid (ai_player_Q.make_dense_qtable) are learned as states of their own,
+just as the agent keeps them in its dict overflow (DenseQTable.overflow), instead of being
+folded into the edge cell.
+
+The check feeds the same random transitions to GridTrainer.update and to
+QLearningAgent.update (dense backend). About half of the states have hand lengths
+beyond POLICY_N_LENGTHS. The resulting to_dict() tables must be identical, value for
+value. It also checks that GRID_SHAPE holds the longest possible hand and that
+GridTrainer.encode maps long hands to the same index as the agent's state would get.
+
+Usage:
+    python tools/check_grid_trainer.py
+    python tools/check_grid_trainer.py --steps 100000 --seed 3
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from ai_player_Q import QLearningAgent, POLICY_N_LENGTHS, RETRY_BUCKET_MAX
+from classes import CARD_VALUES
+from grid_trainer import GRID_SHAPE, GridTrainer
+
+
+def check_shape():
+    """The smallest cards of the shoe, drawn one by one, must bust within GRID_SHAPE. Return failures."""
+    values = sorted(CARD_VALUES)
+    n = next(i for i in range(len(values)) if sum(values[:i + 1]) > 21) + 1
+    if n >= GRID_SHAPE[1]:
+        print('  longest hand has {0} cards, GRID_SHAPE allows {1}'.format(n, GRID_SHAPE[1] - 1))
+        return 1
+    return 0
+
+
+def check_encode(n_tables, seed):
+    """GridTrainer.encode on long hands must agree with QStateEncoder.encode of the agent's state. Return mismatches."""
+    rng = np.random.default_rng(seed)
+    configs = [{'alpha': 0.1, 'gamma': 0.9, 'eps_start': 0.0, 'eps_end': 0.0, 'eps_decay_type': 'const', 'seed': k} for k in range(n_tables)]
+    trainer = GridTrainer(configs)
+    t = trainer.tables
+    t.p_hard[:] = rng.integers(2, 32, size=n_tables)
+    t.p_aces[:] = rng.integers(0, 3, size=n_tables)
+    t.p_n[:] = rng.integers(2, GRID_SHAPE[1], size=n_tables)
+    t.retries[:] = rng.integers(0, 12, size=n_tables)
+    got = trainer.encode(np.arange(n_tables))
+    n_mismatches = 0
+    for m in range(n_tables):
+        hard, aces = int(t.p_hard[m]), int(t.p_aces[m])
+        score = hard + 10 if aces > 0 and hard <= 11 else hard
+        state = (score, int(t.p_n[m]), min(int(t.retries[m]), RETRY_BUCKET_MAX)) # QLearningAgent.observe
+        n_mismatches += int(got[m]) != trainer.encoder.encode(state)
+    return n_mismatches
+
+
+def random_state(rng):
+    return (int(rng.integers(4, 32)), int(rng.integers(2, GRID_SHAPE[1])), int(rng.integers(0, RETRY_BUCKET_MAX + 1)))
+
+
+def check_updates(n_steps, seed, alpha, gamma):
+    """Return (transitions, out-of-grid transitions, mismatching entries)."""
+    rng = np.random.default_rng(seed)
+    config = {'alpha': alpha, 'gamma': gamma, 'eps_start': 0.0, 'eps_end': 0.0, 'eps_decay_type': 'const', 'seed': seed}
+    trainer = GridTrainer([config])
+    agent = QLearningAgent(alpha=alpha, gamma=gamma, qtable_backend='dense', rng=np.random.default_rng(seed), verbose=False)
+    idx = np.zeros(1, dtype=np.int64)
+    n_outside = 0
+    for _ in range(n_steps):
+        state, next_state = random_state(rng), random_state(rng)
+        j = int(rng.integers(len(trainer.actions)))
+        reward = int(rng.integers(-40, 41))
+        n_outside += state[1] >= POLICY_N_LENGTHS or next_state[1] >= POLICY_N_LENGTHS
+        agent.update(state, trainer.actions[j], reward, next_state)
+        trainer.update(idx, np.array([trainer.encoder.encode(state)]), np.array([j]), np.array([reward]), np.array([trainer.encoder.encode(next_state)]))
+    got, expected = trainer.q_table(0).to_dict(), agent.q_table.to_dict()
+    n_mismatches = len(set(got) ^ set(expected)) + sum(1 for k in set(got) & set(expected) if got[k] != expected[k])
+    return n_steps, n_outside, n_mismatches
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Check GridTrainer Q-updates (including long hands) against QLearningAgent')
+    ap.add_argument('--steps', type=int, default=20000, help='random transitions')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--alpha', type=float, default=0.1)
+    ap.add_argument('--gamma', type=float, default=0.9)
+    args = ap.parse_args()
+
+    failures = check_shape()
+    print('grid shape {0}: {1} failures'.format(GRID_SHAPE, failures))
+    n_encode = check_encode(1000, args.seed)
+    print('encode: 1000 table states, {0} mismatches'.format(n_encode))
+    n_steps, n_outside, n_mismatches = check_updates(args.steps, args.seed, args.alpha, args.gamma)
+    print('updates: {0} transitions ({1} beyond the agent grid), {2} mismatching entries'.format(n_steps, n_outside, n_mismatches))
+    if failures or n_encode or n_mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
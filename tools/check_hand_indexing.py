@@ -0,0 +1,92 @@
+"""Indexing check for classes.Hand and classes.HandView against a plain list.
+
+Hand keeps its cards in a preallocated buffer whose entries past len(hand) still hold
+cards that were popped, cleared or never used. Indexing and slicing must only ever see the
+first len(hand) cards, exactly like a list of the same cards: the same values for every
+index and every slice (including negative and out-of-range bounds and steps), and an
+IndexError for indices outside the hand.
+
+Random append / pop / clear / restore operations are applied to a Hand and to a list, and
+after each one every index in -8..8 and a set of slices are compared through the Hand and
+through its view.
+
+Usage:
+    python tools/check_hand_indexing.py
+    python tools/check_hand_indexing.py --steps 100000 --seed 3
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from classes import Hand
+
+BOUNDS = [None, -9, -3, -1, 0, 1, 2, 5, 9]
+SLICES = [slice(a, b, c) for a in BOUNDS for b in BOUNDS for c in (None, 1, 2, -1, -2)]
+
+
+def lookup(seq, key):
+    try:
+        return seq[key]
+    except IndexError:
+        return IndexError
+
+
+def compare(hand, expected):
+    """Return the number of indices and slices where hand or its view differs from expected."""
+    n_mismatches = 0
+    for key in list(range(-8, 9)) + SLICES:
+        e = lookup(expected, key)
+        for got in (lookup(hand, key), lookup(hand.view(), key)):
+            if got != e:
+                n_mismatches += 1
+                if n_mismatches <= 5:
+                    print('  hand {0} [{1}]: got {2}, expected {3}'.format(expected, key, got, e))
+    return n_mismatches
+
+
+def check(n_steps, seed):
+    """Return (operations, mismatches)."""
+    rng = np.random.default_rng(seed)
+    hand = Hand()
+    expected = []
+    n_mismatches = 0
+    for _ in range(n_steps):
+        op = rng.random()
+        if op < 0.5 or not expected:
+            c = int(rng.integers(0, 104))
+            hand.append(c)
+            expected.append(c)
+        elif op < 0.8:
+            hand.pop()
+            expected.pop()
+        elif op < 0.9:
+            hand.clear()
+            expected.clear()
+        else:
+            state = tuple(int(c) for c in rng.integers(0, 104, size=int(rng.integers(0, 5))))
+            hand.restore(state)
+            expected[:] = state
+        n_mismatches += compare(hand, expected)
+    return n_steps, n_mismatches
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Check Hand indexing and slicing against a plain list')
+    ap.add_argument('--steps', type=int, default=5000, help='random hand operations')
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    n_steps, n_mismatches = check(args.steps, args.seed)
+    print('{0} operations, {1} mismatches'.format(n_steps, n_mismatches))
+    if n_mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
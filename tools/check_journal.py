@@ -0,0 +1,142 @@
+"""Round-trip check for journal.JournalWriter / read_journal.
+
+A GAME record stores its action count and card count in 2 bytes each (journal version 2),
+so games longer than 255 actions or cards must be written and read back unchanged. The
+check writes such games next to ordinary ones and compares what read_journal returns.
+It also checks that:
+  - games written concurrently from several threads are all counted in n_games and all
+    present in the file;
+  - a version 1 journal (1-byte counts) can still be read;
+  - JournalWriter refuses to append to a version 1 journal.
+
+Usage:
+    python tools/check_journal.py
+    python tools/check_journal.py --threads 16 --games 5000
+"""
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import threading
+
+import numpy as np
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from journal import FILE_HEADER, GAME_PAYLOADS, JOURNAL_MAGIC, RECORD_GAME, RECORD_HEADER, JournalWriter, read_journal
+from protocol import STATUS_CODES
+
+N_CARDS = 104
+
+
+def random_game(rng, n_actions, n_cards):
+    actions = bytes(int(a) for a in rng.integers(1, 6, size=n_actions))
+    cards = rng.integers(0, N_CARDS, size=n_cards)
+    return (int(rng.integers(1, 10)), int(rng.integers(1, 100)), int(rng.integers(1, 10000)), int(rng.integers(0, N_CARDS)), actions, cards, 'win', 2.0)
+
+
+def same_game(game, record):
+    stream_id, session_id, game_id, start_pos, actions, cards, status, rate = game
+    return (record.stream_id, record.session_id, record.game_id, record.start_pos, record.status, record.rate) == (stream_id, session_id, game_id, start_pos, status, rate) \
+        and bytes(record.actions) == actions and np.array_equal(record.cards, cards)
+
+
+def check_long_games(tmp, seed):
+    """Games with up to 300 actions / 1000 cards must round-trip. Return (games, failures)."""
+    rng = np.random.default_rng(seed)
+    games = [random_game(rng, n_actions, n_cards) for n_actions, n_cards in [(1, 2), (255, 255), (256, 256), (300, 1000), (0, 0), (3, 4)]]
+    path = os.path.join(tmp, 'long.journal')
+    writer = JournalWriter(path, N_CARDS)
+    for game in games:
+        writer.write_game(*game)
+    writer.close()
+    records = [r for t, r in read_journal(path) if t == RECORD_GAME]
+    failures = 0
+    if len(records) != len(games):
+        failures += 1
+        print('  wrote {0} games, read {1}'.format(len(games), len(records)))
+    for game, record in zip(games, records):
+        if not same_game(game, record):
+            failures += 1
+            print('  game with {0} actions and {1} cards did not round-trip'.format(len(game[4]), len(game[5])))
+    return len(games), failures
+
+
+def check_threads(tmp, seed, n_threads, n_games):
+    """Concurrent write_game calls must all be counted and written. Return (games, failures)."""
+    path = os.path.join(tmp, 'threads.journal')
+    writer = JournalWriter(path, N_CARDS, buffer_size=1 << 10)
+    barrier = threading.Barrier(n_threads)
+
+    def work(k):
+        rng = np.random.default_rng([seed, k])
+        barrier.wait()
+        for _ in range(n_games):
+            writer.write_game(*random_game(rng, 3, 5))
+
+    threads = [threading.Thread(target=work, args=(k,)) for k in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    counted = writer.n_games
+    writer.close()
+    n_read = sum(1 for t, _ in read_journal(path) if t == RECORD_GAME)
+    expected = n_threads * n_games
+    if counted != expected or n_read != expected:
+        print('  {0} games written, n_games {1}, {2} in the file'.format(expected, counted, n_read))
+        return expected, 1
+    return expected, 0
+
+
+def check_version_1(tmp, seed):
+    """A hand-made version 1 journal must be readable, and must not be appended to. Return failures."""
+    rng = np.random.default_rng(seed)
+    game = random_game(rng, 4, 6)
+    stream_id, session_id, game_id, start_pos, actions, cards, status, rate = game
+    payload = GAME_PAYLOADS[1].pack(stream_id, session_id, game_id, start_pos, rate, STATUS_CODES[status], len(actions), len(cards))
+    payload += actions + np.asarray(cards, dtype='>u2').tobytes()
+    path = os.path.join(tmp, 'v1.journal')
+    with open(path, 'wb') as f:
+        f.write(FILE_HEADER.pack(JOURNAL_MAGIC, 1, N_CARDS) + RECORD_HEADER.pack(RECORD_GAME, len(payload)) + payload)
+    failures = 0
+    records = [r for t, r in read_journal(path) if t == RECORD_GAME]
+    if len(records) != 1 or not same_game(game, records[0]):
+        failures += 1
+        print('  version 1 journal was not read back correctly')
+    size = os.path.getsize(path)
+    try:
+        JournalWriter(path, N_CARDS).close()
+        failures += 1
+        print('  JournalWriter appended to a version 1 journal')
+    except ValueError:
+        pass
+    if os.path.getsize(path) != size:
+        failures += 1
+        print('  version 1 journal was modified')
+    return failures
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Check JournalWriter / read_journal round trips')
+    ap.add_argument('--threads', type=int, default=8, help='threads writing games at the same time')
+    ap.add_argument('--games', type=int, default=2000, help='games per thread')
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        n_long, f_long = check_long_games(tmp, args.seed)
+        print('long games: {0} games, {1} failures'.format(n_long, f_long))
+        n_threads, f_threads = check_threads(tmp, args.seed, args.threads, args.games)
+        print('threads: {0} games from {1} threads, {2} failures'.format(n_threads, args.threads, f_threads))
+        f_v1 = check_version_1(tmp, args.seed)
+        print('version 1: {0} failures'.format(f_v1))
+    if f_long or f_threads or f_v1:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
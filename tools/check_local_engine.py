@@ -0,0 +1,96 @@
+"""Seeded regression check for ai_player_Q.py --engine local.
+
+For each seed, ai_player_Q.py is run twice with the same options: once through the
+dealer protocol (--inprocess, i.e. the same Player messages as a socket session, but with
+the dealer in the same process) and once with --engine local, which drives the embedded
+Dealer directly. Both runs draw the same cards and the same random numbers, so the play
+histories must be byte-identical and the saved Q-tables must hold the same values. This
+is done for a training run, a --testmode run on the trained table, and a training run
+with --qtable_backend dense.
+
+The wall time of each run is reported together with the interpreter/import start-up
+time, so the difference is the time spent playing and learning.
+
+Usage:
+    python tools/check_local_engine.py
+    python tools/check_local_engine.py --games 20000 --seeds 1 2 3
+"""
+import argparse
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT) # Q-table pickles refer to classes.Action
+
+AI_PLAYER_Q = os.path.join(ROOT, 'ai_player_Q.py')
+
+
+def run_player(options):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, AI_PLAYER_Q, '--quiet'] + options, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError('ai_player_Q.py {0} failed:\n{1}'.format(' '.join(options), proc.stderr))
+    return time.perf_counter() - start
+
+
+def load_table(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)['table']
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+# runs one configuration through both engines; returns a list of differences (empty if none)
+def check_case(tmp, name, options, save):
+    outputs = {}
+    for engine, engine_options in (('protocol', ['--inprocess']), ('local', ['--engine', 'local'])):
+        history = os.path.join(tmp, '{0}.{1}.csv'.format(name, engine))
+        extra = ['--save', os.path.join(tmp, '{0}.{1}.pkl'.format(name, engine))] if save else []
+        elapsed = run_player(options + engine_options + ['--history', history] + extra)
+        outputs[engine] = history
+        print('  {0:<28} {1:<8} {2:.3f} s'.format(name, engine, elapsed))
+    problems = []
+    if read_bytes(outputs['protocol']) != read_bytes(outputs['local']):
+        problems.append('{0}: play histories differ'.format(name))
+    if save and load_table(os.path.join(tmp, name + '.protocol.pkl')) != load_table(os.path.join(tmp, name + '.local.pkl')):
+        problems.append('{0}: saved Q-tables differ'.format(name))
+    return problems
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Check that ai_player_Q.py --engine local reproduces the protocol path')
+    ap.add_argument('--games', type=int, default=5000, help='games per run')
+    ap.add_argument('--seeds', type=int, nargs='+', default=[7, 11])
+    args = ap.parse_args()
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import ai_player_Q'], cwd=ROOT, check=True)
+    print('start-up (interpreter + imports): {0:.3f} s'.format(time.perf_counter() - start))
+
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for seed in args.seeds:
+            print('seed {0}, {1} games'.format(seed, args.games))
+            base = ['--games', str(args.games), '--seed', str(seed)]
+            problems += check_case(tmp, 'train_{0}'.format(seed), base, save=True)
+            trained = os.path.join(tmp, 'train_{0}.protocol.pkl'.format(seed))
+            problems += check_case(tmp, 'test_{0}'.format(seed), base + ['--testmode', '--load', trained], save=False)
+            problems += check_case(tmp, 'train_dense_{0}'.format(seed), base + ['--qtable_backend', 'dense'], save=True)
+
+    for p in problems:
+        print('MISMATCH ' + p)
+    print('{0} mismatches'.format(len(problems)))
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""Conformance check for dealer.Dealer.rollout.
+
+Dealer.rollout evaluates sequences of the form HIT x k followed by STAND, DOUBLE_DOWN or
+SURRENDER in one pass over the shoe (Dealer.hit_stand_outcomes). It replays any other
+sequence with snapshot/restore. This script checks the fast path against the plain
+reference: restore a snapshot, then call resolve_action for each action until the game is
+settled.
+
+Seeded dealers play G games each. At every decision point of every game, a batch of
+sequences is rolled out:
+  - every HIT x k + STAND / DOUBLE_DOWN / SURRENDER for k = 0..max_hits, given as Action
+    members and as action codes;
+  - random sequences that mix in RETRY, some of them too short to settle the game;
+  - the empty sequence.
+Each (status, rate) must equal the reference result. The dealer's shoe position, hands
+and game ID must be unchanged afterwards. The game then moves on with a random HIT or
+RETRY, or ends. HIT x k + final action sequences are also given as numpy arrays of
+action codes.
+
+The shuffle threshold keeps decision points close to the end of the shoe rare, so the
+fallback path (hit_stand_outcomes returns None and rollout replays every sequence) is
+checked separately: after each game is dealt, its snapshot is restored with the shoe
+position only a few cards before the end (just enough for the longest sequence), and the
+HIT x k + final action sequences are compared with the reference there.
+
+Usage:
+    python tools/check_rollout.py
+    python tools/check_rollout.py --games 5000 --seeds 1 2 3 --max_hits 8
+    python tools/check_rollout.py --games 500 --max_hits 60 --random_sequences 2
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from classes import Action
+from dealer import create_dealer
+
+FINAL_ACTIONS = (Action.STAND, Action.DOUBLE_DOWN, Action.SURRENDER)
+RANDOM_ACTIONS = (Action.HIT, Action.STAND, Action.DOUBLE_DOWN, Action.SURRENDER, Action.RETRY)
+
+
+def make_sequences(rng, max_hits, n_random):
+    sequences = []
+    for k in range(max_hits + 1):
+        for last in FINAL_ACTIONS:
+            sequences.append([Action.HIT] * k + [last])
+            sequences.append([Action.HIT.value] * k + [last.value])
+            sequences.append(np.array([Action.HIT.value] * k + [last.value]))
+    for _ in range(n_random):
+        n = int(rng.integers(1, 7))
+        sequences.append([RANDOM_ACTIONS[i] for i in rng.integers(len(RANDOM_ACTIONS), size=n)])
+    sequences.append([])
+    return sequences
+
+
+def reference(dealer, sequences):
+    """Outcome of each sequence via snapshot/restore + resolve_action."""
+    snap = dealer.snapshot()
+    results = []
+    for seq in sequences:
+        dealer.restore(snap)
+        status, rate = 'unsettled', 0.0
+        for action in seq:
+            status, rate, _, _ = dealer.resolve_action(Action(action))
+            if status != 'unsettled':
+                break
+        results.append((status, rate))
+    dealer.restore(snap)
+    return results
+
+
+def state_of(dealer):
+    return (dealer.card_set.pos, id(dealer.card_set.all_cards), dealer.player_hand.snapshot(), dealer.dealer_hand.snapshot(), dealer.game_ID)
+
+
+def check_near_end(seed, n_games, max_hits):
+    """Return (decision points, mismatches) with the shoe position a few cards from the end."""
+    dealer = create_dealer(seed=seed)
+    rng = np.random.default_rng(seed)
+    n_points, n_mismatches = 0, 0
+    for _ in range(n_games):
+        dealer.initialize_game()
+        snap = dealer.snapshot()
+        # DOUBLE_DOWN after max_hits HITs draws max_hits + 1 cards, the dealer then at most max_cards_per_game - 2
+        n_left = max_hits + 1 + dealer.max_cards_per_game - 2 + int(rng.integers(0, 2))
+        all_cards, _ = snap.card_set
+        dealer.restore(snap._replace(card_set=(all_cards, dealer.card_set.n_cards - n_left)))
+        if dealer.hit_stand_outcomes(max_hits + 1) is not None:
+            n_mismatches += 1
+            print('  seed {0}, game {1}: hit_stand_outcomes did not fall back with {2} cards left'.format(seed, dealer.game_ID, n_left))
+            break
+        sequences = make_sequences(rng, max_hits, 0)
+        before = state_of(dealer)
+        got = dealer.rollout(sequences)
+        if state_of(dealer) != before:
+            n_mismatches += 1
+            print('  seed {0}, game {1}: rollout changed the dealer state near the end of the shoe'.format(seed, dealer.game_ID))
+            break
+        for seq, g, e in zip(sequences, got, reference(dealer, sequences)):
+            if g != e:
+                n_mismatches += 1
+                if n_mismatches <= 5:
+                    print('  seed {0}, game {1}, {2} cards left: {3} -> rollout {4}, reference {5}'.format(
+                        seed, dealer.game_ID, n_left, [Action(a).name for a in seq], g, e))
+        n_points += 1
+        dealer.restore(snap)
+    return n_points, n_mismatches
+
+
+def check_seed(seed, n_games, max_hits, n_random):
+    """Return (decision points, sequences, near-end decision points, mismatches, rollout seconds, reference seconds)."""
+    dealer = create_dealer(seed=seed)
+    rng = np.random.default_rng(seed)
+    n_points, n_sequences, n_near_end, n_mismatches = 0, 0, 0, 0
+    t_rollout, t_reference = 0.0, 0.0
+    for _ in range(n_games):
+        dealer.initialize_game()
+        while True:
+            sequences = make_sequences(rng, max_hits, n_random)
+            before = state_of(dealer)
+            if dealer.card_set.pos + max_hits + 1 + dealer.max_cards_per_game > dealer.card_set.n_cards:
+                n_near_end += 1
+
+            start = time.perf_counter()
+            got = dealer.rollout(sequences)
+            t_rollout += time.perf_counter() - start
+            if state_of(dealer) != before:
+                n_mismatches += 1
+                print('  seed {0}, game {1}: rollout changed the dealer state'.format(seed, dealer.game_ID))
+                break
+            start = time.perf_counter()
+            expected = reference(dealer, sequences)
+            t_reference += time.perf_counter() - start
+
+            for seq, g, e in zip(sequences, got, expected):
+                if g != e:
+                    n_mismatches += 1
+                    if n_mismatches <= 5:
+                        print('  seed {0}, game {1}, pos {2}: {3} -> rollout {4}, reference {5}'.format(
+                            seed, dealer.game_ID, dealer.card_set.pos, [Action(a).name for a in seq], g, e))
+            n_points += 1
+            n_sequences += len(sequences)
+
+            # advance the real game with HIT or RETRY, or stop here
+            if rng.random() < 0.3:
+                break
+            status, _, _, _ = dealer.resolve_action(Action.HIT if rng.random() < 0.7 else Action.RETRY)
+            if status != 'unsettled':
+                break
+    return n_points, n_sequences, n_near_end, n_mismatches, t_rollout, t_reference
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Check Dealer.rollout against snapshot/restore + resolve_action')
+    ap.add_argument('--games', type=int, default=2000, help='games per seed')
+    ap.add_argument('--seeds', type=int, nargs='+', default=[0, 1, 2])
+    ap.add_argument('--max_hits', type=int, default=5, help='largest k in the HIT x k + final action sequences')
+    ap.add_argument('--random_sequences', type=int, default=8, help='random mixed sequences per decision point')
+    args = ap.parse_args()
+
+    total_mismatches = 0
+    for seed in args.seeds:
+        n_points, n_sequences, n_near_end, n_mismatches, t_rollout, t_reference = check_seed(seed, args.games, args.max_hits, args.random_sequences)
+        print('seed {0}: {1} decision points ({2} near the end of the shoe), {3} sequences, {4} mismatches; rollout {5:.3f} s, reference {6:.3f} s'.format(
+            seed, n_points, n_near_end, n_sequences, n_mismatches, t_rollout, t_reference))
+        total_mismatches += n_mismatches
+        n_points, n_mismatches = check_near_end(seed, args.games, args.max_hits)
+        print('seed {0}: {1} decision points a few cards from the end of the shoe, {2} mismatches'.format(seed, n_points, n_mismatches))
+        total_mismatches += n_mismatches
+    print('{0} mismatches'.format(total_mismatches))
+    if total_mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
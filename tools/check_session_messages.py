@@ -0,0 +1,106 @@
+"""Message-count check for the text protocol's session options.
+
+A Player with session options (a shoe seed and/or a table) must send them only with the
+first game of a connection: 'ack,<options>' followed by the plain 'ack' for the corrected
+shuffle notice. Later games on the same connection must answer the shuffle notice with a
+single 'ack', since the dealer ignores options after the first game.
+
+The dealer side is dealer.serve_player on one end of a socket pair; the player side is a
+classes.Player on the other end, whose socket records every message it sends. The player
+plays G games with STAND and the recorded messages are compared with the expected
+sequence. A second connection with the same Player must send the options again.
+
+Usage:
+    python tools/check_session_messages.py
+    python tools/check_session_messages.py --games 5
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from classes import Player
+from config import INITIAL_MONEY, BET
+from dealer import PlayerSession, serve_player
+
+
+class RecordingSocket:
+    """Socket wrapper that records every message the player sends."""
+
+    def __init__(self, soc):
+        self.soc = soc
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(bytes(data))
+        return self.soc.send(data)
+
+    def recv(self, n):
+        return self.soc.recv(n)
+
+    def close(self):
+        self.soc.close()
+
+
+def play_connection(player, n_games):
+    """Play n_games with STAND on a new connection; return the messages the player sent."""
+    dealer_end, player_end = socket.socketpair()
+    server = threading.Thread(target=serve_player, args=(dealer_end, PlayerSession()), daemon=True)
+    server.start()
+    soc = RecordingSocket(player_end)
+    for n in range(n_games):
+        if n > 0:
+            player.request_next_game(soc)
+        player.set_bet()
+        player.receive_card_shuffle_status(soc)
+        player.receive_init_cards(soc)
+        player.send_message(soc, 'stand')
+        _, _, rate, _ = player.receive_message(soc, get_dealer_cards=True)
+        player.update_money(rate=rate)
+    soc.close()
+    server.join(timeout=5)
+    dealer_end.close()
+    return soc.sent
+
+
+def expected_messages(options, n_games):
+    expected = []
+    for n in range(n_games):
+        if n > 0:
+            expected.append(b'next')
+        if n == 0 and options:
+            expected.append(b'ack,' + options.encode('utf-8'))
+        expected += [b'ack', b'stand']
+    return expected
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Check that session options are sent only with the first game of a connection')
+    ap.add_argument('--games', type=int, default=2, help='games per connection')
+    ap.add_argument('--seed', type=int, default=5)
+    args = ap.parse_args()
+
+    player = Player(initial_money=INITIAL_MONEY, basic_bet=BET)
+    player.set_shoe_seed(args.seed)
+    options = 'seed={0}'.format(args.seed)
+    failed = False
+    for connection in (1, 2):
+        sent = play_connection(player, args.games)
+        expected = expected_messages(options, args.games)
+        ok = sent == expected
+        print('connection {0}: {1} messages over {2} games ({3})'.format(connection, len(sent), args.games, 'ok' if ok else 'MISMATCH'))
+        if not ok:
+            print('  sent:     {0}'.format(sent))
+            print('  expected: {0}'.format(expected))
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
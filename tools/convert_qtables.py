@@ -0,0 +1,70 @@
+"""Convert pickled Q-tables to the binary Q-table format (qtable_file.py).
+
+Accepts both pickle layouts in use: the legacy bare dict {(state, Action): q} and the
+{'meta': ..., 'table': ...} dict that ai_player_Q.py --save writes. 2-element states
+(score, hand_length) become retry bucket 0. The state grid is sized to hold every state in
+the table without clipping. Each output is written next to its input with the .qtable
+suffix (or under --out_dir), and is checked to read back to the same dict.
+Files that cannot be unpickled (for example git-lfs pointers) are reported and skipped.
+
+Usage:
+    python tools/convert_qtables.py q_table.pkl
+    python tools/convert_qtables.py 'logs/**/qtables/*.pkl' --out_dir converted
+"""
+import argparse
+import glob
+import os
+import sys
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from qtable_file import QTABLE_SUFFIX, dense_from_dict, load_table_dict, open_qtable, write_qtable
+
+
+def convert(path: str, out_path: str):
+    table, meta = load_table_dict(path)
+    table = {((k[0][0], k[0][1], 0) if len(k[0]) == 2 else k[0], k[1]): v for k, v in table.items()}
+    write_qtable(out_path, dense_from_dict(table), meta)
+    back, _ = open_qtable(out_path)
+    if back.to_dict() != {k: float(v) for k, v in table.items()}:
+        raise ValueError('{0}: converted table does not read back to the original'.format(out_path))
+    return len(table)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Convert pickled Q-tables to the binary Q-table format')
+    ap.add_argument('inputs', nargs='+', help='pickle files or glob patterns (quote patterns containing **)')
+    ap.add_argument('--out_dir', type=str, default='', help='write converted files here instead of next to the inputs')
+    ap.add_argument('--overwrite', action='store_true', help='convert even if the output file already exists')
+    args = ap.parse_args()
+
+    paths = []
+    for pattern in args.inputs:
+        paths += sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+
+    n_done, n_skipped, n_failed = 0, 0, 0
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0] + QTABLE_SUFFIX
+        out_path = os.path.join(args.out_dir, name) if args.out_dir else os.path.join(os.path.dirname(path), name)
+        if os.path.exists(out_path) and not args.overwrite:
+            n_skipped += 1
+            continue
+        if args.out_dir:
+            os.makedirs(args.out_dir, exist_ok=True)
+        try:
+            n_entries = convert(path, out_path)
+        except Exception as e:
+            print('FAILED {0}: {1}'.format(path, e))
+            n_failed += 1
+            continue
+        print('{0} -> {1} ({2} entries)'.format(path, out_path, n_entries))
+        n_done += 1
+    print('converted={0} skipped={1} failed={2}'.format(n_done, n_skipped, n_failed))
+    if n_failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
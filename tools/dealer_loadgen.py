@@ -0,0 +1,250 @@
+"""Load generator / capacity benchmark for dealer.py.
+
+Opens N concurrent simulated players over the real wire protocol (text or binary, TCP or
+Unix domain socket) and ramps N through --levels. Every player uses a fixed cheap strategy
+(HIT below 17, otherwise STAND) and keeps one session open, playing games back to back
+(use --session_games 1 against `--mode single`, which serves one connection at a time).
+Players are spread over --procs client processes, each running an asyncio event loop.
+
+For every concurrency level it reports games/sec, p50/p99 per-action round-trip latency and
+connection failures, writes them to a CSV and (when matplotlib is available) plots them.
+
+Usage:
+    python dealer.py --mode async --workers 4 &
+    python tools/dealer_loadgen.py --levels 1,2,4,8,16,32,64 --duration 5 --out loadgen.csv --plot loadgen.png
+"""
+import argparse
+import asyncio
+import csv
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from classes import Hand
+from config import PORT
+from protocol import FRAME_GAME, FRAME_RESULT, FRAME_QUIT, FrameBuffer, encode_hello, encode_frame, encode_command, decode_game, decode_result
+
+
+class Stats:
+    def __init__(self):
+        self.games = 0
+        self.latencies = []
+        self.connect_failures = 0
+        self.errors = 0
+
+
+class TextConn:
+    """One player connection speaking the text protocol (one message per read)."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def recv(self):
+        data = await self.reader.read(1024)
+        if not data:
+            raise ConnectionError('connection closed by the dealer')
+        return data.decode('utf-8')
+
+    async def start_game(self, first: bool):
+        if not first:
+            self.writer.write(b'next')
+        await self.recv()  # shuffled,yes/no
+        self.writer.write(b'ack')
+        dc, pc1, pc2 = (int(x) for x in (await self.recv()).split(','))
+        return pc1, pc2
+
+    async def act(self, cmd: str):
+        self.writer.write(bytes(cmd, 'utf-8'))
+        fields = (await self.recv()).split(',')
+        if cmd == 'hit':
+            fields = fields[1:]
+        return int(fields[0]), fields[1]
+
+    def close(self):
+        self.writer.close()
+
+
+class BinaryConn:
+    """One player connection speaking the binary frame protocol (protocol.py)."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.rbuf = FrameBuffer()
+
+    async def recv_frame(self, frame_type: int):
+        while not self.rbuf.has_frame():
+            data = await self.reader.read(4096)
+            if not data:
+                raise ConnectionError('connection closed by the dealer')
+            self.rbuf.feed(data)
+        t, payload = self.rbuf.next_frame()
+        if t != frame_type:
+            raise ConnectionError('unexpected frame type {0}'.format(t))
+        return payload
+
+    async def start_game(self, first: bool):
+        if first:
+            data = await self.reader.read(1024)  # the first shuffle notice is always text
+            if not data:
+                raise ConnectionError('connection closed by the dealer')
+            self.writer.write(encode_hello())
+        else:
+            self.writer.write(encode_command('next'))
+        shuffled, dc, pc1, pc2 = decode_game(await self.recv_frame(FRAME_GAME))
+        return pc1, pc2
+
+    async def act(self, cmd: str):
+        self.writer.write(encode_command(cmd))
+        player_card, score, status, rate, dealer_cards = decode_result(await self.recv_frame(FRAME_RESULT))
+        return score, status
+
+    def close(self):
+        try:
+            self.writer.write(encode_frame(FRAME_QUIT))
+        except Exception:
+            pass
+        self.writer.close()
+
+
+async def play_session(args, deadline: float, stats: Stats):
+    """Connect once and play games until the deadline (or --session_games games)."""
+    try:
+        if args.uds:
+            opener = asyncio.open_unix_connection(args.uds)
+        else:
+            opener = asyncio.open_connection(args.host, args.port)
+        reader, writer = await asyncio.wait_for(opener, args.connect_timeout)
+    except (OSError, asyncio.TimeoutError):
+        stats.connect_failures += 1
+        await asyncio.sleep(0.05)
+        return
+    conn = BinaryConn(reader, writer) if args.protocol == 'binary' else TextConn(reader, writer)
+    try:
+        n = 0
+        while time.time() < deadline:
+            pc1, pc2 = await conn.start_game(n == 0)
+            hand = Hand()
+            hand.append(pc1)
+            hand.append(pc2)
+            score = hand.get_score()
+            while True:
+                cmd = 'hit' if score < 17 else 'stand'
+                t0 = time.perf_counter()
+                score, status = await conn.act(cmd)
+                stats.latencies.append(time.perf_counter() - t0)
+                if status != 'unsettled':
+                    break
+            stats.games += 1
+            n += 1
+            if args.session_games and n >= args.session_games:
+                break
+    except (ConnectionError, OSError, ValueError, IndexError):
+        stats.errors += 1
+    finally:
+        conn.close()
+
+
+async def run_players(args, n_players: int, deadline: float, stats: Stats):
+    async def player():
+        while time.time() < deadline:
+            await play_session(args, deadline, stats)
+
+    try:
+        await asyncio.wait_for(asyncio.gather(*(player() for _ in range(n_players))), max(0.0, deadline - time.time()) + 1.0)
+    except asyncio.TimeoutError:
+        pass  # players still waiting on the dealer at the end of the level
+
+
+def run_client_process(args, n_players: int, start_at: float):
+    """Entry point of one client process; returns its raw measurements."""
+    stats = Stats()
+    if n_players > 0:
+        time.sleep(max(0.0, start_at - time.time()))
+        asyncio.run(run_players(args, n_players, start_at + args.duration, stats))
+    return stats.games, stats.latencies, stats.connect_failures, stats.errors
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Ramp concurrent simulated players against dealer.py and measure capacity')
+    ap.add_argument('--host', type=str, default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=PORT)
+    ap.add_argument('--uds', type=str, default='', help='connect through this Unix domain socket path instead of TCP')
+    ap.add_argument('--protocol', choices=['text', 'binary'], default='binary')
+    ap.add_argument('--levels', type=str, default='1,2,4,8,16,32', help='comma-separated concurrency levels')
+    ap.add_argument('--duration', type=float, default=5.0, help='seconds per level')
+    ap.add_argument('--procs', type=int, default=min(4, os.cpu_count() or 1), help='client processes the players are spread over')
+    ap.add_argument('--session_games', type=int, default=0, help='reconnect after this many games (0: one session per player for the whole level)')
+    ap.add_argument('--connect_timeout', type=float, default=2.0)
+    ap.add_argument('--out', type=str, default='dealer_loadgen.csv', help='CSV output')
+    ap.add_argument('--plot', type=str, default='', help='PNG output (requires matplotlib)')
+    args = ap.parse_args()
+
+    levels = [int(x) for x in args.levels.split(',') if x.strip()]
+    rows = []
+    with multiprocessing.Pool(args.procs) as pool:
+        for level in levels:
+            per_proc = [level // args.procs + (1 if i < level % args.procs else 0) for i in range(args.procs)]
+            start_at = time.time() + 0.5
+            results = pool.starmap(run_client_process, [(args, n, start_at) for n in per_proc])
+            games = sum(r[0] for r in results)
+            lat = np.array([x for r in results for x in r[1]]) * 1e6
+            row = {
+                'concurrency': level,
+                'games': games,
+                'games_per_sec': round(games / args.duration, 1),
+                'actions': len(lat),
+                'action_p50_us': round(float(np.percentile(lat, 50)), 1) if len(lat) else '',
+                'action_p99_us': round(float(np.percentile(lat, 99)), 1) if len(lat) else '',
+                'connect_failures': sum(r[2] for r in results),
+                'errors': sum(r[3] for r in results),
+            }
+            rows.append(row)
+            print('concurrency={concurrency} games/s={games_per_sec} p50={action_p50_us}us p99={action_p99_us}us '
+                  'connect_failures={connect_failures} errors={errors}'.format(**row), flush=True)
+
+    with open(args.out, 'w', newline='', encoding='utf-8') as f:
+        w = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        w.writeheader()
+        w.writerows(rows)
+    print('Wrote', args.out)
+
+    if args.plot:
+        try:
+            import matplotlib
+            matplotlib.use('Agg')
+            import matplotlib.pyplot as plt
+        except ImportError:
+            print('matplotlib is not available; skipped the plot.')
+            return
+        x = [r['concurrency'] for r in rows]
+        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(11, 4))
+        ax1.plot(x, [r['games_per_sec'] for r in rows], marker='o')
+        ax1.set_xscale('log', base=2)
+        ax1.set_xlabel('concurrent players')
+        ax1.set_ylabel('games / sec')
+        ax1.grid(True, alpha=0.3)
+        ax2.plot(x, [r['action_p50_us'] or np.nan for r in rows], marker='o', label='p50')
+        ax2.plot(x, [r['action_p99_us'] or np.nan for r in rows], marker='o', label='p99')
+        ax2.set_xscale('log', base=2)
+        ax2.set_yscale('log')
+        ax2.set_xlabel('concurrent players')
+        ax2.set_ylabel('per-action latency (us)')
+        ax2.legend()
+        ax2.grid(True, alpha=0.3)
+        fig.suptitle('dealer capacity ({0}, {1})'.format('uds' if args.uds else 'tcp', args.protocol))
+        fig.tight_layout()
+        fig.savefig(args.plot, dpi=120)
+        print('Wrote', args.plot)
+
+
+if __name__ == '__main__':
+    main()
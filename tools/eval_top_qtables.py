@@ -17,13 +17,13 @@ def qtable_from_history_path(history_path: str) -> Path:
     stem = stem.replace('.history', '')  # -> hparam_a0.1_...
     run_dir = ROOT / 'logs' / stem
     qdir = run_dir / 'qtables'
-    # qtable file example: a0.1_g0.98_s0.5_e0.01_dexp_seed3.pkl
-    candidate = stem.replace('hparam_', '') + '.pkl'
-    qpath = qdir / candidate
-    if qpath.exists():
-        return qpath
-    # fallback: pick first .pkl under qtables
-    pkls = list(qdir.glob('*.pkl'))
+    # qtable file example: a0.1_g0.98_s0.5_e0.01_dexp_seed3.pkl (or .qtable after tools/convert_qtables.py)
+    for suffix in ('.qtable', '.pkl'):
+        qpath = qdir / (stem.replace('hparam_', '') + suffix)
+        if qpath.exists():
+            return qpath
+    # fallback: pick first .qtable / .pkl under qtables
+    pkls = list(qdir.glob('*.qtable')) or list(qdir.glob('*.pkl'))
     if pkls:
         return pkls[0]
     raise FileNotFoundError(f'QTable not found under {qdir}')
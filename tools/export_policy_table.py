@@ -42,6 +42,11 @@ def load_qtable(path: str) -> Dict[Any, Any]:
     proj_root = os.path.dirname(os.path.dirname(__file__))
     if proj_root not in sys.path:
         sys.path.append(proj_root)
+    from qtable_file import is_qtable_file, load_table_dict
+    if is_qtable_file(path):
+        # binary Q-table (qtable_file.py): same shape as the pickles ai_player_Q writes with meta
+        table, meta = load_table_dict(path)
+        return {'meta': meta, 'table': table}
     with open(path, 'rb') as f:
         return pickle.load(f)
 
@@ -81,7 +86,7 @@ def export_policy(qtable: Dict[Any, Any], method: str, param: float, out_csv: st
 
 def main():
     parser = argparse.ArgumentParser(description='Export probabilistic policy table from Q-table')
-    parser.add_argument('--qtable', type=str, default='', help='Path to qtable .pkl; if empty, auto-pick latest in logs/**/qtables')
+    parser.add_argument('--qtable', type=str, default='', help='Path to qtable .pkl or .qtable; if empty, auto-pick latest in logs/**/qtables')
     parser.add_argument('--method', type=str, choices=['softmax', 'epsilon_greedy'], default='softmax')
     parser.add_argument('--param', type=float, default=0.5, help='temperature for softmax or epsilon for epsilon_greedy')
     parser.add_argument('--out', type=str, default='policy_table.csv', help='Output CSV path')
@@ -93,6 +98,7 @@ def main():
         for pattern in [
             os.path.join('logs', '**', 'qtables', '*.pkl'),
             os.path.join('**', 'qtables', '*.pkl'),
+            os.path.join('**', 'qtables', '*.qtable'),
         ]:
             candidates += glob.glob(pattern, recursive=True)
         if not candidates:
@@ -100,6 +106,8 @@ def main():
         qtable_path = max(candidates, key=os.path.getmtime)
 
     qtable = load_qtable(qtable_path)
+    if isinstance(qtable, dict) and 'table' in qtable:
+        qtable = qtable['table']
     export_policy(qtable, method=args.method, param=args.param, out_csv=args.out)
     print(f'Exported policy to {args.out} (method={args.method}, param={args.param}, qtable={qtable_path})')
 
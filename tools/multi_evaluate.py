@@ -1,14 +1,18 @@
 import argparse
 import csv
+import os
 import subprocess
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from statistics import mean, pstdev
 
 THIS_PY = Path(__file__).resolve()
 ROOT = THIS_PY.parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
 
 
 def summarize_history(path: Path):
@@ -53,24 +57,35 @@ def summarize_history(path: Path):
     }
 
 
-def run_once(python_exe: str, qtable: Path, games: int, out_hist: Path):
+def run_once(python_exe: str, qtable: Path, games: int, out_hist: Path, shm_name: str = ''):
     cmd = [
         python_exe,
         str(ROOT / 'ai_player_Q.py'),
         '--games', str(games),
         '--testmode',
-        '--load', str(qtable),
         '--history', str(out_hist),
     ]
+    # attach to the shared-memory table instead of loading a private copy
+    cmd += ['--qtable_shm', shm_name] if shm_name else ['--load', str(qtable)]
     return subprocess.run(cmd, cwd=str(ROOT)).returncode
 
 
+def publish_table(qtable: Path, shm_name: str):
+    from qtable_file import dense_from_dict, load_table_dict
+    from shared_qtable import SharedQTable
+    table, meta = load_table_dict(str(qtable))
+    table = {((k[0][0], k[0][1], 0) if len(k[0]) == 2 else k[0], k[1]): v for k, v in table.items()}
+    return SharedQTable.create(shm_name, dense_from_dict(table), meta)
+
+
 def main():
     p = argparse.ArgumentParser()
     p.add_argument('--load', required=True, help='Path to QTable .pkl')
     p.add_argument('--games', type=int, default=1000)
     p.add_argument('--repeats', type=int, default=5)
     p.add_argument('--outdir', default=None, help='Output dir for histories and summary')
+    p.add_argument('--workers', type=int, default=1, help='Number of repeats to run at the same time')
+    p.add_argument('--shared', action='store_true', help='Publish the QTable once in shared memory and let every repeat attach to it read-only')
     args = p.parse_args()
 
     qtable = Path(args.load).resolve()
@@ -85,15 +100,28 @@ def main():
     python_exe = sys.executable
     per_run = []
 
-    for i in range(1, args.repeats + 1):
+    shared = publish_table(qtable, f'bjq_eval_{os.getpid()}') if args.shared else None
+    shm_name = shared.name if shared is not None else ''
+
+    def run_repeat(i: int):
         hist = outdir / f'run_{i:02d}.history.csv'
         print(f'=== Repeat {i}/{args.repeats}: games={args.games}, history={hist.name} ===')
-        rc = run_once(python_exe, qtable, args.games, hist)
+        rc = run_once(python_exe, qtable, args.games, hist, shm_name)
         if rc != 0:
             print(f'Run {i} failed with exit code {rc}')
         time.sleep(0.2)  # small stagger
+        return hist
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as ex:
+            hists = list(ex.map(run_repeat, range(1, args.repeats + 1)))
+    finally:
+        if shared is not None:
+            shared.close()
+
+    for i, hist in enumerate(hists, start=1):
         stats = summarize_history(hist)
-        print(f"  -> games={stats['games']}, win_rate={stats['win_rate']:.3f}, avg_reward={stats['avg_reward']:.3f}")
+        print(f"  run {i} -> games={stats['games']}, win_rate={stats['win_rate']:.3f}, avg_reward={stats['avg_reward']:.3f}")
         per_run.append(stats)
 
     # aggregate
@@ -0,0 +1,71 @@
+"""Replay a dealer journal (dealer.py --journal) without any sockets.
+
+By default every recorded game is re-driven through Dealer with the recorded actions and
+checked against the recorded cards, status and payout. With --qtable the same games (same
+shoes, same starting positions) are re-played with that Q-table's greedy policy, and the
+result is compared with what the recorded player earned.
+
+Usage:
+    python tools/replay_journal.py run.journal
+    python tools/replay_journal.py run.journal.0 run.journal.1 --qtable q_table.pkl
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from classes import Action
+from config import BET
+from dealer import create_dealer
+from journal import replay_verify, replay_policy
+import ai_player_Q
+
+
+# 1ゲームの獲得金額（RETRYペナルティは含めない）
+def game_reward(rate: float, doubled: bool):
+    bet = BET * (2 if doubled else 1)
+    return int(bet * rate) - bet
+
+
+def load_policy(path: str):
+    from tools.export_policy_table import load_qtable
+    loaded = load_qtable(path)
+    table = loaded['table'] if isinstance(loaded, dict) and 'table' in loaded else loaded
+    agent = ai_player_Q.QLearningAgent()
+    agent.q_table.table = {((k[0][0], k[0][1], 0), k[1]) if len(k[0]) == 2 else k: v for k, v in table.items()}
+    return agent.make_policy_table()
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Verify or re-score games recorded in a dealer journal')
+    ap.add_argument('journals', nargs='+', help='journal files written by dealer.py --journal')
+    ap.add_argument('--qtable', type=str, default='', help='re-play the recorded shoes with the greedy policy of this Q-table')
+    ap.add_argument('--max_retries', type=int, default=ai_player_Q.RETRY_MAX, help='RETRY cap per game when re-playing with --qtable')
+    ap.add_argument('--seed', type=int, default=0, help='seed for random actions in states the policy does not cover')
+    args = ap.parse_args()
+
+    policy = load_policy(args.qtable) if args.qtable else None
+    for path in args.journals:
+        dealer = create_dealer(seed=args.seed)
+        start = time.perf_counter()
+        n_games, n_mismatches = replay_verify(path, dealer)
+        elapsed = time.perf_counter() - start
+        print('{0}: {1} games replayed, {2} mismatches ({3:.0f} games/sec)'.format(path, n_games, n_mismatches, n_games / max(elapsed, 1e-9)))
+
+        if policy is not None:
+            results = replay_policy(path, create_dealer(seed=args.seed), policy, args.max_retries)
+            if not results:
+                continue
+            recorded = sum(game_reward(g.rate, Action.DOUBLE_DOWN.value in g.actions) for g, r in results)
+            replayed = sum(game_reward(r[3], r[5]) for g, r in results)
+            wins = sum(1 for g, r in results if r[2] == 'win')
+            print('  recorded policy: {0:+.3f} $/game'.format(recorded / len(results)))
+            print('  {0}: {1:+.3f} $/game, win rate {2:.3f} ({3} games)'.format(os.path.basename(args.qtable), replayed / len(results), wins / len(results), len(results)))
+
+
+if __name__ == '__main__':
+    main()